@@ -0,0 +1,195 @@
+import os
+import sys
+
+from flask import Blueprint, Response, abort, jsonify, request
+
+# The recommender lives with the Textual app and shares its catalog and user database
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main-program', 'new'))
+import recommender
+import snapshot
+import user_store
+from cache import preferences_fingerprint
+from preference_options import GENRE_BITS, canonical_preferences
+
+from auth import current_user
+
+# JSON recommendation endpoints for signed-in users
+#
+# GET  /api/recommendations          the user's stored preferences, or overrides in the query string
+# POST /api/recommendations/batch    several preference sets in one request
+#
+# Rankings go through the recommender's shared cache. Responses carry an ETag
+# built from the catalog version and the preference fingerprint (plus the page),
+# so a conditional GET that still matches gets a 304 before anything is ranked.
+
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+RESULT_LIMIT = 500  # Deepest result reachable by paging
+RANK_BUCKET = 50  # Rankings are computed in multiples of this, so nearby pages share a cache entry
+MAX_BATCH = 100
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+def get_catalog():
+    """The newest generation of the shared catalog snapshot, every worker process maps the same file"""
+    return snapshot.default_handle().current()
+
+
+def bad_request(message):
+    response = jsonify(error=message)
+    response.status_code = 400
+    abort(response)
+
+
+def _int(value, name):
+    if isinstance(value, bool):
+        bad_request(f'{name} must be an integer')
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        bad_request(f'{name} must be an integer')
+
+
+def parse_preferences(source, defaults=None):
+    """Preference dict from query arguments or a JSON object, unset keys fall back to defaults"""
+    preferences = dict(defaults or {})
+    is_args = hasattr(source, 'getlist')
+
+    genres = source.getlist('genre') if is_args else source.get('genre')
+    if isinstance(genres, str):
+        genres = [genres]
+    if genres is not None and not (isinstance(genres, list) and all(isinstance(genre, str) for genre in genres)):
+        bad_request('genre must be a list of genre names')
+    if genres:
+        genres = [genre for value in genres for genre in str(value).split(',') if genre]
+        unknown = [genre for genre in genres if genre not in GENRE_BITS]
+        if unknown:
+            bad_request(f'Unknown genres: {", ".join(unknown)}')
+        preferences['genre'] = genres
+
+    release_range = source.get('release_range')
+    if release_range is not None and not isinstance(release_range, (str, list)):
+        bad_request('release_range must be two years, e.g. 1990-2005')
+    if release_range:
+        parts = release_range.split('-') if isinstance(release_range, str) else release_range
+        if len(parts) != 2:
+            bad_request('release_range must be two years, e.g. 1990-2005')
+        start, end = (_int(part, 'release_range') for part in parts)
+        if start > end:
+            bad_request('release_range starts after it ends')
+        preferences['release_range'] = (start, end)
+
+    for name in ('number_of_players', 'length'):
+        if source.get(name) not in (None, ''):
+            value = _int(source.get(name), name)
+            if value <= 0:
+                bad_request(f'{name} must be positive')
+            preferences[name] = value
+    return preferences
+
+
+def stored_preferences(user):
+    """Preferences saved for the signed-in user, matched on email and then Auth0 user id"""
+    store = user_store.default_store()
+    for username in (user.get('email'), user.get('sub')):
+        account = store.get(username) if username else None
+        if account is not None:
+            return dict(account.preferences)
+    return {}
+
+
+def rank_depth(needed):
+    return min(RESULT_LIMIT, -(-needed // RANK_BUCKET) * RANK_BUCKET)
+
+
+def serialize(games, rows, scores, first_rank=1):
+    return [
+        {
+            'rank': first_rank + i,
+            'title': games.title(int(row)),
+            'genres': games.genres(int(row)),
+            'release_year': int(games.release_year[row]),
+            'players': int(games.players[row]),
+            'length_hours': round(float(games.length[row]), 1),
+            'score': round(float(score), 4),
+        }
+        for i, (row, score) in enumerate(zip(rows, scores))
+    ]
+
+
+def cacheable(response, etag):
+    # Personal to the signed-in user, but the ETag lets the browser revalidate cheaply
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+async def signed_in_user():
+    user = await current_user()
+    if not user:
+        response = jsonify(error='Sign in first')
+        response.status_code = 401
+        abort(response)
+    return user
+
+
+@api.route('/recommendations')
+async def recommendations():
+    """One page of recommendations for the user's preferences, with query string overrides"""
+    user = await signed_in_user()
+    page = _int(request.args.get('page', 1), 'page')
+    page_size = _int(request.args.get('page_size', PAGE_SIZE), 'page_size')
+    if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+        bad_request(f'page must be at least 1 and page_size between 1 and {MAX_PAGE_SIZE}')
+    start = (page - 1) * page_size
+    if start >= RESULT_LIMIT:
+        bad_request(f'Only the first {RESULT_LIMIT} results can be paged through')
+
+    games = get_catalog()
+    preferences = canonical_preferences(parse_preferences(request.args, stored_preferences(user))).as_preferences()
+    fingerprint = preferences_fingerprint(preferences)
+    etag = f'{games.version[:16]}-{fingerprint}-{page}-{page_size}'
+    if etag in request.if_none_match:
+        return cacheable(Response(status=304), etag)
+
+    end = min(start + page_size, RESULT_LIMIT)
+    rows, scores = recommender.rank_cached(games, preferences, rank_depth(end))
+    response = jsonify(
+        page=page,
+        page_size=page_size,
+        has_more=len(rows) > end,
+        catalog_version=games.version,
+        fingerprint=fingerprint,
+        results=serialize(games, rows[start:end], scores[start:end], start + 1),
+    )
+    return cacheable(response, etag)
+
+
+@api.route('/recommendations/batch', methods=['POST'])
+async def recommendations_batch():
+    """Top results for each of several preference sets: {"preferences": [...], "limit": 10}"""
+    await signed_in_user()
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('preferences'), list):
+        bad_request('Expected a JSON object with a "preferences" list')
+    sets = body['preferences']
+    if len(sets) > MAX_BATCH:
+        bad_request(f'At most {MAX_BATCH} preference sets per request')
+    limit = _int(body.get('limit', PAGE_SIZE), 'limit')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        bad_request(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    games = get_catalog()
+    results = []
+    ranked = {}  # Identical preference sets in one batch are ranked once
+    for item in sets:
+        if not isinstance(item, dict):
+            bad_request('Each preference set must be a JSON object')
+        preferences = canonical_preferences(parse_preferences(item)).as_preferences()
+        fingerprint = preferences_fingerprint(preferences)
+        if fingerprint not in ranked:
+            rows, scores = recommender.rank_cached(games, preferences, rank_depth(limit))
+            ranked[fingerprint] = serialize(games, rows[:limit], scores[:limit])
+        results.append({'fingerprint': fingerprint, 'results': ranked[fingerprint]})
+    return jsonify(catalog_version=games.version, results=results)
@@ -1,6 +1,8 @@
 import os
 from flask import Flask, redirect, render_template, request, url_for, g
-from auth import auth0
+from api import api
+from auth0_server_python.error import BackchannelLogoutError
+from auth import auth0, backchannel_logout, current_user, forget_session
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,6 +17,8 @@ app.config.update(
     SESSION_COOKIE_SAMESITE='Lax',
 )
 
+app.register_blueprint(api)
+
 @app.before_request
 def store_request_response():
     """Make request/response available for Auth0 SDK"""
@@ -23,7 +27,7 @@ def store_request_response():
 @app.route('/')
 async def index():
     """Home page - shows login button or user profile"""
-    user = await auth0.get_user(g.store_options)
+    user = await current_user()
     return render_template('index.html', user=user)
 
 @app.route('/login')
@@ -37,6 +41,7 @@ async def callback():
     """Handle Auth0 callback after login"""
     try:
         result = await auth0.complete_interactive_login(str(request.url), g.store_options)
+        forget_session()
         return redirect(url_for('index'))
     except Exception as e:
         return f"Authentication error: {str(e)}", 400
@@ -44,7 +49,7 @@ async def callback():
 @app.route('/profile')
 async def profile():
     """Protected route - shows user profile"""
-    user = await auth0.get_user(g.store_options)
+    user = await current_user()
     
     if not user:
         return redirect(url_for('login'))
@@ -54,8 +59,18 @@ async def profile():
 @app.route('/logout')
 async def logout():
     """Logout and redirect to Auth0 logout"""
+    forget_session()
     logout_url = await auth0.logout(g.store_options)
     return redirect(logout_url)
 
+@app.route('/backchannel-logout', methods=['POST'])
+async def backchannel_logout_route():
+    """Auth0 ends sessions here when the user logs out elsewhere"""
+    try:
+        await backchannel_logout(request.form.get('logout_token', ''))
+    except BackchannelLogoutError as e:
+        return f"Backchannel logout error: {str(e)}", 400
+    return '', 204
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
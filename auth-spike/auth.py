@@ -1,46 +1,24 @@
 import os
+import jwt
+from flask import g, session
 from auth0_server_python.auth_server.server_client import ServerClient
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Simple in-memory storage for development
-# For production, use Redis, PostgreSQL, or other persistent storage
-class MemoryStateStore:
-    """In-memory state store for session data (development only)"""
-    def __init__(self):
-        self._data = {}
-    
-    async def get(self, key, options=None):
-        return self._data.get(key)
-    
-    async def set(self, key, value, options=None):
-        self._data[key] = value
-    
-    async def delete(self, key, options=None):
-        self._data.pop(key, None)
-    
-    async def delete_by_logout_token(self, claims, options=None):
-        # For backchannel logout support
-        pass
-
-class MemoryTransactionStore:
-    """In-memory transaction store for OAuth flows (development only)"""
-    def __init__(self):
-        self._data = {}
-    
-    async def get(self, key, options=None):
-        return self._data.get(key)
-    
-    async def set(self, key, value, options=None):
-        self._data[key] = value
-    
-    async def delete(self, key, options=None):
-        self._data.pop(key, None)
-
-# Initialize stores
-state_store = MemoryStateStore()
-transaction_store = MemoryTransactionStore()
+# Imported after load_dotenv so AUTH_* settings in .env apply
+from stores import MemoryStateStore, MemoryTransactionStore, SQLiteStateStore, SQLiteTransactionStore
+from verification import ISSUER, IdTokenVerifier, JWKSCache, SessionUsers, VerifiedUserCache
+
+# Sessions and login transactions expire and are bounded in size, see stores.py
+# AUTH_STORE=sqlite keeps them in AUTH_STORE_PATH so several workers can share them
+if os.getenv('AUTH_STORE', 'memory') == 'sqlite':
+    store_path = os.getenv('AUTH_STORE_PATH', 'auth_sessions.db')
+    state_store = SQLiteStateStore(store_path)
+    transaction_store = SQLiteTransactionStore(store_path)
+else:
+    state_store = MemoryStateStore()
+    transaction_store = MemoryTransactionStore()
 
 # Initialize the Auth0 ServerClient
 auth0 = ServerClient(
@@ -55,4 +33,33 @@ auth0 = ServerClient(
         'scope': 'openid profile email',
         'audience': os.getenv('AUTH0_AUDIENCE', '')  # Optional: for API access
     }
-)
\ No newline at end of file
+)
+
+# Verified users per session, so page loads don't go back to the state store
+session_users = SessionUsers(
+    auth0,
+    IdTokenVerifier(ISSUER, os.getenv('AUTH0_CLIENT_ID'), JWKSCache(ISSUER)),
+    VerifiedUserCache(),
+    state_store,
+)
+
+async def current_user():
+    """Signed-in user, from the verified-user cache once the session has been seen"""
+    user, sid = await session_users.get_user(session.get('sid'), g.store_options)
+    if sid:
+        session['sid'] = sid
+    elif 'sid' in session:
+        session.pop('sid')
+    return user
+
+async def backchannel_logout(logout_token):
+    """Delete the sessions a verified logout token names, and their cached users"""
+    await auth0.handle_backchannel_logout(logout_token, g.store_options)
+    # The SDK has checked the token's signature by now, it just doesn't hand the claims back
+    session_users.cache.discard_by_logout_token(jwt.decode(logout_token, options={'verify_signature': False}))
+
+def forget_session():
+    """Drop this browser's cached user, the next request verifies the session again"""
+    sid = session.pop('sid', None)
+    if sid:
+        session_users.cache.discard(sid)
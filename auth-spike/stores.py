@@ -0,0 +1,339 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from auth0_server_python.auth_types import StateData, TransactionData
+
+# Session and transaction stores for the Auth0 ServerClient
+#
+# Every entry has a TTL and expired ones are removed by a background sweeper, so
+# abandoned logins and old sessions don't pile up. The memory stores are split
+# into shards (each with its own lock and LRU order) and hold at most max_entries.
+# State stores also index sessions by the sid and sub claims, so a backchannel
+# logout deletes the matching sessions without scanning the store, and the
+# verified-user cache can check that a session it serves still exists.
+#
+# The SQLite stores have the same interface and can be shared by several worker
+# processes through one database file.
+
+SESSION_TTL = int(os.getenv('AUTH_SESSION_TTL', 24 * 3600))  # Seconds a session lives after its last write
+TRANSACTION_TTL = int(os.getenv('AUTH_TRANSACTION_TTL', 10 * 60))  # Seconds to finish a login
+MAX_ENTRIES = int(os.getenv('AUTH_STORE_MAX_ENTRIES', 100_000))
+SHARDS = 16
+SWEEP_INTERVAL = 30.0  # Seconds between background expiry passes
+
+# Stored models, so values read back from SQLite have the type the SDK expects
+MODEL_TYPES = {model.__name__: model for model in (StateData, TransactionData)}
+
+
+def _as_dict(value):
+    return value.model_dump() if hasattr(value, 'model_dump') else (value or {})
+
+
+def session_claims(value):
+    """(sid, sub, domain) of a stored session, any of them may be None"""
+    data = _as_dict(value)
+    internal = data.get('internal') or {}
+    user = data.get('user') or {}
+    return internal.get('sid'), user.get('sub'), data.get('domain')
+
+
+def session_deadline(value, ttl, now):
+    # Rolling TTL, capped by the session ceiling set by the identity provider
+    deadline = now + ttl
+    ceiling = (_as_dict(value).get('internal') or {}).get('session_expires_at')
+    return min(deadline, ceiling) if ceiling else deadline
+
+
+def _same_issuer(issuer, domain):
+    # Logout tokens carry an issuer URL, sessions store the bare domain
+    if not issuer or not domain:
+        return True
+    strip = lambda url: url.removeprefix('https://').removeprefix('http://').rstrip('/')
+    return strip(issuer) == strip(domain)
+
+
+def _start_sweeper(store, interval):
+    # Daemon thread calling store.expire(); holds the store weakly so it can still be collected
+    ref = weakref.ref(store)
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            target = ref()
+            if target is None:
+                return
+            target.expire()
+            del target
+
+    threading.Thread(target=run, name=f'{type(store).__name__}-sweeper', daemon=True).start()
+    return stop
+
+
+class _Shard:
+    """One lock, LRU order and logout index"""
+    __slots__ = ('lock', 'entries', 'by_sid', 'by_sub')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, expires_at, sid, sub, domain)
+        self.by_sid = {}
+        self.by_sub = {}
+
+    def _index(self, index, claim, key):
+        if claim:
+            index.setdefault(claim, set()).add(key)
+
+    def _unindex(self, index, claim, key):
+        keys = index.get(claim)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[claim]
+
+    def put(self, key, value, expires_at, claims):
+        self.pop(key)
+        sid, sub, _ = claims
+        self.entries[key] = (value, expires_at, *claims)
+        self._index(self.by_sid, sid, key)
+        self._index(self.by_sub, sub, key)
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self._unindex(self.by_sid, entry[2], key)
+            self._unindex(self.by_sub, entry[3], key)
+        return entry
+
+
+class MemoryStore:
+    """In-memory store with TTL expiry, LRU eviction and sharded locking (one process only)"""
+    def __init__(self, ttl, max_entries=MAX_ENTRIES, shards=SHARDS, sweep_interval=SWEEP_INTERVAL, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._shards = [_Shard() for _ in range(shards)]
+        # Each shard holds its share of the limit, keeping eviction local to one lock
+        self._shard_limit = max(1, -(-max_entries // shards))
+        self.evictions = 0
+        self.expirations = 0
+        self._stop_sweeper = _start_sweeper(self, sweep_interval) if sweep_interval else None
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _claims(self, value):
+        return None, None, None
+
+    def _expires_at(self, value, now):
+        return now + self.ttl
+
+    async def get(self, key, options=None):
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self.clock():
+                shard.pop(key)
+                self.expirations += 1
+                return None
+            shard.entries.move_to_end(key)
+            return entry[0]
+
+    async def set(self, key, value, remove_if_expires=False, options=None):
+        now = self.clock()
+        shard = self._shard(key)
+        with shard.lock:
+            shard.put(key, value, self._expires_at(value, now), self._claims(value))
+            while len(shard.entries) > self._shard_limit:
+                shard.pop(next(iter(shard.entries)))
+                self.evictions += 1
+
+    async def delete(self, key, options=None):
+        shard = self._shard(key)
+        with shard.lock:
+            shard.pop(key)
+
+    def expire(self):
+        # Removes expired entries, called by the sweeper thread
+        now = self.clock()
+        for shard in self._shards:
+            with shard.lock:
+                expired = [key for key, entry in shard.entries.items() if entry[1] <= now]
+                for key in expired:
+                    shard.pop(key)
+            self.expirations += len(expired)
+
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self._shards)
+
+    def close(self):
+        if self._stop_sweeper:
+            self._stop_sweeper.set()
+
+
+class MemoryStateStore(MemoryStore):
+    """In-memory state store for session data, indexed by sid and sub for backchannel logout"""
+    def __init__(self, ttl=SESSION_TTL, **kwargs):
+        super().__init__(ttl, **kwargs)
+
+    def _claims(self, value):
+        return session_claims(value)
+
+    def _expires_at(self, value, now):
+        return session_deadline(value, self.ttl, now)
+
+    async def delete_by_logout_token(self, claims, options=None):
+        # Deletes sessions matching the token's sid or sub, from the token's issuer
+        sid, sub, issuer = claims.get('sid'), claims.get('sub'), claims.get('iss')
+        for shard in self._shards:
+            with shard.lock:
+                keys = shard.by_sid.get(sid, set()) | shard.by_sub.get(sub, set())
+                for key in keys:
+                    if _same_issuer(issuer, shard.entries[key][4]):
+                        shard.pop(key)
+
+
+    async def has_session(self, sid, sub, options=None):
+        # Whether a live session with the sid claim (or of sub, without one) exists; counts as a use for LRU eviction
+        index, claim = ('by_sid', sid) if sid else ('by_sub', sub)
+        now = self.clock()
+        for shard in self._shards:
+            with shard.lock:
+                for key in getattr(shard, index).get(claim, ()):
+                    if shard.entries[key][1] > now:
+                        shard.entries.move_to_end(key)
+                        return True
+        return False
+
+
+class MemoryTransactionStore(MemoryStore):
+    """In-memory transaction store for OAuth flows, abandoned logins expire after TRANSACTION_TTL"""
+    def __init__(self, ttl=TRANSACTION_TTL, **kwargs):
+        super().__init__(ttl, **kwargs)
+
+
+def _encode(value):
+    if hasattr(value, 'model_dump'):
+        return json.dumps({'type': type(value).__name__, 'data': value.model_dump(mode='json')})
+    return json.dumps({'type': None, 'data': value})
+
+
+def _decode(text):
+    payload = json.loads(text)
+    model = MODEL_TYPES.get(payload['type'])
+    return model.model_validate(payload['data']) if model else payload['data']
+
+
+class SQLiteStore:
+    """Store kept in an SQLite table, safe to share between processes"""
+    def __init__(self, path, table, ttl, max_entries=MAX_ENTRIES, sweep_interval=SWEEP_INTERVAL, clock=time.time):
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                sid TEXT,
+                sub TEXT,
+                domain TEXT
+            )''')
+            for column in ('expires_at', 'accessed_at', 'sid', 'sub'):
+                self._connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column})')
+        self.evictions = 0
+        self.expirations = 0
+        self._stop_sweeper = _start_sweeper(self, sweep_interval) if sweep_interval else None
+
+    def _claims(self, value):
+        return None, None, None
+
+    def _expires_at(self, value, now):
+        return now + self.ttl
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters)
+
+    async def get(self, key, options=None):
+        now = self.clock()
+        with self._lock:
+            row = self._connection.execute(f'SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?', (key, now)).fetchone()
+            if row is not None:
+                self._connection.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?', (now, key))
+        return _decode(row[0]) if row else None
+
+    async def set(self, key, value, remove_if_expires=False, options=None):
+        now = self.clock()
+        self._execute(
+            f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at, sid, sub, domain) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, _encode(value), self._expires_at(value, now), now, *self._claims(value)),
+        )
+
+    async def delete(self, key, options=None):
+        self._execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def expire(self):
+        # Removes expired rows, then the least recently used ones past max_entries
+        with self._lock:
+            self.expirations += self._connection.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (self.clock(),)).rowcount
+            excess = self._connection.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.evictions += self._connection.execute(
+                    f'DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)', (excess,)
+                ).rowcount
+
+    def __len__(self):
+        return self._execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def close(self):
+        if self._stop_sweeper:
+            self._stop_sweeper.set()
+        with self._lock:
+            self._connection.close()
+
+
+class SQLiteStateStore(SQLiteStore):
+    """SQLite state store for session data, with sid and sub indexes for backchannel logout"""
+    def __init__(self, path, ttl=SESSION_TTL, **kwargs):
+        super().__init__(path, 'sessions', ttl, **kwargs)
+
+    def _claims(self, value):
+        return session_claims(value)
+
+    def _expires_at(self, value, now):
+        return session_deadline(value, self.ttl, now)
+
+    async def delete_by_logout_token(self, claims, options=None):
+        sid, sub, issuer = claims.get('sid'), claims.get('sub'), claims.get('iss')
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT key, domain FROM {self.table} WHERE sid = ? UNION SELECT key, domain FROM {self.table} WHERE sub = ?', (sid, sub)
+            ).fetchall()
+            keys = [(key,) for key, domain in rows if _same_issuer(issuer, domain)]
+            self._connection.executemany(f'DELETE FROM {self.table} WHERE key = ?', keys)
+
+
+    async def has_session(self, sid, sub, options=None):
+        # Whether a live session with the sid claim (or of sub, without one) exists; counts as a use for LRU eviction
+        column, claim = ('sid', sid) if sid else ('sub', sub)
+        now = self.clock()
+        cursor = self._execute(f'UPDATE {self.table} SET accessed_at = ? WHERE {column} = ? AND expires_at > ?', (now, claim, now))
+        return cursor.rowcount > 0
+
+
+class SQLiteTransactionStore(SQLiteStore):
+    """SQLite transaction store for OAuth flows"""
+    def __init__(self, path, ttl=TRANSACTION_TTL, **kwargs):
+        super().__init__(path, 'transactions', ttl, **kwargs)
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+from flask import Flask
+
+# auth.py builds its Auth0 client at import, these only have to be present
+for name, value in {
+    'AUTH0_DOMAIN': 'stand-in.test',
+    'AUTH0_CLIENT_ID': 'client',
+    'AUTH0_CLIENT_SECRET': 'secret',
+    'AUTH0_SECRET': 'x' * 32,
+    'AUTH0_REDIRECT_URI': 'http://localhost:5000/callback',
+}.items():
+    os.environ.setdefault(name, value)
+
+import api
+import catalog
+
+# Checks of the JSON endpoints' input validation, with sign-in and the shared catalog stubbed out
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def signed_in_user():
+        return {'sub': 'auth0|1'}
+
+    games = catalog.generate_synthetic(2000)
+    monkeypatch.setattr(api, 'signed_in_user', signed_in_user)
+    monkeypatch.setattr(api, 'get_catalog', lambda: games)
+    app = Flask(__name__)
+    app.register_blueprint(api.api)
+    return app.test_client()
+
+
+def test_batch_ranks_each_preference_set(client):
+    response = client.post('/api/recommendations/batch', json={
+        'preferences': [{'genre': ['RPG']}, {'genre': 'RPG'}, {'release_range': [1990, 2000], 'number_of_players': 2}],
+        'limit': 5,
+    })
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [len(result['results']) for result in results] == [5, 5, 5]
+    assert results[0]['fingerprint'] == results[1]['fingerprint']
+
+
+@pytest.mark.parametrize('item', [
+    {'genre': 5},
+    {'genre': True},
+    {'genre': [1, 2]},
+    {'genre': {'RPG': 1}},
+    {'genre': ['Not A Genre']},
+    {'release_range': 2000},
+    {'release_range': [2000]},
+    {'release_range': [2000, 'soon']},
+    {'release_range': {'from': 1990, 'to': 2000}},
+    {'release_range': [2005, 1990]},
+    {'number_of_players': True},
+    {'number_of_players': [2]},
+    {'length': 1e400},
+    {'length': -3},
+    'RPG',
+])
+def test_batch_rejects_malformed_items(client, item):
+    response = client.post('/api/recommendations/batch', json={'preferences': [{'genre': ['RPG']}, item]})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
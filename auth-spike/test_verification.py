@@ -0,0 +1,144 @@
+import asyncio
+import json
+import time
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from stores import MemoryStateStore
+from verification import IdTokenVerifier, JWKSCache, SessionUsers, VerifiedUserCache
+
+# Checks of the ID token verification and verified-user cache against a local
+# stand-in OIDC provider: RSA keys generated per test, with discovery and JWKS
+# served through httpx.MockTransport, so nothing touches the network.
+
+ISSUER = 'https://stand-in.test/'
+CLIENT_ID = 'client'
+
+
+class StandInProvider:
+    """Signs ID tokens and serves its discovery document and key set"""
+    def __init__(self):
+        self.keys = {}
+        self.jwks_requests = 0
+        self.add_key('key-1')
+        self.transport = httpx.MockTransport(self._handle)
+
+    def add_key(self, kid):
+        self.keys[kid] = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def _handle(self, request):
+        if request.url.path == '/.well-known/openid-configuration':
+            return httpx.Response(200, json={'issuer': ISSUER, 'jwks_uri': ISSUER + '.well-known/jwks.json'})
+        if request.url.path == '/.well-known/jwks.json':
+            self.jwks_requests += 1
+            keys = [
+                dict(json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key())), kid=kid, use='sig', alg='RS256')
+                for kid, key in self.keys.items()
+            ]
+            return httpx.Response(200, json={'keys': keys})
+        return httpx.Response(404)
+
+    async def fetch_json(self, url):
+        async with httpx.AsyncClient(transport=self.transport) as client:
+            response = await client.get(url)
+            response.raise_for_status()
+            return response.json()
+
+    def id_token(self, kid='key-1', sid='session-1', expires_in=3600, signing_key=None):
+        now = int(time.time())
+        claims = {'iss': ISSUER, 'aud': CLIENT_ID, 'sub': 'auth0|1', 'sid': sid, 'iat': now, 'exp': now + expires_in}
+        return jwt.encode(claims, signing_key or self.keys[kid], 'RS256', headers={'kid': kid})
+
+
+class StandInAuth0:
+    """The one ServerClient call SessionUsers makes, reading sessions from a real state store"""
+    def __init__(self, state_store):
+        self.state_store = state_store
+        self.session_reads = 0
+
+    async def get_session(self, store_options=None):
+        self.session_reads += 1
+        return await self.state_store.get('_a0_session', store_options)
+
+
+@pytest.fixture
+def provider():
+    return StandInProvider()
+
+
+@pytest.fixture
+def clock():
+    return [time.time()]
+
+
+@pytest.fixture
+def jwks(provider, clock):
+    return JWKSCache(ISSUER, min_refresh_interval=60, fetch_json=provider.fetch_json, clock=lambda: clock[0])
+
+
+def session_users(provider, jwks, id_token):
+    state_store = MemoryStateStore(sweep_interval=0)
+    session = {'user': {'sub': 'auth0|1', 'name': 'Player'}, 'id_token': id_token, 'internal': {'sid': 'session-1'}}
+    asyncio.run(state_store.set('_a0_session', session))
+    auth0 = StandInAuth0(state_store)
+    users = SessionUsers(auth0, IdTokenVerifier(ISSUER, CLIENT_ID, jwks), VerifiedUserCache(), state_store)
+    return users, auth0, state_store
+
+
+def test_cache_hit_skips_session_read(provider, jwks):
+    users, auth0, _ = session_users(provider, jwks, provider.id_token())
+    user, sid = asyncio.run(users.get_user(None))
+    assert user['name'] == 'Player' and sid == 'session-1'
+
+    for _ in range(10):
+        assert asyncio.run(users.get_user(sid)) == (user, sid)
+    assert auth0.session_reads == 1
+    assert users.cache.hits == 10
+
+
+def test_expired_token_is_not_cached(provider, jwks):
+    users, auth0, _ = session_users(provider, jwks, provider.id_token(expires_in=-3600))
+    user, sid = asyncio.run(users.get_user(None))
+    assert user['name'] == 'Player' and sid is None
+    assert len(users.cache) == 0
+
+
+def test_revoked_session_leaves_cache(provider, jwks):
+    users, auth0, state_store = session_users(provider, jwks, provider.id_token())
+    _, sid = asyncio.run(users.get_user(None))
+    asyncio.run(state_store.delete_by_logout_token({'sid': 'session-1', 'sub': 'auth0|1', 'iss': ISSUER}))
+
+    assert asyncio.run(users.get_user(sid)) == (None, None)
+    assert len(users.cache) == 0
+
+
+def test_unknown_kid_refreshes_once_per_interval(provider, jwks, clock):
+    verifier = IdTokenVerifier(ISSUER, CLIENT_ID, jwks)
+    asyncio.run(verifier.verify(provider.id_token()))
+    assert provider.jwks_requests == 1
+
+    # A rotated key shows up: the first token with its kid refetches, later ones don't until the interval passes
+    provider.add_key('key-2')
+    clock[0] += 61
+    assert asyncio.run(verifier.verify(provider.id_token('key-2')))['sid'] == 'session-1'
+    assert provider.jwks_requests == 2
+
+    provider.add_key('made-up')
+    for _ in range(5):
+        with pytest.raises(jwt.InvalidTokenError):
+            asyncio.run(verifier.verify(provider.id_token('made-up')))
+    assert provider.jwks_requests == 2
+
+    clock[0] += 61
+    asyncio.run(verifier.verify(provider.id_token('made-up')))
+    assert provider.jwks_requests == 3
+
+
+def test_bad_signature_is_rejected(provider, jwks):
+    verifier = IdTokenVerifier(ISSUER, CLIENT_ID, jwks)
+    forged = provider.id_token(signing_key=rsa.generate_private_key(public_exponent=65537, key_size=2048))
+    with pytest.raises(jwt.InvalidSignatureError):
+        asyncio.run(verifier.verify(forged))
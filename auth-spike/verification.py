@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+import jwt
+
+# Serves the signed-in user from memory on steady-state page loads
+#
+# The first request of a session reads it from the state store and verifies its
+# ID token against the issuer's signing keys. The user is then cached under the
+# session id until the ID token expires, or until the state store no longer has
+# the session: every cache hit asks the store whether a live session with the
+# token's sid (or sub, for tokens without one) still exists. That is an index
+# lookup instead of a full session read plus token check, and it notices logouts,
+# expiry and eviction done by any process sharing the store. Signing keys come from a JWKS cache that
+# refetches when it sees an unknown kid (key rotation), at most once per
+# JWKS_MIN_REFRESH seconds, so tokens with made-up kids can't flood the issuer.
+#
+# AUTH0_ISSUER points everything at another OIDC provider, e.g. a local
+# stand-in such as http://127.0.0.1:8080/ for development without network.
+
+ISSUER = os.getenv('AUTH0_ISSUER') or f"https://{os.getenv('AUTH0_DOMAIN')}/"
+JWKS_TTL = 3600  # Seconds before known keys are refetched
+JWKS_MIN_REFRESH = 60  # Minimum seconds between refetches caused by unknown kids
+USER_CACHE_SIZE = 10_000
+CLOCK_LEEWAY = 60  # Seconds of clock skew allowed on exp/iat
+
+
+class JWKSCache:
+    """Signing keys of one issuer by kid, found through OIDC discovery"""
+    def __init__(self, issuer, ttl=JWKS_TTL, min_refresh_interval=JWKS_MIN_REFRESH, fetch_json=None, clock=time.time):
+        self.issuer = issuer
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.clock = clock
+        self._fetch_json = fetch_json or _fetch_json
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._jwks_uri = None
+        self._expires_at = 0.0
+        self._refreshed_at = float('-inf')
+        self.refreshes = 0
+
+    async def key(self, kid):
+        # The key for kid, refetching the key set when it has expired or doesn't have kid
+        now = self.clock()
+        with self._lock:
+            key = self._keys.get(kid) if now < self._expires_at else None
+            stale = now >= self._expires_at
+            may_refresh = stale or now - self._refreshed_at >= self.min_refresh_interval
+            if key is None and may_refresh:
+                self._refreshed_at = now  # Claimed before fetching so concurrent misses don't all refetch
+        if key is not None:
+            return key
+        if may_refresh:
+            await self.refresh()
+        with self._lock:
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f'No signing key with kid {kid!r}')
+        return key
+
+    async def refresh(self):
+        if self._jwks_uri is None:
+            metadata = await self._fetch_json(self.issuer.rstrip('/') + '/.well-known/openid-configuration')
+            self._jwks_uri = metadata['jwks_uri']
+        jwks = await self._fetch_json(self._jwks_uri)
+        keys = {}
+        for entry in jwks.get('keys', []):
+            if entry.get('use', 'sig') == 'sig' and 'kid' in entry:
+                keys[entry['kid']] = jwt.PyJWK.from_dict(entry)
+        with self._lock:
+            self._keys = keys
+            self._expires_at = self.clock() + self.ttl
+            self.refreshes += 1
+
+
+async def _fetch_json(url):
+    async with httpx.AsyncClient(timeout=10) as client:
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.json()
+
+
+class IdTokenVerifier:
+    """Checks an ID token's signature, issuer, audience and expiry"""
+    def __init__(self, issuer, audience, jwks, leeway=CLOCK_LEEWAY):
+        self.issuer = issuer
+        self.audience = audience
+        self.jwks = jwks
+        self.leeway = leeway
+
+    async def verify(self, token):
+        # Returns the token's claims, raises jwt.InvalidTokenError (or a subclass) otherwise
+        header = jwt.get_unverified_header(token)
+        key = await self.jwks.key(header.get('kid'))
+        return jwt.decode(
+            token,
+            key.key,
+            algorithms=[key.algorithm_name],
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={'require': ['exp', 'iat', 'sub']},
+        )
+
+
+class VerifiedUserCache:
+    """Users with a verified ID token by session id, each kept until its token expires"""
+    def __init__(self, max_entries=USER_CACHE_SIZE, clock=time.time):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # sid -> (user, expires_at, sub, session_sid)
+        self._by_sub = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sid):
+        # (user, session_sid, sub) of a live entry, session_sid being the token's sid claim
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None and entry[1] <= self.clock():
+                self._pop(sid)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(sid)
+            self.hits += 1
+            return entry[0], entry[3], entry[2]
+
+    def put(self, sid, user, expires_at, sub=None, session_sid=None):
+        with self._lock:
+            self._pop(sid)
+            self._entries[sid] = (user, expires_at, sub, session_sid)
+            if sub:
+                self._by_sub.setdefault(sub, set()).add(sid)
+            while len(self._entries) > self.max_entries:
+                self._pop(next(iter(self._entries)))
+
+    def discard(self, sid):
+        with self._lock:
+            self._pop(sid)
+
+    def discard_by_logout_token(self, claims):
+        # Same matching as the state store: the token's sid (entries are keyed by it), or every session of its sub
+        with self._lock:
+            self._pop(claims.get('sid'))
+            for sid in list(self._by_sub.get(claims.get('sub'), ())):
+                self._pop(sid)
+
+    def _pop(self, sid):
+        entry = self._entries.pop(sid, None)
+        if entry is not None and entry[2]:
+            sids = self._by_sub[entry[2]]
+            sids.discard(sid)
+            if not sids:
+                del self._by_sub[entry[2]]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SessionUsers:
+    """Looks up the signed-in user, reading the full session from the state store only on a cache miss"""
+    def __init__(self, auth0, verifier, cache, state_store=None):
+        self.auth0 = auth0
+        self.verifier = verifier
+        self.cache = cache
+        self.state_store = state_store  # Asked whether a cached session still exists, None trusts the cache until exp
+
+    async def get_user(self, sid, store_options=None):
+        # Returns (user, sid); sid is the key to remember for this browser, or None if the user can't be cached
+        if sid:
+            cached = self.cache.get(sid)
+            if cached is not None:
+                user, session_sid, sub = cached
+                if self.state_store is None or await self.state_store.has_session(session_sid, sub, store_options):
+                    return user, sid
+                self.cache.discard(sid)  # Logged out, expired or evicted meanwhile
+
+        session = await self.auth0.get_session(store_options)
+        if not session or not session.get('user'):
+            return None, None
+        if not session.get('id_token'):
+            return session['user'], None
+        try:
+            claims = await self.verifier.verify(session['id_token'])
+        except jwt.ExpiredSignatureError:
+            # The session itself is still valid, it's just not cacheable any more
+            return session['user'], None
+        except jwt.InvalidTokenError:
+            return None, None
+
+        sid = claims.get('sid') or sid or claims['sub'] + ':' + str(claims['iat'])
+        self.cache.put(sid, session['user'], claims['exp'], claims['sub'], claims.get('sid'))
+        return session['user'], sid
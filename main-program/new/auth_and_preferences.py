@@ -1,4 +1,14 @@
-from typing import Any
+from collections.abc import Iterable, Iterator, MutableMapping, MutableSet
+from typing import TYPE_CHECKING, Any
+
+from preference_options import GenreSet, as_genre_mask
+
+if TYPE_CHECKING:
+    from user_store import UserStore # user_store imports this module, so only for annotations
+
+
+PREFERENCE_KEYS = ("genre", "release_range", "number_of_players", "length")
+
 
 class User:
     """
@@ -10,45 +20,140 @@ class User:
 
     Set a dictionary of:
         preferences: predefined key value pairs, no adding more but we can update the values of the keys
+
+    Preferences are packed into slots (genre bitmask, release years, players, length; 0 means unset)
+    so a user costs one small object. user.preferences is a dict-like view over those slots, and its
+    "genre" value is a GenreSet that writes straight back to genre_mask.
     """
+    __slots__ = ("username", "password", "genre_mask", "release_start", "release_end", "number_of_players", "length", "__weakref__")
+
     def __init__(self, username=None, password=None, preferences=None):
         self.username = username or ""
         self.password = password or ""
-        self.preferences = preferences or {}
+        self.genre_mask = self.release_start = self.release_end = self.number_of_players = self.length = 0
+        self.preferences.update(preferences or {})
+
+    @classmethod
+    def from_fields(cls, username: str, password: str, genre_mask: int, release_start: int, release_end: int, number_of_players: int, length: int) -> "User":
+        # Builds a user straight from packed fields, used by the stores
+        user = cls.__new__(cls)
+        user.username, user.password = username, password
+        user.genre_mask, user.release_start, user.release_end = genre_mask, release_start, release_end
+        user.number_of_players, user.length = number_of_players, length
+        return user
+
+    @property
+    def preferences(self) -> "Preferences":
+        return Preferences(self)
 
     # Can update preferences
     def update_preference(self, preference: str, value: Any) -> None:
-        self.preferences.update(preference=value)
+        self.preferences[preference] = value
 
     def add_preference(self, preference: str, value: Any) -> None:
-        if type(self.preferences[preference]) is set:
+        if isinstance(self.preferences[preference], MutableSet):
             # E.g. genres
             # Update preference with 
             self.preferences[preference].add(value)
         else:
-            self.preferences.update(preference=value)
+            self.preferences[preference] = value
 
     def delete_preference(self, preference: str, value: Any) -> None:
-        if type(self.preferences[preference]) is set:
+        if isinstance(self.preferences[preference], MutableSet):
             # E.g. genres
             # Update preference with 
             if value not in self.preferences[preference]:
                 return
             self.preferences[preference].remove(value)
         else:
-            self.preferences.update(preference=value)
+            self.preferences[preference] = value
+
+
+class UserGenreSet(GenreSet):
+    """GenreSet whose mask is its user's genre_mask"""
+    __slots__ = ("_user",)
+
+    def __init__(self, user: User):
+        self._user = user
+
+    @classmethod
+    def _from_iterable(cls, genres: Iterable[str]) -> GenreSet:
+        # Results of |, &, - are plain sets, not bound to the user
+        return GenreSet(genres)
+
+    @property
+    def mask(self) -> int:
+        return self._user.genre_mask
+
+    @mask.setter
+    def mask(self, value: int) -> None:
+        self._user.genre_mask = value
+
+
+class Preferences(MutableMapping):
+    """The preference dict of a user, read from and written to the user's packed slots"""
+    __slots__ = ("_user",)
+
+    def __init__(self, user: User):
+        self._user = user
+
+    def __getitem__(self, preference: str) -> Any:
+        user = self._user
+        match preference:
+            case "genre":
+                return UserGenreSet(user)
+            case "release_range":
+                return (user.release_start, user.release_end) if user.release_start else ()
+            case "number_of_players":
+                return user.number_of_players or None
+            case "length":
+                return user.length or None
+            case _:
+                raise KeyError(preference)
+
+    def __setitem__(self, preference: str, value: Any) -> None:
+        user = self._user
+        match preference:
+            case "genre":
+                user.genre_mask = as_genre_mask(value)
+            case "release_range":
+                user.release_start, user.release_end = value or (0, 0)
+            case "number_of_players":
+                user.number_of_players = value or 0
+            case "length":
+                user.length = value or 0
+            case _:
+                raise KeyError(f"Recieved invalid preference value: {preference}")
+
+    def __delitem__(self, preference: str) -> None:
+        raise TypeError("Preferences can't be removed, set them to None instead")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(PREFERENCE_KEYS)
+
+    def __len__(self) -> int:
+        return len(PREFERENCE_KEYS)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
 
+def validate_credentials(username: str, password: str, store: "UserStore | None" = None) -> User | None:
+    # Looks the username up in the user database (the default one unless a store is given).
+    # Blocks while the password hash is checked, async callers should use credentials.CredentialVerifier.
+    import credentials
+    import user_store
 
-def validate_credentials(username: str, password: str) -> User | None:
-    for user in VALID_USERS:
-        if user.username == username and user.password == password:
-            return user
+    user = (store or user_store.default_store()).get(username)
+    if user and credentials.verify_password(password, user.password):
+        return user
     return None
 
 
+# Seed accounts, copied into a new user database the first time it's created
 VALID_USERS = [
     User("test", "1234", {
-        "genre": set(),
+        "genre": GenreSet(),
         "release_range": (),
         "number_of_players": None,
         "length": None,
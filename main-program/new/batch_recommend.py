@@ -0,0 +1,167 @@
+"""
+Docstring for batch_recommend
+
+Offline recommendations for every user in the database (Sprint 2)
+
+Streams users out of the user database in id order, ranks them in chunks on a
+pool of worker processes and writes the results as they come in, as JSON lines
+(one object per user) or CSV (one row per recommendation). Each worker
+memory-maps the catalog snapshot, so every process reads the same page-cache
+copy instead of loading its own. Users with identical preferences are ranked
+once per worker through the recommendation cache.
+
+After every chunk the output is flushed and a checkpoint records the last user
+id and the output size. --resume truncates the output back to that size and
+carries on after that user, so a killed job neither loses nor repeats users.
+
+Usage:
+    python batch_recommend.py recommendations.jsonl [--format jsonl|csv] [--resume]
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import resource
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import catalog
+import recommender
+import snapshot
+import user_store
+import workers
+from auth_and_preferences import User
+
+
+CHUNK_SIZE = 2000 # Users per task sent to a worker
+RESULTS = 10
+CSV_FIELDS = ["username", "rank", "title", "score"]
+
+_games: catalog.GameCatalog | None = None # The worker's mapped catalog
+
+
+def _init_worker(path: str) -> None:
+    # Every worker maps the same snapshot, derived sections included, and keeps that generation for the job
+    global _games
+    _games = snapshot.open_snapshot(path)
+
+
+def rank_chunk(rows: list[tuple], k: int, fmt: str) -> tuple[int, int, str, int, int]:
+    # Runs in a worker: ranks one chunk of user rows and renders them in the output format.
+    # Returns (last user id, users ranked, rendered text, worker pid, its peak RSS in KiB).
+    games = _games
+    assert games is not None
+    out = io.StringIO()
+    writer = csv.writer(out) if fmt == "csv" else None
+    for _, username, genre_mask, *preferences in rows:
+        user = User.from_fields(username, "", genre_mask, *(value or 0 for value in preferences))
+        ranked_rows, scores = recommender.rank_cached(games, user.preferences, k)
+        if writer is not None:
+            for rank, (row, score) in enumerate(zip(ranked_rows, scores), start=1):
+                writer.writerow([username, rank, games.title(row), f"{score:.4f}"])
+        else:
+            recommendations = [{"title": games.title(row), "score": round(float(score), 4)} for row, score in zip(ranked_rows, scores)]
+            out.write(json.dumps({"username": username, "recommendations": recommendations}) + "\n")
+    return rows[-1][0], len(rows), out.getvalue(), os.getpid(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def read_checkpoint(path: str) -> dict | None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path: str, state: dict) -> None:
+    # Replaced atomically, a crash leaves either the old or the new checkpoint
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(temporary, path)
+
+
+def run(output: str, fmt: str, store: user_store.UserStore, snapshot_path: str, resume: bool = False,
+        k: int = RESULTS, chunk_size: int = CHUNK_SIZE, processes: int = workers.PROCESS_WORKERS) -> dict:
+    checkpoint_path = output + ".checkpoint"
+    state = read_checkpoint(checkpoint_path) if resume else None
+    if state is not None and (state["format"], state["k"]) != (fmt, k):
+        raise ValueError(f"Checkpoint was written for format {state['format']} with {state['k']} results")
+    state = state or {"format": fmt, "k": k, "last_id": 0, "users": 0, "offset": 0}
+
+    out = open(output, "r+" if state["offset"] else "w", newline="", encoding="utf-8")
+    out.truncate(state["offset"]) # Drops whatever was written after the checkpoint
+    out.seek(state["offset"])
+    if fmt == "csv" and state["offset"] == 0:
+        csv.writer(out).writerow(CSV_FIELDS)
+
+    worker_rss: dict[int, int] = {} # Peak RSS by worker pid
+    start = time.perf_counter()
+    resumed_users = state["users"]
+    pool = ProcessPoolExecutor(processes, mp_context=workers.process_context(), initializer=_init_worker, initargs=(snapshot_path,))
+    pending: deque[Future] = deque()
+
+    def finish_oldest() -> None:
+        # Results are written in submission order so the checkpoint always covers a prefix of the users
+        last_id, count, text, pid, rss = pending.popleft().result()
+        out.write(text)
+        out.flush()
+        state.update(last_id=last_id, users=state["users"] + count, offset=out.tell())
+        write_checkpoint(checkpoint_path, state)
+        worker_rss[pid] = rss
+
+    try:
+        for rows in store.iter_preference_chunks(state["last_id"], chunk_size):
+            pending.append(pool.submit(rank_chunk, rows, k, fmt))
+            if len(pending) >= 2 * processes: # Bounds memory while keeping every worker busy
+                finish_oldest()
+        while pending:
+            finish_oldest()
+    finally:
+        pool.shutdown(cancel_futures=True)
+        out.close()
+
+    elapsed = time.perf_counter() - start
+    ranked = state["users"] - resumed_users
+    return {
+        "users": ranked,
+        "total_users": state["users"],
+        "seconds": elapsed,
+        "users_per_second": ranked / elapsed if elapsed else 0.0,
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "worker_peak_rss_mib": max(worker_rss.values(), default=0) / 1024,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rank recommendations for every user")
+    parser.add_argument("output")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None, help="Defaults to the output file's extension")
+    parser.add_argument("--resume", action="store_true", help="Continue from the output's checkpoint")
+    parser.add_argument("--db", default=user_store.USER_DB_PATH)
+    parser.add_argument("--snapshot", default=snapshot.SNAPSHOT_PATH)
+    parser.add_argument("--results", type=int, default=RESULTS)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--processes", type=int, default=workers.PROCESS_WORKERS)
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.output.endswith(".csv") else "jsonl")
+    store = user_store.UserStore(args.db)
+    report = run(args.output, fmt, store, snapshot.ensure_snapshot(args.snapshot), args.resume, args.results, args.chunk_size, args.processes)
+    store.close()
+
+    print(f"{'users ranked':<32} {report['users']:12d}")
+    print(f"{'users in output':<32} {report['total_users']:12d}")
+    print(f"{'elapsed':<32} {report['seconds']:12.2f} s")
+    print(f"{'users per second':<32} {report['users_per_second']:12.0f}")
+    print(f"{'peak RSS (coordinator)':<32} {report['peak_rss_mib']:12.1f} MiB")
+    print(f"{'peak RSS (largest worker)':<32} {report['worker_peak_rss_mib']:12.1f} MiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,484 @@
+"""
+Docstring for benchmarks
+
+Timing suite for the recommender, run with `python benchmarks.py`
+
+Each benchmark prints the median of several runs so one slow run doesn't skew it
+"""
+
+import argparse
+import asyncio
+import csv
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Callable
+
+import numpy as np
+
+import cache
+import catalog
+import catalog_reload
+import collaborative
+import credentials
+import ingest
+import preference_journal
+import preference_options
+import query_plan
+import recommender
+import similarity
+import snapshot
+import user_store
+import user_table
+import workers
+from auth_and_preferences import User
+
+
+SAMPLE_PREFERENCES = {
+    "no preferences": {"genre": set(), "release_range": (), "number_of_players": None, "length": None},
+    "one genre": {"genre": {"RPG"}, "release_range": (), "number_of_players": None, "length": None},
+    "narrow": {"genre": {"Action", "Indie"}, "release_range": (1998, 2002), "number_of_players": 2, "length": 10},
+    "wide": {"genre": {"Action", "Adventure", "Casual", "Indie", "Strategy"}, "release_range": (1985, 2025), "number_of_players": 1, "length": 20},
+}
+
+
+def time_it(func: Callable[[], object], repeat: int = 20) -> float:
+    # Median wall time of func in milliseconds
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def report(name: str, millis: float) -> None:
+    print(f"{name:<48} {millis:10.3f} ms")
+
+
+def bench_recommend(games: catalog.GameCatalog) -> None:
+    for name, prefs in SAMPLE_PREFERENCES.items():
+        report(f"recommend ({name})", time_it(lambda: recommender.recommend(games, prefs)))
+
+
+def bench_plans(games: catalog.GameCatalog) -> None:
+    # Compiling a query plan against fetching it from the per-catalog cache, and what each plan chose
+    statistics = query_plan._Statistics(games)
+    for name, prefs in SAMPLE_PREFERENCES.items():
+        plan = query_plan.plan_for(games, prefs)
+        report(f"compile plan ({name})", time_it(lambda: query_plan.compile_plan(games, prefs, statistics)))
+        report(f"cached plan ({name})", time_it(lambda: query_plan.plan_for(games, prefs)))
+        print(f"{'  steps':<48} {', '.join(step.access for step in plan.steps) or 'none'}")
+
+
+def bench_threshold(games: catalog.GameCatalog) -> None:
+    # Threshold-algorithm top-k over genre posting lists against the full scan it replaces
+    report(f"build genre posting lists ({len(games)} games)", time_it(lambda: catalog.GenrePostings.build(games.genre_mask, games.popularity_score), repeat=5))
+    games.genre_postings # Built once up front like a snapshot would have it
+
+    def scan(prefs: dict, k: int) -> tuple[np.ndarray, np.ndarray]:
+        rows = recommender.candidate_rows(games, prefs)
+        return recommender.top_k(rows, recommender.score_rows(games, prefs, rows), k)
+
+    profiles = {
+        "one genre": {"genre": {"RPG"}},
+        "two genres": {"genre": {"RPG", "Indie"}},
+        "three genres": {"genre": {"RPG", "Indie", "Sports"}},
+        "one genre, length": {"genre": {"RPG"}, "length": 20},
+    }
+    for name, prefs in profiles.items():
+        for k in (10, 50):
+            answered = recommender.threshold_rank(games, prefs, k) is not None
+            report(f"top {k} ({name}), {'threshold' if answered else 'gave up'}", time_it(lambda: recommender.threshold_rank(games, prefs, k)))
+            report(f"top {k} ({name}), scan", time_it(lambda: scan(prefs, k)))
+
+
+def bench_indexes(games: catalog.GameCatalog) -> None:
+    # Cost of building the range indexes and how flat latency stays across range widths
+    report("build release year index", time_it(lambda: catalog.SortedIndex(games.release_year), repeat=5))
+    report("build length index", time_it(lambda: catalog.SortedIndex(games.length), repeat=5))
+    index_bytes = sum(index.order.nbytes + index.values.nbytes for index in (games.release_year_index, games.length_index))
+    print(f"{'range index memory':<48} {index_bytes / 2**20:10.3f} MiB")
+
+    for label, release_range in (("1998-2002", (1998, 2002)), ("2010-2025", (2010, 2025)), ("any year", ())):
+        prefs = {**SAMPLE_PREFERENCES["one genre"], "release_range": release_range}
+        report(f"recommend (one genre, {label})", time_it(lambda: recommender.recommend(games, prefs)))
+
+
+def bench_cache(games: catalog.GameCatalog, users: int = 5000, distinct: int = 300) -> None:
+    # Replays a skewed workload where many users share a few popular preference sets
+    rng = np.random.default_rng(1)
+    genre_count = len(preference_options.GENRE_OPTIONS)
+    profiles = [
+        {
+            "genre": preference_options.GenreSet(mask=int(rng.integers(1, 1 << genre_count))),
+            "release_range": (int(start), int(start) + 5) if (start := rng.integers(1985, 2030)) < 2021 else (),
+            "number_of_players": None,
+            "length": None,
+        }
+        for _ in range(distinct)
+    ]
+    picks = np.minimum(rng.zipf(1.3, users), distinct) - 1
+    population = [User(f"user{i}", preferences=dict(profiles[pick])) for i, pick in enumerate(picks)]
+
+    results = cache.RecommendationCache(max_entries=distinct // 2)
+    start = time.perf_counter()
+    for user in population:
+        recommender.recommend_for(user, games, cache=results)
+    elapsed = (time.perf_counter() - start) * 1000
+    report(f"recommend_for ({users} users, {distinct} profiles)", elapsed / users)
+    print(f"{'  cache stats':<48} {results.stats()}")
+
+    hit_user = population[0]
+    report("recommend_for (cache hit)", time_it(lambda: recommender.recommend_for(hit_user, games, cache=results)))
+
+
+def bench_incremental(games: catalog.GameCatalog) -> None:
+    # Toggling one genre through a RankingSession versus ranking from scratch each time
+    for label, release_range in (("any year", ()), ("2000-2010", (2000, 2010)), ("2000-2002", (2000, 2002))):
+        prefs = {**SAMPLE_PREFERENCES["one genre"], "genre": {"RPG"}, "release_range": release_range}
+        ranking = recommender.RankingSession(games)
+        ranking.rank(prefs)
+
+        def toggle(rank: Callable[[], object]) -> None:
+            prefs["genre"] ^= {"Action"}
+            rank()
+
+        report(f"toggle genre, incremental ({label})", time_it(lambda: toggle(lambda: ranking.rank(prefs))))
+        report(f"toggle genre, from scratch ({label})", time_it(lambda: toggle(lambda: recommender.rank(games, prefs))))
+
+
+def bench_user_store(count: int) -> None:
+    # Bulk import into a fresh database, then single-user lookups through the username index
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "users.db")
+        store = user_store.UserStore(path)
+        users = (User(f"user{i}", "password", {"genre": preference_options.GenreSet(mask=i & 0x3FFFF)}) for i in range(count))
+        start = time.perf_counter()
+        store.bulk_import(users)
+        elapsed = time.perf_counter() - start
+        report(f"bulk import {count} users", elapsed * 1000)
+        print(f"{'  import rate':<48} {count / elapsed:10.0f} users/s")
+
+        rng = np.random.default_rng(2)
+        names = [f"user{i}" for i in rng.integers(0, count, 1000)]
+        report("user lookup (per user)", time_it(lambda: [store.get(name) for name in names], repeat=5) / len(names))
+        report("user lookup (missing)", time_it(lambda: store.get("nobody")))
+        store.close()
+        print(f"{'  database size':<48} {os.path.getsize(path) / 2**20:10.3f} MiB")
+
+
+def _traced_bytes(build: Callable[[], object]) -> int:
+    # Bytes allocated by build() that are still alive while its result is held
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_user_memory(count: int = 1_000_000, sample: int = 100_000) -> None:
+    # Memory per 1M users: dict-based objects (the old layout), slotted User objects and a UserTable.
+    # Object layouts are measured on a sample and scaled up, the table is built at full size.
+    genres = preference_options.GENRE_OPTIONS
+
+    def preferences(i: int) -> dict:
+        return {"genre": {genres[i % 18], genres[(i * 7) % 18]}, "release_range": (1990 + i % 30, 2025), "number_of_players": 1 + i % 4, "length": 5 + i % 60}
+
+    def dict_users() -> list:
+        return [SimpleNamespace(username=f"user{i}", password="password", preferences=preferences(i)) for i in range(sample)]
+
+    def slotted_users() -> list:
+        return [User(f"user{i}", "password", preferences(i)) for i in range(sample)]
+
+    scale = count / sample / 2**20
+    print(f"{f'dict-based users (per {count} users)':<48} {_traced_bytes(dict_users) * scale:10.1f} MiB")
+    print(f"{f'slotted User objects (per {count} users)':<48} {_traced_bytes(slotted_users) * scale:10.1f} MiB")
+
+    start = time.perf_counter()
+    table = user_table.UserTable(count)
+    table.extend(User(f"user{i}", "", preferences(i)) for i in range(count))
+    report(f"fill UserTable ({count} users)", (time.perf_counter() - start) * 1000)
+    print(f"{f'UserTable ({count} users)':<48} {table.nbytes / 2**20:10.1f} MiB")
+    table.row_of("user0") # Builds the username index
+    print(f"{f'UserTable with username index ({count} users)':<48} {table.nbytes / 2**20:10.1f} MiB")
+    print(f"{'  bytes per user':<48} {table.nbytes / count:10.1f}")
+    rng = np.random.default_rng(3)
+    names = [f"user{i}" for i in rng.integers(0, count, 1000)]
+    report("UserTable username lookup (per user)", time_it(lambda: [table.row_of(name) for name in names], repeat=5) / len(names))
+    report("UserTable column scan (users liking genre 0)", time_it(lambda: np.count_nonzero(table.genre_mask & 1)))
+
+
+def bench_catalog_memory(count: int = 1_000_000, sample: int = 100_000) -> None:
+    # Text of a catalog of count games: per-row Python strings and tag lists (what a loader keeping
+    # parsed rows ends up with) against the title StringTable, genre mask and dictionary-encoded columns.
+    # Python layouts are measured on a sample and scaled up, the encoded columns at full size.
+    games = catalog.generate_synthetic(count)
+    rows = range(sample)
+    scale = count / sample / 2**20
+    layouts = {
+        "titles": (lambda: [games.title(row) for row in rows], games.titles.data.nbytes + games.titles.offsets.nbytes),
+        "developers and publishers": (
+            lambda: ([games.developer_of(row) for row in rows], [games.publisher_of(row) for row in rows]),
+            games.developer.nbytes + games.publisher.nbytes,
+        ),
+        "tags": (lambda: [";".join(games.genres(row)).split(";") for row in rows], games.genre_mask.nbytes),
+    }
+    print(f"Catalog text of {count} games:")
+    before = after = 0.0
+    for name, (python_objects, encoded) in layouts.items():
+        size = _traced_bytes(python_objects) * scale
+        before += size
+        after += encoded / 2**20
+        print(f"{f'  {name}, Python objects':<48} {size:10.1f} MiB")
+        print(f"{f'  {name}, encoded':<48} {encoded / 2**20:10.1f} MiB")
+    print(f"{'  total before / after':<48} {before:10.1f} / {after:.1f} MiB")
+    print(f"{'  distinct developers / publishers':<48} {len(games.developer.values):10} / {len(games.publisher.values)}")
+    page = np.random.default_rng(4).integers(0, count, 10)
+    report("decode one page of results (10 games)", time_it(lambda: [(games.title(row), games.developer_of(row), games.genres(row)) for row in page]))
+
+
+def bench_logins(logins: int = 64) -> None:
+    # Password verification cost in one process, then login throughput through the process pool
+    stored = credentials.hash_password("hunter2")
+    single = time_it(lambda: credentials.verify_password("hunter2", stored), repeat=5)
+    report(f"verify password (scrypt log_n={credentials.DEFAULT_PARAMS.log_n})", single)
+    print(f"{'  logins per second per core':<48} {1000 / single:10.1f}")
+
+    store = user_store.UserStore(":memory:")
+    store.bulk_import(User(f"user{i}", stored) for i in range(logins))
+    verifier = credentials.CredentialVerifier(store)
+
+    async def login_all() -> None:
+        await asyncio.gather(*(verifier.verify(f"user{i}", "hunter2") for i in range(logins)))
+
+    asyncio.run(login_all()) # Warms up the pool's worker processes
+    start = time.perf_counter()
+    asyncio.run(login_all())
+    elapsed = time.perf_counter() - start
+    rate = logins / elapsed
+    print(f"{f'  logins per second ({workers.PROCESS_WORKERS} worker processes)':<48} {rate:10.1f}")
+    print(f"{'  logins per second per worker':<48} {rate / workers.PROCESS_WORKERS:10.1f}")
+    workers.shutdown()
+
+
+def bench_journal(updates: int = 100_000, users: int = 1000) -> None:
+    # Preference updates through the write-behind journal, including the final flush and compaction
+    with tempfile.TemporaryDirectory() as directory:
+        store = user_store.UserStore(os.path.join(directory, "users.db"))
+        store.bulk_import(User(f"user{i}", "password", {"genre": set()}) for i in range(users))
+        population = [store.get(f"user{i}") for i in range(users)]
+        journal = preference_journal.PreferenceJournal(store, os.path.join(directory, "preferences.journal"))
+
+        genres = preference_options.GENRE_OPTIONS
+        start = time.perf_counter()
+        for i in range(updates):
+            user = population[i % users]
+            user.add_preference("genre", genres[i % len(genres)])
+            journal.record(user)
+        recorded = time.perf_counter() - start
+        journal.close()
+        total = time.perf_counter() - start
+
+        print(f"{'preference updates per second (recorded)':<48} {updates / recorded:10.0f}")
+        print(f"{'preference updates per second (durable)':<48} {updates / total:10.0f}")
+        print(f"{'  journal flushes / compactions':<48} {journal.flushes:>5} / {journal.compactions}")
+
+        start = time.perf_counter()
+        for user in population[:200]:
+            store.save_preferences(user)
+        print(f"{'preference updates per second (transaction each)':<48} {200 / (time.perf_counter() - start):10.0f}")
+
+
+def bench_startup(games: catalog.GameCatalog) -> None:
+    # Compares parsing the raw CSV with mapping the compiled snapshot
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "games.csv")
+        path = os.path.join(directory, "games.snap")
+        catalog.write_csv(games, source)
+        report("load raw CSV", time_it(lambda: catalog.load_csv(source), repeat=3))
+        report("build snapshot", time_it(lambda: snapshot.build_snapshot(source, path), repeat=3))
+        report("open snapshot", time_it(lambda: snapshot.open_snapshot(path, source=source)))
+        mapped = snapshot.open_snapshot(path, source=source)
+        report("recommend (one genre, mapped snapshot)", time_it(lambda: recommender.recommend(mapped, SAMPLE_PREFERENCES["one genre"])))
+
+
+def _anonymous_mib() -> float | None:
+    # Anonymous memory of this process, i.e. what it can't share with others.
+    # Pages of a mapped file are excluded even when only this process maps them. Linux only.
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {line.split()[0]: int(line.split()[1]) for line in f if line.endswith("kB\n")}
+    except OSError:
+        return None
+    return fields["Anonymous:"] / 1024
+
+
+def _catalog_worker(path: str, private: bool, results) -> None:
+    # Runs in a child: attaches to (or copies) the catalog, serves a few requests, reports its own memory
+    before = _anonymous_mib()
+    games = snapshot.open_snapshot(path)
+    if private:
+        # What every process used to hold: its own columns, popularity scores and indexes
+        titles = catalog.StringTable(np.array(games.titles.data), np.array(games.titles.offsets))
+        games = catalog.GameCatalog(titles, *(np.array(getattr(games, name)) for name in catalog.GameCatalog.COLUMNS))
+    for _ in range(5):
+        for prefs in SAMPLE_PREFERENCES.values():
+            recommender.recommend(games, prefs)
+    games.release_year_index, games.length_index
+    results.put(_anonymous_mib() - before)
+
+
+def bench_shared_catalog(games: catalog.GameCatalog, counts: tuple[int, ...] = (1, 2, 4, 8)) -> None:
+    # Catalog memory each worker process adds, private copies against one attached snapshot
+    if _anonymous_mib() is None:
+        print("shared catalog benchmark needs /proc/self/smaps_rollup, skipped")
+        return
+    context = workers.process_context()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "games.snap")
+        snapshot.write_snapshot(games, path)
+        for private in (True, False):
+            for count in counts:
+                results = context.Queue()
+                processes = [context.Process(target=_catalog_worker, args=(path, private, results)) for _ in range(count)]
+                for process in processes:
+                    process.start()
+                per_worker = [results.get() for _ in processes]
+                for process in processes:
+                    process.join()
+                name = f"catalog memory per worker ({'private copy' if private else 'attached'}, {count} workers)"
+                print(f"{name:<48} {statistics.mean(per_worker):10.2f} MiB")
+
+
+def bench_reload(games: catalog.GameCatalog, changes: int = 4000) -> None:
+    # Applies a delta to a live snapshot while another thread keeps serving recommendations
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "games.snap")
+        snapshot.write_snapshot(games, path)
+        handle = snapshot.CatalogHandle(path, check_interval=0)
+
+        delta = os.path.join(directory, "delta.csv")
+        genres = preference_options.GENRE_OPTIONS
+        with open(delta, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(catalog_reload.DELTA_FIELDS)
+            for i in range(changes // 2):
+                writer.writerow(["update", games.title(i * 2), genres[i % len(genres)], "", "", "", ""])
+            for i in range(changes // 4):
+                writer.writerow(["remove", games.title(i * 2 + 1), "", "", "", "", ""])
+                writer.writerow(["add", f"New Game {i}", genres[i % len(genres)], 2025, 1, 10, 100])
+
+        prefs = SAMPLE_PREFERENCES["one genre"]
+        latencies = []
+        stop = threading.Event()
+
+        def serve() -> None:
+            while not stop.is_set():
+                start = time.perf_counter()
+                recommender.rank(handle.current(), prefs)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        report("recommend (one genre, before reload)", time_it(lambda: recommender.rank(handle.current(), prefs)))
+        server = threading.Thread(target=serve)
+        server.start()
+        stats = catalog_reload.CatalogReloader(handle, cache.RecommendationCache()).reload(delta)
+        stop.set()
+        server.join()
+        report(f"reload delta ({changes} changes)", (stats.build_seconds + stats.swap_seconds) * 1000)
+        report("  swap (reader pause)", stats.swap_seconds * 1000)
+        report(f"recommend during reload (p50, {len(latencies)} requests)", statistics.median(latencies))
+        report("recommend during reload (max)", max(latencies))
+
+
+def bench_similarity(games: catalog.GameCatalog, queries: int = 200) -> None:
+    # Builds the "more like this" index, then compares IVF queries with brute force on speed and recall@k
+    start = time.perf_counter()
+    index = similarity.SimilarityIndex.build(games)
+    report(f"build similarity index ({len(games)} games)", (time.perf_counter() - start) * 1000)
+    print(f"{'  index size':<48} {index.nbytes / 2**20:10.1f} MiB")
+
+    rows = np.random.default_rng(1).choice(len(games), size=queries, replace=False).tolist()
+    approximate = {row: index.similar(row) for row in rows}
+    exact = {row: index.exact(row) for row in rows}
+    # Games tied with the k-th exact result are as correct as it, so recall counts results scoring at least that much
+    recall = statistics.mean(float(np.mean(approximate[row][1] >= exact[row][1][-1] - 1e-6)) for row in rows)
+    report(f"similar, IVF ({similarity.PROBES} probes)", time_it(lambda: [index.similar(row) for row in rows], repeat=3) / queries)
+    report("similar, brute force", time_it(lambda: [index.exact(row) for row in rows[:20]], repeat=3) / 20)
+    print(f"{f'  recall@{similarity.SIMILAR_RESULTS}':<48} {recall:10.3f}")
+
+
+def bench_neighbours(games: catalog.GameCatalog, users: int = 50_000, per_user: int = 40, queries: int = 200) -> None:
+    # Builds item-item neighbours from a synthetic play history, then times recommendations with the history boost
+    with tempfile.TemporaryDirectory() as directory:
+        history = os.path.join(directory, "history.csv")
+        collaborative.generate_history(games, history, users, per_user)
+        path = os.path.join(directory, "neighbours.snap")
+        stats = collaborative.build_neighbours(history, games, path)
+        report(f"build neighbours ({stats['interactions']} interactions)", stats["seconds"] * 1000)
+        print(f"{'  interactions per second':<48} {stats['interactions'] / stats['seconds']:10.0f}")
+        print(f"{'  file size':<48} {os.path.getsize(path) / 2**20:10.1f} MiB")
+
+        model = collaborative.NeighbourModel.open(path)
+        rng = np.random.default_rng(2)
+        population = [
+            User(f"user{i}", preferences={"genre": {rng.choice(preference_options.GENRE_OPTIONS)}})
+            for i in rng.choice(users, size=queries, replace=False)
+        ]
+        results = cache.RecommendationCache()
+        report("NeighbourModel.affinity (per user)", time_it(lambda: [model.affinity(model.history(user.username)) for user in population], repeat=3) / queries)
+        report("rank_for (per user)", time_it(lambda: [recommender.rank_for(user, games, cache=results) for user in population], repeat=3) / queries)
+        report("rank_with_history (per user)", time_it(lambda: [collaborative.rank_with_history(user, games, model, cache=results) for user in population], repeat=3) / queries)
+        del model # Unmaps the file before the directory goes
+
+
+def bench_ingest(games: catalog.GameCatalog, description_bytes: int = 10_000) -> None:
+    # Rebuilds the snapshot from Steam-style dumps of the catalog, padded with description text like real ones
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in (".jsonl", ".csv"):
+            dump = os.path.join(directory, "dump" + extension)
+            ingest.generate_dump(dump, games, description_bytes)
+            stats = ingest.ingest(dump, os.path.join(directory, "games.snap"), processes=1)
+            report(f"ingest {extension} dump ({stats['bytes'] / 2**20:.0f} MiB, {stats['rows']} games)", stats["seconds"] * 1000)
+            print(f"{'  throughput':<48} {stats['mib_per_second']:10.1f} MiB/s")
+            os.remove(dump)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Game Recommender benchmarks")
+    parser.add_argument("--games", type=int, default=catalog.SYNTHETIC_SIZE, help="Synthetic catalog size")
+    parser.add_argument("--users", type=int, default=200_000, help="Users for the account and batch benchmarks")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    games = catalog.generate_synthetic(args.games)
+    report(f"generate synthetic catalog ({args.games} games)", (time.perf_counter() - start) * 1000)
+
+    bench_recommend(games)
+    bench_plans(games)
+    bench_threshold(games)
+    bench_threshold(catalog.generate_synthetic(1_000_000))
+    bench_indexes(games)
+    bench_cache(games)
+    bench_incremental(games)
+    bench_startup(games)
+    bench_shared_catalog(games)
+    bench_reload(games)
+    bench_similarity(games)
+    bench_similarity(catalog.generate_synthetic(1_000_000))
+    bench_neighbours(games)
+    bench_ingest(games)
+    bench_user_store(args.users)
+    bench_user_memory()
+    bench_catalog_memory()
+    bench_journal()
+    bench_logins()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Docstring for cache
+
+Recommendation result cache shared by every session in the process (Sprint 2)
+
+Results are keyed on the catalog version plus a canonical fingerprint of the
+preferences, so users with identical preferences share one entry. Entries
+expire after a TTL, the least recently used ones are evicted past a size limit,
+and an entry is dropped as soon as no user's current preferences point at it,
+whether they changed them or logged out.
+"""
+
+import hashlib
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
+
+from preference_options import canonical_preferences
+
+
+DEFAULT_MAX_ENTRIES = 10_000
+DEFAULT_TTL = 600.0 # Seconds
+
+# catalog version, preference fingerprint, number of results
+CacheKey = tuple[str, str, int]
+# catalog version, preference fingerprint; every result count for one set of preferences
+PreferenceKey = tuple[str, str]
+
+
+def preferences_fingerprint(preferences: dict[str, Any]) -> str:
+    # Canonical hash of a preference dict, unset values (None, empty set, empty tuple) all look the same
+    canonical = tuple(canonical_preferences(preferences))
+    return hashlib.blake2b(repr(canonical).encode("utf-8"), digest_size=12).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    rows: np.ndarray
+    scores: np.ndarray
+    expires_at: float
+
+    @property
+    def nbytes(self) -> int:
+        return self.rows.nbytes + self.scores.nbytes
+
+
+class RecommendationCache:
+    """Thread-safe LRU + TTL cache of ranked row ids"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.catalog_version: str | None = None
+        self.catalog_generation = 0
+
+        self._entries: OrderedDict[CacheKey, CacheEntry] = OrderedDict()
+        self._by_preferences: dict[PreferenceKey, set[CacheKey]] = {} # Every result count cached per preference key
+        self._owners: dict[int, tuple[weakref.ref, PreferenceKey]] = {} # id(owner) -> (weak ref to it, key it wants)
+        self._refs: Counter[PreferenceKey] = Counter()
+        # Owners that were collected, released on the next call that takes the lock. Their weakref
+        # callbacks only append here: collection can happen on a thread that already holds the lock.
+        self._dead: deque[tuple[int, weakref.ref]] = deque()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: CacheKey) -> CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: CacheKey, rows: np.ndarray, scores: np.ndarray) -> None:
+        with self._lock:
+            if self.catalog_version is not None and key[0] != self.catalog_version:
+                return # Ranked on a catalog that was replaced meanwhile
+            self._release_dead()
+            self._entries[key] = CacheEntry(rows, scores, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            self._by_preferences.setdefault(key[:2], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: CacheKey) -> None:
+        del self._entries[key]
+        keys = self._by_preferences[key[:2]]
+        keys.discard(key)
+        if not keys:
+            del self._by_preferences[key[:2]]
+
+    def track(self, owner: Any, key: CacheKey) -> None:
+        # Records that owner (usually a User) currently wants results for key's preferences.
+        # When the owner's preferences change, or the owner is collected (the user logged out),
+        # their old entries are dropped unless someone else still uses them.
+        preference_key = key[:2]
+        with self._lock:
+            self._release_dead()
+            ident = id(owner)
+            current = self._owners.get(ident)
+            if current is not None and current[0]() is not owner:
+                self._owners.pop(ident) # A collected owner's id, reused before its callback was processed
+                self._release(current[1])
+                current = None
+            if current is not None and current[1] == preference_key:
+                return
+            if current is None:
+                dead = self._dead
+                ref = weakref.ref(owner, lambda ref, ident=ident: dead.append((ident, ref)))
+            else:
+                ref = current[0]
+            self._owners[ident] = (ref, preference_key)
+            self._refs[preference_key] += 1
+            if current is not None:
+                self._release(current[1])
+
+    def _release_dead(self) -> None:
+        while self._dead:
+            ident, ref = self._dead.popleft()
+            current = self._owners.get(ident)
+            if current is not None and current[0] is ref: # Not already replaced by a new owner with the same id
+                del self._owners[ident]
+                self._release(current[1])
+
+    def _release(self, preference_key: PreferenceKey) -> None:
+        self._refs[preference_key] -= 1
+        if self._refs[preference_key] <= 0:
+            del self._refs[preference_key]
+            for key in self._by_preferences.pop(preference_key, ()):
+                del self._entries[key]
+                self.invalidations += 1
+
+    def set_catalog_version(self, version: str, generation: int = 0) -> None:
+        # Drops every entry computed against a different catalog.
+        # Requests still finishing on an older generation after a reload don't switch it back.
+        with self._lock:
+            if version == self.catalog_version or generation < self.catalog_generation:
+                return
+            self.catalog_version = version
+            self.catalog_generation = generation
+            for key in [key for key in self._entries if key[0] != version]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_preferences.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        with self._lock:
+            self._release_dead()
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": sum(entry.nbytes for entry in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "tracked_preferences": len(self._refs),
+            }
+
+
+# One cache for every session in the process
+shared_cache = RecommendationCache()
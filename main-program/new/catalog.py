@@ -0,0 +1,434 @@
+"""
+Docstring for catalog
+
+Column-oriented game catalog (Sprint 2)
+
+Every attribute of a game is stored in its own NumPy array, so row i of each
+column describes game i. The recommender scores whole columns at once instead
+of looping over games in Python.
+
+Nothing is kept as per-game Python strings: titles are one UTF-8 buffer plus
+offsets (StringTable), tags are a bitmask over GENRE_OPTIONS, and repetitive text
+such as developers and publishers is an integer code per game into a shared
+dictionary of the distinct values (DictionaryColumn). Strings are decoded only
+for the rows that are actually shown.
+"""
+
+import csv
+import hashlib
+import math
+import os
+from functools import cached_property
+from typing import Iterable, Iterator
+
+import numpy as np
+
+import preference_options
+from preference_options import genre_mask
+
+
+CATALOG_PATH = os.getenv(
+    "GAME_CATALOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "games.csv"),
+)
+
+# Dataset fields, in the order they appear in the CSV header. developer and publisher may be left out.
+CSV_FIELDS = ["title", "genres", "release_year", "players", "length_hours", "popularity", "developer", "publisher"]
+GENRE_SEPARATOR = ";"
+
+# Column dtypes, kept small so 100k+ rows stay a few megabytes
+GENRE_DTYPE = np.uint32
+YEAR_DTYPE = np.int16
+PLAYERS_DTYPE = np.int16
+LENGTH_DTYPE = np.float32
+POPULARITY_DTYPE = np.float32
+CODE_DTYPE = np.uint32 # Dictionary codes of string columns
+
+SYNTHETIC_SIZE = 100_000
+
+
+class StringTable:
+    """Strings packed into one UTF-8 buffer plus offsets, decoded only when read"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data # uint8 buffer
+        self.offsets = offsets # uint64, string i is data[offsets[i]:offsets[i + 1]]
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> "StringTable":
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return bytes(self.data[start:end]).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        # Decodes from one copy of the buffer, indexing the arrays once per string is several times slower
+        data = bytes(self.data)
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield data[start:end].decode("utf-8")
+
+
+class StringInterner:
+    """Gives every distinct string a code in first-seen order, "" is always code 0"""
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.values = [""]
+        self.codes = {"": 0}
+        for value in values:
+            self.code(value)
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def table(self) -> StringTable:
+        return StringTable.from_strings(self.values)
+
+
+class DictionaryColumn:
+    """A string per row stored as an integer code into a table of the distinct strings"""
+
+    def __init__(self, codes: np.ndarray, values: StringTable):
+        self.codes = codes # CODE_DTYPE per row
+        self.values = values # Distinct strings, code 0 is "" (unknown)
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> "DictionaryColumn":
+        interner = StringInterner()
+        codes = np.fromiter((interner.code(s) for s in strings), dtype=CODE_DTYPE)
+        return cls(codes, interner.table())
+
+    @classmethod
+    def empty(cls, rows: int) -> "DictionaryColumn":
+        # Every row unknown
+        return cls(np.zeros(rows, dtype=CODE_DTYPE), StringTable.from_strings([""]))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, row: int) -> str:
+        return self.values[int(self.codes[row])]
+
+    def __iter__(self) -> Iterator[str]:
+        values = list(self.values)
+        return (values[code] for code in self.codes.tolist())
+
+    def interner(self) -> StringInterner:
+        # The dictionary as an interner, for building a column that extends this one
+        return StringInterner(self.values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.values.data.nbytes + self.values.offsets.nbytes
+
+
+class SortedIndex:
+    """Row ids ordered by one column, answers range predicates with binary search"""
+
+    def __init__(self, values: np.ndarray):
+        self.order = np.argsort(values, kind="stable").astype(np.int32)
+        self.values = np.asarray(values)[self.order]
+
+    @classmethod
+    def from_sorted(cls, order: np.ndarray, values: np.ndarray) -> "SortedIndex":
+        # Wraps an index that was already built, e.g. sections of a mapped snapshot
+        index = cls.__new__(cls)
+        index.order, index.values = order, values
+        return index
+
+    def _bounds(self, low: float, high: float) -> tuple[int, int]:
+        # Bounds are converted to the column dtype first, otherwise NumPy would upcast
+        # (copy) the entire sorted column on every search
+        dtype = self.values.dtype
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            low = min(max(math.ceil(low), info.min), info.max + 1)
+            high = max(min(math.floor(high), info.max), info.min - 1)
+            if low > info.max or high < info.min or low > high:
+                return 0, 0
+        start = int(np.searchsorted(self.values, dtype.type(low), "left"))
+        end = int(np.searchsorted(self.values, dtype.type(high), "right"))
+        return start, max(start, end)
+
+    def count(self, low: float, high: float) -> int:
+        # Number of rows with low <= value <= high, without touching the rows
+        start, end = self._bounds(low, high)
+        return end - start
+
+    def rows(self, low: float, high: float) -> np.ndarray:
+        # Row ids with low <= value <= high, in value order
+        start, end = self._bounds(low, high)
+        return self.order[start:end]
+
+
+class GenrePostings:
+    """Rows of every genre ordered by popularity score, best first, for early-terminating top-k merges"""
+
+    def __init__(self, offsets: np.ndarray, rows: np.ndarray):
+        self.offsets = offsets # Genre i (bit i of a mask) owns rows[offsets[i]:offsets[i + 1]]
+        self.rows = rows
+
+    @classmethod
+    def build(cls, genre_mask: np.ndarray, popularity_score: np.ndarray) -> "GenrePostings":
+        lists = []
+        for genre in preference_options.GENRE_OPTIONS:
+            members = np.flatnonzero(genre_mask & preference_options.GENRE_BITS[genre])
+            lists.append(members[np.argsort(-popularity_score[members], kind="stable")].astype(np.int32))
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([len(members) for members in lists], out=offsets[1:])
+        return cls(offsets, np.concatenate(lists))
+
+    def postings(self, bit: int) -> np.ndarray:
+        return self.rows[self.offsets[bit]:self.offsets[bit + 1]]
+
+    def count(self, mask: int) -> int:
+        # Total length of the lists of the genres in mask, rows with several of them count once per list
+        return sum(int(self.offsets[bit + 1] - self.offsets[bit]) for bit in range(len(self.offsets) - 1) if mask >> bit & 1)
+
+
+class GameCatalog:
+    """Games stored as parallel column arrays"""
+
+    # Numeric columns in storage order, shared with the snapshot format
+    COLUMNS = {
+        "genre_mask": GENRE_DTYPE,
+        "release_year": YEAR_DTYPE,
+        "players": PLAYERS_DTYPE,
+        "length": LENGTH_DTYPE,
+        "popularity": POPULARITY_DTYPE,
+    }
+
+    # Range indexes by attribute name, with the column each one sorts
+    INDEXES = {"release_year_index": "release_year", "length_index": "length"}
+
+    # Dictionary-encoded text columns, "" where the dataset doesn't say
+    STRING_COLUMNS = ("developer", "publisher")
+
+    def __init__(
+        self,
+        titles: Iterable[str] | StringTable,
+        genre_mask: np.ndarray,
+        release_year: np.ndarray,
+        players: np.ndarray,
+        length: np.ndarray,
+        popularity: np.ndarray,
+        version: str | None = None,
+        popularity_score: np.ndarray | None = None,
+        indexes: dict[str, SortedIndex] | None = None,
+        genre_postings: GenrePostings | None = None,
+        generation: int = 0,
+        developer: DictionaryColumn | Iterable[str] | None = None,
+        publisher: DictionaryColumn | Iterable[str] | None = None,
+    ):
+        self.titles = titles if isinstance(titles, StringTable) else StringTable.from_strings(titles)
+        self.genre_mask = np.asarray(genre_mask, dtype=GENRE_DTYPE)
+        self.release_year = np.asarray(release_year, dtype=YEAR_DTYPE)
+        self.players = np.asarray(players, dtype=PLAYERS_DTYPE)
+        self.length = np.asarray(length, dtype=LENGTH_DTYPE)
+        self.popularity = np.asarray(popularity, dtype=POPULARITY_DTYPE)
+
+        rows = len(self.titles)
+        for name in self.COLUMNS:
+            if len(getattr(self, name)) != rows:
+                raise ValueError(f"Column {name} has {len(getattr(self, name))} rows, expected {rows}")
+        for name, values in (("developer", developer), ("publisher", publisher)):
+            if values is None:
+                values = DictionaryColumn.empty(rows)
+            elif not isinstance(values, DictionaryColumn):
+                values = DictionaryColumn.from_strings(values)
+            if len(values) != rows:
+                raise ValueError(f"Column {name} has {len(values)} rows, expected {rows}")
+            setattr(self, name, values)
+
+        # Popularity squashed into 0..1 once, so scoring doesn't redo it per request.
+        # A snapshot stores it (and the indexes), so mapped catalogs share them instead of each process deriving its own.
+        if popularity_score is None:
+            scaled = np.log1p(np.maximum(self.popularity, 0))
+            top = scaled.max() if rows else 0
+            popularity_score = (scaled / top if top > 0 else scaled).astype(np.float32)
+        self.popularity_score = popularity_score
+        for name, index in (indexes or {}).items():
+            self.__dict__[name] = index # Fills the cached_property below
+        if genre_postings is not None:
+            self.__dict__["genre_postings"] = genre_postings
+
+        self._version = version
+        self.generation = generation # Snapshot generation, caches never go back to an older one
+
+    @property
+    def version(self) -> str:
+        # Content hash identifying this exact catalog, caches key their results on it
+        if self._version is None:
+            self._version = content_version(self)
+        return self._version
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    # Range indexes are built on first use so opening a snapshot stays cheap
+    @cached_property
+    def release_year_index(self) -> SortedIndex:
+        return SortedIndex(self.release_year)
+
+    @cached_property
+    def length_index(self) -> SortedIndex:
+        return SortedIndex(self.length)
+
+    @cached_property
+    def genre_postings(self) -> GenrePostings:
+        return GenrePostings.build(self.genre_mask, self.popularity_score)
+
+    def title(self, row: int) -> str:
+        return self.titles[row]
+
+    def developer_of(self, row: int) -> str:
+        return self.developer[row]
+
+    def publisher_of(self, row: int) -> str:
+        return self.publisher[row]
+
+    def genres(self, row: int) -> list[str]:
+        return preference_options.genres_from_mask(int(self.genre_mask[row]))
+
+    def genre_matches(self, mask: int, require_all: bool = False) -> np.ndarray:
+        # Boolean column, true for games with any (or all) of the genres in mask
+        if require_all:
+            return (self.genre_mask & mask) == mask
+        return (self.genre_mask & mask) != 0
+
+
+def content_version(catalog: GameCatalog) -> str:
+    # Hashes every column so two catalogs with the same games share a version
+    digest = hashlib.blake2b(digest_size=16)
+    for name in GameCatalog.COLUMNS:
+        digest.update(np.ascontiguousarray(getattr(catalog, name)).tobytes())
+    # Every title followed by a zero byte, made from the buffer without decoding it
+    titles = catalog.titles
+    digest.update(np.insert(np.asarray(titles.data), np.asarray(titles.offsets[1:], dtype=np.intp), 0).tobytes())
+    for name in GameCatalog.STRING_COLUMNS:
+        # Codes depend on the order strings were first seen in, so the used strings are hashed
+        # in sorted order with codes renumbered to match
+        column = getattr(catalog, name)
+        values = list(column.values)
+        used = np.flatnonzero(np.bincount(column.codes, minlength=len(values))).tolist()
+        if used in ([], [0]):
+            continue # Catalogs without the column keep the version they had before it existed
+        order = sorted(used, key=values.__getitem__)
+        ranks = np.zeros(len(values), dtype=CODE_DTYPE)
+        ranks[order] = np.arange(len(order), dtype=CODE_DTYPE)
+        digest.update(name.encode("utf-8"))
+        digest.update(ranks[column.codes].tobytes())
+        for code in order:
+            digest.update(values[code].encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+def load_csv(path: str) -> GameCatalog:
+    # Reads a dataset with the CSV_FIELDS header into column arrays
+    titles = []
+    masks, years, players, lengths, popularity = [], [], [], [], []
+    developers, publishers = StringInterner(), StringInterner()
+    developer_codes, publisher_codes = [], []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            titles.append(row["title"])
+            masks.append(genre_mask(row["genres"].split(GENRE_SEPARATOR)))
+            years.append(int(row["release_year"] or 0))
+            players.append(int(row["players"] or 1))
+            lengths.append(float(row["length_hours"] or 0))
+            popularity.append(float(row["popularity"] or 0))
+            developer_codes.append(developers.code((row.get("developer") or "").strip()))
+            publisher_codes.append(publishers.code((row.get("publisher") or "").strip()))
+    return GameCatalog(
+        titles, masks, years, players, lengths, popularity,
+        developer=DictionaryColumn(np.array(developer_codes, dtype=CODE_DTYPE), developers.table()),
+        publisher=DictionaryColumn(np.array(publisher_codes, dtype=CODE_DTYPE), publishers.table()),
+    )
+
+
+def write_csv(catalog: GameCatalog, path: str) -> None:
+    # Writes a catalog back out in the format load_csv reads
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        for row in range(len(catalog)):
+            writer.writerow([
+                catalog.title(row),
+                GENRE_SEPARATOR.join(catalog.genres(row)),
+                int(catalog.release_year[row]),
+                int(catalog.players[row]),
+                float(catalog.length[row]),
+                float(catalog.popularity[row]),
+                catalog.developer_of(row),
+                catalog.publisher_of(row),
+            ])
+
+
+_TITLE_WORDS = (
+    ["Dark", "Lost", "Iron", "Neon", "Silent", "Crimson", "Hollow", "Star", "Wild", "Broken"],
+    ["Kingdom", "Frontier", "Legacy", "Protocol", "Odyssey", "Horizon", "Rift", "Citadel", "Harvest", "Circuit"],
+)
+
+
+def generate_synthetic(size: int = SYNTHETIC_SIZE, seed: int = 0) -> GameCatalog:
+    # Builds a random Steam-like catalog, used when no dataset is present and for benchmarks
+    rng = np.random.default_rng(seed)
+    first, second = _TITLE_WORDS
+    titles = [f"{first[i % 10]} {second[i // 10 % 10]} {i // 100 + 1}" for i in range(size)]
+
+    # Each game gets one to four genres
+    genre_count = len(preference_options.GENRE_OPTIONS)
+    masks = np.zeros(size, dtype=GENRE_DTYPE)
+    for _ in range(4):
+        bits = rng.integers(0, genre_count, size)
+        keep = rng.random(size) < 0.6
+        masks |= np.where(keep, 1 << bits, 0).astype(GENRE_DTYPE)
+    masks[masks == 0] = 1 << rng.integers(0, genre_count, int((masks == 0).sum()))
+
+    years = rng.integers(1985, 2026, size)
+    players = rng.choice([1, 1, 1, 2, 2, 4, 8, 64], size)
+    lengths = np.round(rng.lognormal(2.3, 0.9, size), 1)
+    popularity = rng.pareto(1.2, size) * 100
+
+    # About 20 games per studio, each studio signed to one of a fifth as many publishers.
+    # Codes are drawn directly, so no per-game strings are made.
+    studios = max(size // 20, 1)
+    publishers = max(studios // 5, 1)
+    developer_codes = (1 + rng.integers(0, studios, size)).astype(CODE_DTYPE)
+    publisher_of_studio = np.r_[0, 1 + rng.integers(0, publishers, studios)].astype(CODE_DTYPE)
+    suffixes = ["Interactive", "Entertainment", "Publishing", "Digital"]
+    developer_names = [""] + [f"{first[i % 10]}{second[i // 10 % 10].lower()} Studio {i // 100 + 1}" for i in range(studios)]
+    publisher_names = [""] + [f"{second[i % 10]} {suffixes[i // 10 % 4]} {i // 40 + 1}" for i in range(publishers)]
+
+    return GameCatalog(
+        titles,
+        masks,
+        years,
+        players,
+        lengths,
+        popularity,
+        developer=DictionaryColumn(developer_codes, StringTable.from_strings(developer_names)),
+        publisher=DictionaryColumn(publisher_of_studio[developer_codes], StringTable.from_strings(publisher_names)),
+    )
+
+
+def load_default_catalog() -> GameCatalog:
+    # The current generation of the shared snapshot at SNAPSHOT_PATH, compiled from CATALOG_PATH
+    # (or the synthetic catalog when there is no dataset) the first time any process needs it
+    import snapshot
+
+    return snapshot.default_handle().current()
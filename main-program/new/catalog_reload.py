@@ -0,0 +1,225 @@
+"""
+Docstring for catalog_reload
+
+Hot catalog updates from delta files (Sprint 2)
+
+New games and tag changes arrive as delta files instead of a whole new dataset.
+A delta is applied to the newest published snapshot, producing a new immutable
+catalog that is written as the next snapshot generation (see
+snapshot.CatalogHandle). Nothing running has to restart: requests that already
+hold the old catalog finish on it, new requests get the new one, and every other
+process attached to the snapshot moves over on its handle's next check.
+
+Delta files are CSVs with the dataset's columns plus an action column:
+    action,title,genres,release_year,players,length_hours,popularity,developer,publisher
+    add,Brand New Game,Action;Indie,2025,1,12,350,Tiny Studio,
+    update,Old Favourite,Action;RPG,,,,,,
+    remove,Delisted Game,,,,,,,
+Games are matched by title. An update only changes the columns it fills in.
+Changes apply in file order, so a game can be added and then updated by one delta.
+
+Usage:
+    python catalog_reload.py delta.csv [--snapshot games.snap]
+"""
+
+import argparse
+import csv
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import numpy as np
+
+import recommender
+import snapshot
+from cache import RecommendationCache
+from catalog import CODE_DTYPE, GENRE_SEPARATOR, DictionaryColumn, GameCatalog
+from preference_options import genre_mask
+
+
+ACTIONS = ("add", "update", "remove")
+DELTA_FIELDS = ["action", "title", "genres", "release_year", "players", "length_hours", "popularity", "developer", "publisher"]
+
+# Dataset field -> (catalog column, parser, value for a new game that leaves it empty)
+FIELDS: dict[str, tuple[str, Callable[[str], Any], Any]] = {
+    "genres": ("genre_mask", lambda text: genre_mask(text.split(GENRE_SEPARATOR)), 0),
+    "release_year": ("release_year", int, 0),
+    "players": ("players", int, 1),
+    "length_hours": ("length", float, 0.0),
+    "popularity": ("popularity", float, 0.0),
+    "developer": ("developer", str, ""),
+    "publisher": ("publisher", str, ""),
+}
+
+
+@dataclass
+class Change:
+    """One line of a delta file"""
+    action: str
+    title: str
+    values: dict[str, Any] # Catalog column -> new value, only the columns the line filled in
+    line: int
+
+
+@dataclass
+class ReloadStats:
+    added: int
+    updated: int
+    removed: int
+    rows: int # Games in the new catalog
+    generation: int
+    build_seconds: float # Reading, applying and writing the delta, while requests carry on
+    swap_seconds: float # Moving this process to the new catalog, the only time a request could wait
+
+
+def read_delta(path: str) -> list[Change]:
+    changes = []
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None or not {"action", "title"} <= set(reader.fieldnames):
+            raise ValueError(f"{path} needs at least the columns action and title")
+        for line, row in enumerate(reader, start=2):
+            action = (row["action"] or "").strip().lower()
+            if action not in ACTIONS:
+                raise ValueError(f"{path}:{line}: Unknown action {row['action']!r}")
+            title = (row["title"] or "").strip()
+            if not title:
+                raise ValueError(f"{path}:{line}: Missing title")
+            values = {}
+            for field, (column, parse, _) in FIELDS.items():
+                text = (row.get(field) or "").strip()
+                if text:
+                    try:
+                        values[column] = parse(text)
+                    except ValueError:
+                        raise ValueError(f"{path}:{line}: Invalid {field} {text!r}") from None
+            changes.append(Change(action, title, values, line))
+    return changes
+
+
+def apply_delta(games: GameCatalog, changes: list[Change]) -> tuple[GameCatalog, dict[str, int]]:
+    # Builds a new catalog with the changes applied, games itself is left untouched.
+    # Returns it with the number of games added, updated and removed.
+    titles = list(games.titles)
+    rows = {title: row for row, title in enumerate(titles)}
+    columns = {name: np.array(getattr(games, name)) for name in GameCatalog.COLUMNS} # Writable copies
+    # String columns are edited as codes, new strings extend the existing dictionaries
+    interners = {name: getattr(games, name).interner() for name in GameCatalog.STRING_COLUMNS}
+    columns |= {name: np.array(getattr(games, name).codes) for name in GameCatalog.STRING_COLUMNS}
+
+    def encoded(values: dict[str, Any]) -> dict[str, Any]:
+        return {column: interners[column].code(value) if column in interners else value for column, value in values.items()}
+
+    removed = np.zeros(len(games), dtype=bool)
+    updated: set[int] = set()
+    added: dict[str, dict[str, Any]] = {} # Insertion ordered, appended after the existing rows
+
+    for change in changes:
+        row = rows.get(change.title)
+        present = row is not None and not removed[row]
+        match change.action:
+            case "add":
+                if present or change.title in added:
+                    raise ValueError(f"Line {change.line}: {change.title} is already in the catalog")
+                values = encoded({column: default for column, _, default in FIELDS.values()} | change.values)
+                if row is not None: # Removed earlier in this delta, so it's really a replacement
+                    removed[row] = False
+                    for column, value in values.items():
+                        columns[column][row] = value
+                    updated.add(row)
+                else:
+                    added[change.title] = values
+            case "update":
+                if change.title in added:
+                    added[change.title].update(encoded(change.values))
+                elif present:
+                    for column, value in encoded(change.values).items():
+                        columns[column][row] = value
+                    updated.add(row)
+                else:
+                    raise ValueError(f"Line {change.line}: {change.title} is not in the catalog")
+            case "remove":
+                if change.title in added:
+                    del added[change.title]
+                elif present:
+                    removed[row] = True
+                    updated.discard(row)
+                else:
+                    raise ValueError(f"Line {change.line}: {change.title} is not in the catalog")
+
+    kept = np.flatnonzero(~removed)
+    titles = [titles[row] for row in kept.tolist()] + list(added)
+    dtypes = GameCatalog.COLUMNS | {name: CODE_DTYPE for name in GameCatalog.STRING_COLUMNS}
+    for name, dtype in dtypes.items():
+        new_values = np.array([values[name] for values in added.values()], dtype=dtype)
+        columns[name] = np.concatenate([columns[name][kept], new_values])
+    for name, interner in interners.items():
+        columns[name] = DictionaryColumn(columns[name], interner.table()) # Strings no game uses any more stay, codes don't move
+    counts = {"added": len(added), "updated": len(updated), "removed": int(removed.sum())}
+    return GameCatalog(titles, **columns), counts
+
+
+class CatalogReloader:
+    """Applies delta files to a published catalog without stopping anything that reads it"""
+
+    def __init__(self, handle: snapshot.CatalogHandle, cache: RecommendationCache = recommender.shared_cache):
+        self.handle = handle
+        self.cache = cache
+        # One reload at a time, in the order they were asked for
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-reload")
+
+    def reload(self, delta_path: str) -> ReloadStats:
+        start = time.perf_counter()
+        changes = read_delta(delta_path) # Bad files fail here, before anything is published
+        counts = {}
+
+        def change(base: GameCatalog) -> GameCatalog:
+            games, applied = apply_delta(base, changes)
+            counts.update(applied)
+            return games
+
+        games = self.handle.update(change)
+        # Results for the old catalog are dropped now rather than on the next request
+        self.cache.set_catalog_version(games.version, games.generation)
+        total = time.perf_counter() - start
+        return ReloadStats(
+            **counts,
+            rows=len(games),
+            generation=games.generation,
+            build_seconds=total - self.handle.swap_seconds,
+            swap_seconds=self.handle.swap_seconds,
+        )
+
+    def reload_in_background(self, delta_path: str) -> "Future[ReloadStats]":
+        return self._executor.submit(self.reload, delta_path)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Apply a delta file to the published catalog")
+    parser.add_argument("delta")
+    parser.add_argument("--snapshot", default=snapshot.SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    reloader = CatalogReloader(snapshot.CatalogHandle(snapshot.ensure_snapshot(args.snapshot)))
+    try:
+        stats = reloader.reload(args.delta)
+    except ValueError as e:
+        print(e)
+        return 1
+    finally:
+        reloader.close()
+
+    print(f"Published generation {stats.generation} to {args.snapshot}: {stats.rows} games")
+    print(f"{'added / updated / removed':<32} {stats.added} / {stats.updated} / {stats.removed}")
+    print(f"{'build':<32} {stats.build_seconds * 1000:10.1f} ms")
+    print(f"{'swap':<32} {stats.swap_seconds * 1000:10.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Docstring for credentials
+
+Password hashing and asynchronous login verification (Sprint 2)
+
+Passwords are stored as scrypt hashes. Each verification deliberately costs tens
+of milliseconds of CPU, so the async CredentialVerifier runs it on the shared
+process pool instead of the Textual event loop. Stored hashes made with weaker
+parameters (or legacy plaintext passwords) are rehashed on the next good login.
+
+Encoded format:
+    scrypt$<log2 N>$<r>$<p>$<salt hex>$<hash hex>
+"""
+
+import asyncio
+import hashlib
+import hmac
+import os
+from dataclasses import dataclass
+
+import workers
+from auth_and_preferences import User
+from user_store import UserStore
+
+
+ALGORITHM = "scrypt"
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+MAX_HASH_MEMORY = 1 << 30 # Stored hashes whose parameters need more scrypt memory than this are treated as corrupt
+
+# Bounds how many logins can wait for the pool at once, the rest are queued on the event loop
+MAX_PENDING_VERIFICATIONS = 64
+
+
+@dataclass(frozen=True)
+class HashParams:
+    """scrypt work factor; raising log_n doubles the CPU and memory cost of each hash"""
+    log_n: int = int(os.getenv("PASSWORD_HASH_COST", "14"))
+    r: int = 8
+    p: int = 1
+
+
+DEFAULT_PARAMS = HashParams()
+
+
+def _scrypt(password: str, salt: bytes, params: HashParams) -> bytes:
+    return hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=salt,
+        n=2 ** params.log_n,
+        r=params.r,
+        p=params.p,
+        maxmem=256 * 2 ** params.log_n * params.r, # Twice what scrypt needs
+        dklen=HASH_BYTES,
+    )
+
+
+def hash_password(password: str, params: HashParams = DEFAULT_PARAMS) -> str:
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, params)
+    return f"{ALGORITHM}${params.log_n}${params.r}${params.p}${salt.hex()}${digest.hex()}"
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(ALGORITHM + "$")
+
+
+def parse_hash(stored: str) -> tuple[HashParams, bytes, bytes] | None:
+    # (params, salt, digest) of an encoded hash, None when it is malformed or asks for an unreasonable cost
+    try:
+        _, log_n, r, p, salt, digest = stored.split("$")
+        params = HashParams(int(log_n), int(r), int(p))
+        salt, digest = bytes.fromhex(salt), bytes.fromhex(digest)
+    except ValueError:
+        return None
+    if min(params.log_n, params.r, params.p) < 1 or params.log_n > 30 or 128 * params.r * 2 ** params.log_n > MAX_HASH_MEMORY:
+        return None
+    if params.p > 16 or not salt or len(digest) != HASH_BYTES:
+        return None
+    return params, salt, digest
+
+
+def verify_password(password: str, stored: str) -> bool:
+    # Constant-time comparison against a stored hash, or a legacy plaintext password.
+    # A corrupt hash never matches (CredentialVerifier still spends a decoy hash's time on it).
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    parsed = parse_hash(stored)
+    if parsed is None:
+        return False
+    params, salt, digest = parsed
+    return hmac.compare_digest(_scrypt(password, salt, params), digest)
+
+
+def needs_rehash(stored: str, params: HashParams = DEFAULT_PARAMS) -> bool:
+    # True for plaintext passwords, corrupt hashes and hashes made with different parameters
+    if not is_hashed(stored):
+        return True
+    parsed = parse_hash(stored)
+    return parsed is None or parsed[0] != params
+
+
+class CredentialVerifier:
+    """Checks usernames and passwords against a UserStore without blocking the event loop"""
+
+    def __init__(self, store: UserStore, params: HashParams = DEFAULT_PARAMS, max_pending: int = MAX_PENDING_VERIFICATIONS):
+        self.store = store
+        self.params = params
+        self._pending = asyncio.Semaphore(max_pending)
+        # Unknown usernames are checked against this so they take as long as wrong passwords
+        self._decoy = hash_password(os.urandom(8).hex(), params)
+
+    async def verify(self, username: str, password: str) -> User | None:
+        async with self._pending:
+            user = await workers.run_in_thread(self.store.get, username)
+            # Corrupt stored hashes fail like unknown usernames, after the same amount of work
+            usable = user is not None and (not is_hashed(user.password) or parse_hash(user.password) is not None)
+            stored = user.password if usable else self._decoy
+            valid = await workers.run_in_process(verify_password, password, stored)
+            if not (usable and valid):
+                return None
+
+            if needs_rehash(user.password, self.params):
+                user.password = await workers.run_in_process(hash_password, password, self.params)
+                await workers.run_in_thread(self.store.set_password, user.username, user.password)
+            return user
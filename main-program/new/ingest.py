@@ -0,0 +1,532 @@
+"""
+Docstring for ingest
+
+Streaming catalog ingestion from raw Steam dumps (Sprint 2)
+
+The public Steam datasets ship as multi-gigabyte CSV or JSON files, mostly
+descriptions, screenshots and review text the catalog never uses. They are
+never loaded whole. Instead:
+    1. The dump is split into CHUNK_BYTES byte ranges, which worker processes
+       parse in parallel. A range owns the records whose line starts inside it.
+    2. Each worker streams its range as batches of BATCH_ROWS records, already
+       normalized to catalog columns. Tags and genres become a GENRE_OPTIONS mask
+       titles one UTF-8 buffer with lengths, and developers and publishers
+       become codes into the batch's own dictionary, so no per-game Python
+       strings leave the worker.
+    3. The coordinator appends the batches, in file order, to one spill file per
+       column next to the snapshot, translating batch dictionary codes into the
+       catalog's shared dictionaries on the way.
+    4. The spilled columns are mapped as a GameCatalog and published as the
+       snapshot's next generation (see snapshot.CatalogHandle).
+The dump is read once, and memory is bounded by the batches in flight plus the
+finished columns (about 40 bytes per game) and the distinct developers and
+publishers, whatever the dump's size.
+
+Formats, by extension:
+    .csv            a header row then one game per line (the Kaggle Steam games
+                    CSV, or this app's own dataset CSV)
+    .jsonl, .ndjson one JSON object per line
+    .json           one object of {app id: game}, as in the Steam games JSON dump.
+                    Its records can't be told apart mid-file, so it is streamed
+                    by one process.
+CSV records must not contain raw line breaks inside quoted fields, or a byte
+range could start mid-record. Use --processes 1 for such files.
+
+A dataset CSV at GAME_CATALOG stays the source of truth: startup recompiles the
+snapshot from it when it exists, so publish dumps where there is none.
+
+Usage:
+    python ingest.py dump.json [--snapshot games.snap] [--processes N]
+    python ingest.py sample dump.jsonl [--games 100000] [--description-bytes 20000]
+"""
+
+import argparse
+import csv
+import functools
+import json
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Iterator, TextIO
+
+import numpy as np
+
+import catalog
+import snapshot
+import workers
+from catalog import CODE_DTYPE, DictionaryColumn, GameCatalog, StringInterner, StringTable
+from preference_options import GENRE_BITS, GENRE_OPTIONS
+
+
+CHUNK_BYTES = 64 << 20 # Bytes of the dump per worker task
+BATCH_ROWS = 10_000 # Records normalized at a time
+JSON_READ_CHARS = 1 << 20 # Smallest read while streaming a .json dump
+MAX_PLAYERS = int(np.iinfo(catalog.PLAYERS_DTYPE).max)
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "json"}
+
+# Catalog field -> record fields that can fill it, compared by _key, first present wins
+FIELD_NAMES = {
+    "title": ("name", "title"),
+    "release": ("releasedate", "releaseyear"),
+    "genres": ("genres",),
+    "tags": ("tags",),
+    "categories": ("categories",),
+    "players": ("players",),
+    "length_hours": ("lengthhours",),
+    "playtime_minutes": ("averageplaytimeforever", "medianplaytimeforever"),
+    "popularity": ("popularity",),
+    "positive": ("positive",),
+    "negative": ("negative",),
+    "developer": ("developers", "developer"),
+    "publisher": ("publishers", "publisher"),
+}
+
+# Steam categories -> how many players a game with them supports at least
+PLAYER_CATEGORIES = {
+    "singleplayer": 1,
+    "sharedsplitscreen": 2,
+    "sharedsplitscreencoop": 2,
+    "sharedsplitscreenpvp": 2,
+    "coop": 2,
+    "multiplayer": 4,
+    "onlinecoop": 4,
+    "onlinepvp": 4,
+    "lancoop": 4,
+    "lanpvp": 4,
+    "pvp": 4,
+    "mmo": 64,
+}
+
+YEAR_PATTERN = re.compile(r"(?<!\d)(\d{4})(?!\d)")
+LIST_SEPARATORS = re.compile(r"[,;]")
+
+
+@functools.lru_cache(maxsize=4096)
+def _key(name: str) -> str:
+    # Field and tag names compared without case or punctuation: "Free to Play" == "free-to-play"
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+GENRE_KEYS = {_key(genre): GENRE_BITS[genre] for genre in GENRE_OPTIONS}
+
+
+@functools.lru_cache(maxsize=65_536)
+def _text_mask(text: str) -> int:
+    # Dump tag lists repeat endlessly, so each distinct list string is only split once
+    return sum({GENRE_KEYS.get(_key(name), 0) for name in LIST_SEPARATORS.split(text)})
+
+
+def genre_mask_of(value: Any) -> int:
+    # Genre mask of a tag or genre field: "Action,Indie", ["Action", "Indie"] or {"Action": 120, ...}
+    if not value:
+        return 0
+    if isinstance(value, str):
+        return _text_mask(value)
+    mask = 0
+    for name in value: # Lists and the keys of tag -> votes objects alike
+        mask |= GENRE_KEYS.get(_key(str(name)), 0)
+    return mask
+
+
+def players_of(categories: Any) -> int:
+    names = LIST_SEPARATORS.split(categories) if isinstance(categories, str) else categories or ()
+    return max((PLAYER_CATEGORIES.get(_key(str(name)), 1) for name in names), default=1)
+
+
+@functools.lru_cache(maxsize=65_536)
+def _text_names(text: str) -> str:
+    return ", ".join(name.strip() for name in text.split(","))
+
+
+def _names(value: Any) -> str:
+    # A developer or publisher field as one string, the same whatever the format:
+    # "Valve,Hidden Path" and ["Valve", "Hidden Path"] are both "Valve, Hidden Path"
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return _text_names(value.strip())
+    return ", ".join(str(name).strip() for name in value)
+
+
+def _number(value: Any, default: float = 0.0) -> float:
+    try:
+        return float(value) if value not in (None, "") else default
+    except (TypeError, ValueError):
+        return default
+
+
+@dataclass
+class Batch:
+    """Normalized records, ready to append to the catalog columns"""
+    titles: bytes # UTF-8 titles back to back
+    title_lengths: np.ndarray
+    columns: dict[str, np.ndarray] # GameCatalog.COLUMNS
+    strings: dict[str, tuple[list[str], np.ndarray]] # GameCatalog.STRING_COLUMNS as (batch dictionary, codes into it)
+    skipped: int # Records without a title
+
+
+class _BatchBuilder:
+    def __init__(self):
+        self._reset()
+
+    def _reset(self) -> None:
+        self.titles: list[str] = []
+        self.values: dict[str, list] = {name: [] for name in (*GameCatalog.COLUMNS, *GameCatalog.STRING_COLUMNS)}
+        self.interners = {name: StringInterner() for name in GameCatalog.STRING_COLUMNS}
+        self.skipped = 0
+
+    def add(self, record: dict[str, Any]) -> None:
+        # record maps _key(field name) -> value
+        def field(name: str) -> Any:
+            for candidate in FIELD_NAMES[name]:
+                value = record.get(candidate)
+                if value not in (None, ""):
+                    return value
+            return None
+
+        title = field("title")
+        if not title or not str(title).strip():
+            self.skipped += 1
+            return
+        self.titles.append(str(title).strip())
+
+        release = field("release")
+        year = YEAR_PATTERN.findall(str(release)) if release is not None else []
+        players = field("players")
+        length = field("length_hours")
+        popularity = field("popularity")
+
+        values = self.values
+        values["genre_mask"].append(genre_mask_of(field("genres")) | genre_mask_of(field("tags")))
+        values["release_year"].append(int(year[-1]) if year else 0)
+        players = int(_number(players, 1)) if players is not None else players_of(field("categories"))
+        values["players"].append(min(max(players, 1), MAX_PLAYERS))
+        values["length"].append(_number(length) if length is not None else _number(field("playtime_minutes")) / 60)
+        values["popularity"].append(_number(popularity) if popularity is not None else _number(field("positive")) + _number(field("negative")))
+        for name, interner in self.interners.items():
+            values[name].append(interner.code(_names(field(name))))
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def build(self) -> Batch:
+        encoded = [title.encode("utf-8") for title in self.titles]
+        batch = Batch(
+            b"".join(encoded),
+            np.fromiter((len(title) for title in encoded), dtype=np.uint64, count=len(encoded)),
+            {name: np.array(self.values[name], dtype=dtype) for name, dtype in GameCatalog.COLUMNS.items()},
+            {name: (interner.values, np.array(self.values[name], dtype=CODE_DTYPE)) for name, interner in self.interners.items()},
+            self.skipped,
+        )
+        self._reset()
+        return batch
+
+
+def dump_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Don't know how to read {extension or 'extensionless'} dumps, expected one of {', '.join(FORMATS)}")
+    return FORMATS[extension]
+
+
+def _lines(f: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+    # Lines starting in [start, end). The line straddling start belongs to the previous range.
+    f.seek(max(0, start - 1))
+    position = f.tell()
+    if start > 0:
+        position += len(f.readline())
+    while position < end:
+        line = f.readline()
+        if not line:
+            return
+        position += len(line)
+        yield line
+
+
+def _csv_header(path: str) -> tuple[list[str], int]:
+    # Field keys of a CSV dump and the byte length of its header line
+    with open(path, "rb") as f:
+        line = f.readline()
+    return [_key(name) for name in next(csv.reader([line.decode("utf-8-sig")]))], len(line)
+
+
+def _records(path: str, fmt: str, start: int, end: int) -> Iterator[dict[str, Any]]:
+    # Records of one byte range as dicts keyed by _key(field name)
+    if fmt == "json":
+        with open(path, encoding="utf-8") as f:
+            for record in _json_object_values(f):
+                if isinstance(record, dict):
+                    yield {_key(name): value for name, value in record.items()}
+        return
+
+    with open(path, "rb") as f:
+        if fmt == "csv":
+            header, header_bytes = _csv_header(path)
+            lines = (line.decode("utf-8") for line in _lines(f, max(start, header_bytes), end))
+            for row in csv.reader(lines):
+                yield dict(zip(header, row))
+        else:
+            for line in _lines(f, start, end):
+                if line.strip():
+                    record = json.loads(line)
+                    if isinstance(record, dict):
+                        yield {_key(name): value for name, value in record.items()}
+
+
+def _json_object_values(f: TextIO) -> Iterator[Any]:
+    # Values of the top-level JSON object in f, decoded one at a time so the file is never held whole
+    decoder = json.JSONDecoder()
+    buffer, position, at_end = "", 0, False
+
+    def read_more() -> None:
+        nonlocal buffer, position, at_end
+        chunk = f.read(max(JSON_READ_CHARS, len(buffer) - position)) # Doubles for values bigger than the buffer
+        at_end = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
+    def next_char() -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if at_end:
+                return ""
+            read_more()
+
+    def decode() -> Any:
+        nonlocal position
+        while True:
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+                return value
+            except json.JSONDecodeError:
+                if at_end:
+                    raise
+                read_more() # Cut off at the end of the buffer
+
+    def expect(char: str) -> None:
+        nonlocal position
+        if next_char() != char:
+            raise ValueError(f"Expected {char!r} in the JSON dump, found {buffer[position:position + 20]!r}")
+        position += 1
+
+    expect("{")
+    if next_char() == "}":
+        return
+    while True:
+        decode() # The app id
+        expect(":")
+        next_char()
+        yield decode()
+        if next_char() == "}":
+            return
+        expect(",")
+
+
+def read_batches(path: str, fmt: str, start: int = 0, end: int | None = None, batch_rows: int = BATCH_ROWS) -> Iterator[Batch]:
+    # The records of dump bytes [start, end) as normalized batches, streamed
+    end = os.path.getsize(path) if end is None else end
+    builder = _BatchBuilder()
+    for record in _records(path, fmt, start, end):
+        builder.add(record)
+        if len(builder) >= batch_rows:
+            yield builder.build()
+    if len(builder) or builder.skipped:
+        yield builder.build()
+
+
+def parse_range(path: str, fmt: str, start: int, end: int) -> tuple[list[Batch], int, int]:
+    # Runs in a worker: one byte range as batches, plus the worker's pid and peak RSS in KiB
+    return list(read_batches(path, fmt, start, end)), os.getpid(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class ColumnSpill:
+    """Catalog columns appended batch by batch to files, then mapped as one GameCatalog"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        names = [*GameCatalog.COLUMNS, *GameCatalog.STRING_COLUMNS, "titles.data", "titles.lengths"]
+        self.files = {name: open(os.path.join(directory, name), "wb") for name in names}
+        self.interners = {name: StringInterner() for name in GameCatalog.STRING_COLUMNS} # Only the distinct strings stay in memory
+        self.rows = 0
+        self.skipped = 0
+
+    def append(self, batch: Batch) -> None:
+        for name, values in batch.columns.items():
+            values.tofile(self.files[name])
+        self.files["titles.data"].write(batch.titles)
+        batch.title_lengths.tofile(self.files["titles.lengths"])
+        for name, (values, codes) in batch.strings.items():
+            interner = self.interners[name]
+            to_catalog = np.array([interner.code(value) for value in values], dtype=CODE_DTYPE)
+            to_catalog[codes].tofile(self.files[name])
+        self.rows += len(batch.title_lengths)
+        self.skipped += batch.skipped
+
+    def _map(self, name: str, dtype: type) -> np.ndarray:
+        path = os.path.join(self.directory, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def catalog(self) -> GameCatalog:
+        for f in self.files.values():
+            f.close()
+        offsets = np.zeros(self.rows + 1, dtype=np.uint64)
+        np.cumsum(self._map("titles.lengths", np.uint64), out=offsets[1:])
+        titles = StringTable(self._map("titles.data", np.uint8), offsets)
+        strings = {name: DictionaryColumn(self._map(name, CODE_DTYPE), interner.table()) for name, interner in self.interners.items()}
+        return GameCatalog(titles, **{name: self._map(name, dtype) for name, dtype in GameCatalog.COLUMNS.items()}, **strings)
+
+
+def ingest(dump_path: str, snapshot_path: str = snapshot.SNAPSHOT_PATH, processes: int = workers.PROCESS_WORKERS, chunk_bytes: int = CHUNK_BYTES) -> dict:
+    # Parses the dump and publishes it as the next generation of the snapshot, returns what it measured
+    fmt = dump_format(dump_path)
+    size = os.path.getsize(dump_path)
+    ranges = [(0, size)] if fmt == "json" else [(start, min(size, start + chunk_bytes)) for start in range(0, size, chunk_bytes)]
+    start_time = time.perf_counter()
+    worker_rss: dict[int, int] = {}
+
+    work_dir = os.path.dirname(os.path.abspath(snapshot_path)) # Spill next to the snapshot, temp dirs are often small
+    os.makedirs(work_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=work_dir, prefix=".ingest") as directory:
+        spill = ColumnSpill(directory)
+        if processes > 1 and len(ranges) > 1:
+            pool = ProcessPoolExecutor(processes, mp_context=workers.process_context())
+            pending: deque[Future] = deque()
+
+            def finish_oldest() -> None:
+                # Appended in submission order, so rows keep the dump's order
+                batches, pid, rss = pending.popleft().result()
+                for batch in batches:
+                    spill.append(batch)
+                worker_rss[pid] = rss
+
+            try:
+                for start, end in ranges:
+                    pending.append(pool.submit(parse_range, dump_path, fmt, start, end))
+                    if len(pending) >= 2 * processes: # Bounds parsed batches waiting in memory
+                        finish_oldest()
+                while pending:
+                    finish_oldest()
+            finally:
+                pool.shutdown(cancel_futures=True)
+        else:
+            for start, end in ranges:
+                for batch in read_batches(dump_path, fmt, start, end):
+                    spill.append(batch)
+
+        parsed = time.perf_counter()
+        games = spill.catalog()
+        handle = snapshot.CatalogHandle(snapshot_path)
+        published = handle.publish(games, source=dump_path)
+        rows, generation = len(published), handle.generation
+        del games, published, handle # Unmaps the spill files before their directory goes
+
+    elapsed = time.perf_counter() - start_time
+    return {
+        "rows": rows,
+        "skipped": spill.skipped,
+        "generation": generation,
+        "bytes": size,
+        "parse_seconds": parsed - start_time,
+        "seconds": elapsed,
+        "mib_per_second": size / 2**20 / elapsed if elapsed else 0.0,
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "worker_peak_rss_mib": max(worker_rss.values(), default=0) / 1024,
+    }
+
+
+def generate_dump(path: str, games: GameCatalog, description_bytes: int = 20_000, seed: int = 0) -> int:
+    # Writes games as a Steam-style dump in the format path's extension asks for, padded with
+    # description text the way real dumps are. For benchmarks and trying the pipeline out. Returns its size.
+    fmt = dump_format(path)
+    rng = np.random.default_rng(seed)
+    words = ["the", "game", "world", "battle", "story", "build", "explore", "quest", "friends", "online"]
+    filler = " ".join(words[i] for i in rng.integers(0, len(words), description_bytes // 6))
+    names = {genre: genre.replace("-", " ") for genre in GENRE_OPTIONS} # Steam spells them with spaces
+
+    def record(row: int) -> dict[str, Any]:
+        genres = [names[genre] for genre in games.genres(row)]
+        players = int(games.players[row])
+        return {
+            "name": games.title(row),
+            "release_date": f"Jan {1 + row % 28}, {games.release_year[row]}",
+            "about_the_game": filler,
+            "genres": genres[:2],
+            "tags": {genre: int(votes) for genre, votes in zip(genres, rng.integers(1, 500, len(genres)))},
+            "categories": ["Single-player"] + (["Multi-player"] if players > 1 else []),
+            "positive": int(games.popularity[row] * 0.8),
+            "negative": int(games.popularity[row] * 0.2),
+            "average_playtime_forever": int(games.length[row] * 60),
+            "developers": [games.developer_of(row)],
+            "publishers": [games.publisher_of(row)],
+        }
+
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            fields = ["AppID", "Name", "Release date", "About the game", "Genres", "Tags", "Categories", "Positive", "Negative", "Average playtime forever",
+                      "Developers", "Publishers"]
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in range(len(games)):
+                r = record(row)
+                writer.writerow([row, r["name"], r["release_date"], r["about_the_game"], ",".join(r["genres"]), ",".join(r["tags"]),
+                                 ",".join(r["categories"]), r["positive"], r["negative"], r["average_playtime_forever"],
+                                 ",".join(r["developers"]), ",".join(r["publishers"])])
+        elif fmt == "jsonl":
+            for row in range(len(games)):
+                f.write(json.dumps(record(row)) + "\n")
+        else:
+            f.write("{\n")
+            for row in range(len(games)):
+                f.write(f'{"," if row else ""}"{row}": {json.dumps(record(row), indent=2)}\n')
+            f.write("}\n")
+    return os.path.getsize(path)
+
+
+def main() -> int:
+    if len(sys.argv) > 1 and sys.argv[1] == "sample":
+        parser = argparse.ArgumentParser(description="Write a Steam-style dump of the synthetic catalog")
+        parser.add_argument("command")
+        parser.add_argument("dump")
+        parser.add_argument("--games", type=int, default=catalog.SYNTHETIC_SIZE)
+        parser.add_argument("--description-bytes", type=int, default=20_000)
+        args = parser.parse_args()
+        size = generate_dump(args.dump, catalog.generate_synthetic(args.games), args.description_bytes)
+        print(f"Wrote {args.games} games to {args.dump} ({size / 2**20:.0f} MiB)")
+        return 0
+
+    parser = argparse.ArgumentParser(description="Rebuild the catalog snapshot from a raw Steam dump")
+    parser.add_argument("dump")
+    parser.add_argument("--snapshot", default=snapshot.SNAPSHOT_PATH)
+    parser.add_argument("--processes", type=int, default=workers.PROCESS_WORKERS)
+    parser.add_argument("--chunk-mib", type=int, default=CHUNK_BYTES >> 20)
+    args = parser.parse_args()
+
+    try:
+        report = ingest(args.dump, args.snapshot, args.processes, args.chunk_mib << 20)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"Published generation {report['generation']} to {args.snapshot}: {report['rows']} games ({report['skipped']} records without a title skipped)")
+    print(f"{'dump size':<32} {report['bytes'] / 2**20:12.1f} MiB")
+    print(f"{'parse':<32} {report['parse_seconds']:12.2f} s")
+    print(f"{'total':<32} {report['seconds']:12.2f} s")
+    print(f"{'throughput':<32} {report['mib_per_second']:12.1f} MiB/s")
+    print(f"{'peak RSS (coordinator)':<32} {report['peak_rss_mib']:12.1f} MiB")
+    print(f"{'peak RSS (largest worker)':<32} {report['worker_peak_rss_mib']:12.1f} MiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+Docstring for preference_journal
+
+Write-behind persistence for preference changes (Sprint 2)
+
+A preference edit is applied to the in-memory User straight away and recorded
+here as one journal line holding the user's full preferences afterwards. A
+background thread appends buffered lines and fsyncs them every FLUSH_INTERVAL
+seconds, so rapid edits cost one disk sync per batch instead of one each.
+Once the journal passes COMPACT_BYTES, the latest preferences of every user
+in it are written to the user database in one transaction and the journal is
+emptied.
+
+Each line is "<crc32 hex> <json>". Lines hold absolute values rather than
+deltas, so replaying one twice is harmless.
+
+Every process (the Textual app, session servers, the CLI) writes its own journal,
+JOURNAL_PATH.<pid>, and holds an exclusive lock on it while it runs. On startup a
+process replays into the database every journal whose lock it can take, meaning
+its writer is gone, then deletes it; journals of live processes are left alone.
+Replay stops at the first line that fails its checksum (a write torn by a crash),
+so the result is exactly the state as of the writer's last completed flush.
+"""
+
+import json
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+from auth_and_preferences import User
+from user_store import UserStore, preferences_row
+
+try:
+    import fcntl
+except ImportError: # Windows, where a journal's writer can't be told apart from a crashed one
+    fcntl = None
+
+
+JOURNAL_PATH = os.getenv(
+    "PREFERENCE_JOURNAL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "preferences.journal"),
+)
+
+FLUSH_INTERVAL = 0.5 # Seconds between background fsyncs
+COMPACT_BYTES = 1 << 20 # Journal size that triggers compaction into the database
+
+
+def _encode(username: str, row: tuple) -> bytes:
+    payload = json.dumps([username, row], separators=(",", ":")).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def read_journal(path: str) -> Iterator[tuple[str, tuple]]:
+    # Yields (username, preferences_row) records up to the first torn or corrupt line
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            crc, _, payload = line.rstrip(b"\n").partition(b" ")
+            if not line.endswith(b"\n") or len(crc) != 8 or crc != b"%08x" % zlib.crc32(payload):
+                return
+            username, row = json.loads(payload)
+            yield username, tuple(row)
+
+
+def journal_files(path: str) -> list[str]:
+    # Every process's journal for the base path, plus one at the base path itself from before they were split
+    directory, base = os.path.split(os.path.abspath(path))
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names if name == base or name.startswith(base + ".") and name[len(base) + 1:].isdigit()]
+
+
+def _try_lock(f: BinaryIO) -> bool:
+    # Takes f's exclusive lock without waiting, False while another open file holds it
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _modified(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0.0
+
+
+@contextmanager
+def _startup_lock(path: str) -> Iterator[None]:
+    # Serializes replay between processes starting together
+    with open(path + ".lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield # The lock is released when the file closes
+
+
+class PreferenceJournal:
+    """Append-only preference change log, flushed in batches by a background thread"""
+
+    def __init__(self, store: UserStore, path: str = JOURNAL_PATH, flush_interval: float = FLUSH_INTERVAL, compact_bytes: int = COMPACT_BYTES):
+        self.store = store
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_bytes = compact_bytes
+
+        self._lock = threading.Lock() # Guards the buffer and pending state
+        self._io_lock = threading.Lock() # Serializes writes, syncs and compaction
+        self._buffer: list[bytes] = []
+        self._pending: dict[str, tuple] = {} # Latest row per user since the last compaction
+
+        self.records = 0
+        self.flushes = 0
+        self.compactions = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file_path = f"{path}.{os.getpid()}" # This process's journal
+        with _startup_lock(path):
+            self.replay()
+            self._file = open(self.file_path, "ab")
+            _try_lock(self._file) # Nobody else can hold it, replay just took over any file at this path
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="preference-journal", daemon=True)
+        self._thread.start()
+
+    def record(self, user: User) -> None:
+        # Call after changing user.preferences; returns without touching the disk
+        row = preferences_row(user)
+        line = _encode(user.username, row)
+        with self._lock:
+            self._buffer.append(line)
+            self._pending[user.username] = row
+            self.records += 1
+
+    def flush(self) -> None:
+        # Appends everything recorded so far and waits for it to reach the disk
+        with self._io_lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        self._file.write(b"".join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.flushes += 1
+
+    def compact(self, min_bytes: int = 0) -> None:
+        # Moves the journal's contents into the database and empties it, if it holds at least min_bytes
+        with self._io_lock:
+            self._flush()
+            if os.fstat(self._file.fileno()).st_size < min_bytes:
+                return
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if pending:
+                self.store.save_preference_rows(pending.items())
+            # Only truncated after the database commit; a crash in between just replays the same values
+            self._file.truncate(0)
+            self._file.seek(0) # truncate leaves the position, so tell() would keep reporting the old size
+            os.fsync(self._file.fileno())
+            self.compactions += 1
+
+    def replay(self) -> int:
+        # Applies the journals processes that are gone left behind to the database and deletes them,
+        # returns the number of records. Older journals are applied first.
+        latest = {}
+        count = 0
+        abandoned = []
+        try:
+            for file_path in sorted(journal_files(self.path), key=_modified):
+                try:
+                    f = open(file_path, "rb")
+                except FileNotFoundError:
+                    continue # Its writer closed it meanwhile
+                if not _try_lock(f):
+                    f.close() # Its writer is still running
+                    continue
+                abandoned.append((file_path, f))
+                for username, row in read_journal(file_path):
+                    latest[username] = row
+                    count += 1
+            if latest:
+                self.store.save_preference_rows(latest.items())
+            for file_path, _ in abandoned: # Only deleted after the database commit
+                os.remove(file_path)
+        finally:
+            for _, f in abandoned:
+                f.close()
+        return count
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.compact(self.compact_bytes) # Flushes first, compacts only once the file has grown enough
+
+    def close(self) -> None:
+        # Stops the background thread and leaves everything in the database
+        self._stop.set()
+        self._thread.join()
+        self.compact()
+        os.remove(self.file_path) # Empty now, removed while still locked so no replay can pick it up
+        self._file.close()
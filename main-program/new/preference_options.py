@@ -2,8 +2,14 @@
 Docstring for preference_options
 
 Stores all the categorical and numerical range preference options for each preference
+
+Genres are also registered to bit positions, so a selection of genres packs into
+one integer mask that can be compared against the whole catalog at once
 """
 
+from collections.abc import MutableSet
+from typing import Any, Iterable, Iterator, NamedTuple
+
 # "genres": [],
 # "release_range": (),
 # "number_of_players": None,
@@ -29,10 +35,116 @@ GENRE_OPTIONS = ['Action',
  'Violent',
 ]
 
+# Bit position of every genre option, GENRE_OPTIONS[i] is bit i
+GENRE_BITS = {genre: 1 << bit for bit, genre in enumerate(GENRE_OPTIONS)}
+ALL_GENRES_MASK = (1 << len(GENRE_OPTIONS)) - 1
+
+
+def genre_mask(genres: Iterable[str]) -> int:
+    # Packs genre names into a mask, names that aren't genre options are ignored
+    mask = 0
+    for genre in genres:
+        mask |= GENRE_BITS.get(genre, 0)
+    return mask
+
+
+def genres_from_mask(mask: int) -> list[str]:
+    # Unpacks a mask into genre names in GENRE_OPTIONS order
+    return [genre for genre, bit in GENRE_BITS.items() if mask & bit]
+
+
+def as_genre_mask(genres: "GenreSet | Iterable[str] | int | None") -> int:
+    # Accepts any way a genre preference can be stored and returns its mask
+    if not genres:
+        return 0
+    if isinstance(genres, GenreSet):
+        return genres.mask
+    if isinstance(genres, int):
+        return genres
+    return genre_mask(genres)
+
+
+class GenreSet(MutableSet):
+    """Set of genre names, stored as a bitmask over GENRE_OPTIONS"""
+
+    __slots__ = ("mask",)
+
+    def __init__(self, genres: Iterable[str] = (), mask: int = 0):
+        self.mask = mask
+        for genre in genres:
+            self.add(genre)
+
+    @classmethod
+    def _from_iterable(cls, genres: Iterable[str]) -> "GenreSet":
+        # Used by the set operators (|, &, -) inherited from MutableSet
+        return cls(genres)
+
+    def __contains__(self, genre: object) -> bool:
+        return bool(self.mask & GENRE_BITS.get(genre, 0)) # type: ignore[arg-type]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(genres_from_mask(self.mask))
+
+    def __len__(self) -> int:
+        return self.mask.bit_count()
+
+    def add(self, genre: str) -> None:
+        if genre not in GENRE_BITS:
+            raise ValueError(f"Recieved invalid genre: {genre}")
+        self.mask |= GENRE_BITS[genre]
+
+    def discard(self, genre: str) -> None:
+        self.mask &= ~GENRE_BITS.get(genre, 0)
+
+    def copy(self) -> "GenreSet":
+        return GenreSet(mask=self.mask)
+
+    def __repr__(self) -> str:
+        # Prints like the plain set it replaced
+        return "{" + ", ".join(repr(genre) for genre in self) + "}" if self.mask else "set()"
+
+
 def get_options(preference: str):
     match (preference):
         case "genre":
             return GENRE_OPTIONS
         case _:
             raise ValueError(f"Recieved invalid preference value: {preference}")
+
+
+class CanonicalPreferences(NamedTuple):
+    """A preference dict reduced to plain values, unset preferences are all None"""
+    genre_mask: int
+    release_range: tuple[int, int] | None
+    number_of_players: int | None
+    length: int | None
+
+    def as_preferences(self) -> dict[str, Any]:
+        # Back to a preference dict, with genres as a mask
+        return {
+            "genre": self.genre_mask,
+            "release_range": self.release_range,
+            "number_of_players": self.number_of_players,
+            "length": self.length,
+        }
+
+
+def canonical_preferences(preferences: dict[str, Any]) -> CanonicalPreferences:
+    # None, empty sets and empty tuples all mean "not set" and compare equal afterwards
+    release_range = preferences.get("release_range")
+    return CanonicalPreferences(
+        as_genre_mask(preferences.get("genre")),
+        tuple(release_range) if release_range else None,
+        preferences.get("number_of_players") or None,
+        preferences.get("length") or None,
+    )
+
+
+def is_valid_option(preference: str, value: Any) -> bool:
+    # Constant-time check that value is one of the options for preference
+    match (preference):
+        case "genre":
+            return value in GENRE_BITS
+        case _:
+            raise ValueError(f"Recieved invalid preference value: {preference}")
     
@@ -0,0 +1,275 @@
+"""
+Docstring for query_plan
+
+Preference dicts compiled into reusable query plans (Sprint 2)
+
+A preference dict says which games to keep, not how to find them. compile_plan
+turns one into an immutable QueryPlan: unset preferences are left out, every
+remaining filter becomes a Predicate with its estimated row count from catalog
+statistics, and the predicates run most selective first. Each one gets an access
+method:
+    index   the first predicate hands over just its rows from a range index or the
+            genre posting lists, when they are few enough to beat reading the column
+    scan    the predicate is checked against its whole column
+    filter  the predicate is only checked on the rows earlier steps kept, once
+            those are few enough that gathering them beats another full column
+Predicates whose exact count says they keep every game are dropped.
+The plan also records whether ranking may try the threshold algorithm first
+(see recommender.threshold_rank).
+
+Plans only depend on the preferences and the catalog, so they are cached per
+catalog by preference fingerprint and shared by everyone with the same
+preferences. explain() prints a plan with estimated and actual row counts.
+"""
+
+import math
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from cache import preferences_fingerprint
+from catalog import GameCatalog
+from preference_options import canonical_preferences, genres_from_mask
+
+
+# A length preference of N hours accepts games between N / tolerance and N * tolerance hours
+LENGTH_TOLERANCE = 2.0
+
+# Indexes are only used when they narrow the catalog to this fraction or less,
+# past that a sequential scan beats gathering scattered rows
+INDEX_SCAN_FRACTION = 0.25
+
+# Later predicates stop scanning whole columns and only check the rows kept so far once
+# this fraction of the catalog or less is left, gathering costs several times a scan per row
+GATHER_FRACTION = 0.1
+
+# Ranking may try the threshold algorithm when the wanted genres' posting lists hold at most
+# this fraction of the catalog, longer lists rarely let it stop early
+THRESHOLD_MAX_FRACTION = 0.5
+
+PLAN_CACHE_SIZE = 1024 # Plans kept per catalog, the least recently used go first
+
+# Catalog attribute answering each column's predicates without a scan
+COLUMN_INDEXES = {"release_year": "release_year_index", "length": "length_index", "genre_mask": "genre_postings"}
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """One filter: a genre mask to overlap, or inclusive bounds on a column"""
+    column: str
+    low: float = 0
+    high: float | None = None # None for no upper bound
+    mask: int = 0 # Genre predicates only
+
+    def matches(self, values: np.ndarray) -> np.ndarray:
+        # Boolean per value of the predicate's column
+        if self.mask:
+            return (values & self.mask) != 0
+        keep = values >= self.low
+        if self.high is not None:
+            keep &= values <= self.high
+        return keep
+
+    def lookup(self, catalog: GameCatalog) -> np.ndarray:
+        # Matching rows from the column's index, in row order
+        if self.mask:
+            postings = catalog.genre_postings
+            bits = [bit for bit in range(self.mask.bit_length()) if self.mask >> bit & 1]
+            rows = np.sort(np.concatenate([postings.postings(bit) for bit in bits]))
+            return rows[np.r_[True, rows[1:] != rows[:-1]]] if len(bits) > 1 and len(rows) else rows # Games in several lists once
+        return np.sort(getattr(catalog, COLUMN_INDEXES[self.column]).rows(self.low, self.high))
+
+    def describe(self) -> str:
+        match self.column:
+            case "genre_mask":
+                return "genre is any of " + ", ".join(genres_from_mask(self.mask))
+            case "release_year":
+                return f"release year {self.low:g} to {self.high:g}"
+            case "length":
+                return f"length {self.low:g} to {self.high:g} hours"
+            case "players":
+                return f"at least {self.low:g} players"
+        return self.column
+
+
+@dataclass(frozen=True)
+class Step:
+    predicate: Predicate
+    access: str # "index", "scan" or "filter"
+    estimate: int # Rows expected to pass this and every earlier step
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    """How to find the games that pass one set of preferences"""
+    fingerprint: str
+    steps: tuple[Step, ...] # In execution order, most selective first
+    threshold: bool # Ranking may try the threshold algorithm over the genre posting lists
+    genre_mask: int
+
+    @property
+    def estimate(self) -> int | None:
+        return self.steps[-1].estimate if self.steps else None
+
+    def candidate_rows(self, catalog: GameCatalog, trace: list[int] | None = None) -> np.ndarray:
+        # Row ids passing every step, in row order. With trace, the rows left after each step are appended to it.
+        rows, keep = None, None
+        for step in self.steps:
+            predicate = step.predicate
+            if step.access == "index":
+                rows = predicate.lookup(catalog)
+            elif step.access == "scan":
+                matches = predicate.matches(getattr(catalog, predicate.column))
+                keep = matches if keep is None else keep & matches
+            else:
+                if rows is None:
+                    rows = np.flatnonzero(keep)
+                rows = rows[predicate.matches(getattr(catalog, predicate.column)[rows])]
+            if trace is not None:
+                trace.append(len(rows) if rows is not None else int(np.count_nonzero(keep)))
+        if rows is not None:
+            return rows
+        return np.flatnonzero(keep) if keep is not None else np.arange(len(catalog))
+
+    def filter(self, catalog: GameCatalog, rows: np.ndarray) -> np.ndarray:
+        # The given rows that pass every step
+        for step in self.steps:
+            predicate = step.predicate
+            rows = rows[predicate.matches(getattr(catalog, predicate.column)[rows])]
+        return rows
+
+
+class _Statistics:
+    """What the planner estimates row counts from, gathered once per catalog"""
+
+    def __init__(self, catalog: GameCatalog):
+        self.rows = len(catalog)
+        offsets = catalog.genre_postings.offsets
+        self.genre_counts = np.diff(offsets) # Games per genre bit
+        # Games with at least n players, for every n in the column
+        self.players_at_least = np.cumsum(np.bincount(np.maximum(catalog.players, 0))[::-1])[::-1]
+
+    def estimate(self, catalog: GameCatalog, predicate: Predicate) -> int:
+        if predicate.mask:
+            # Genres treated as independent: a game misses every wanted genre with the product of their odds
+            shares = [self.genre_counts[bit] / max(self.rows, 1) for bit in range(predicate.mask.bit_length()) if predicate.mask >> bit & 1]
+            return round(self.rows * (1 - math.prod(1 - share for share in shares)))
+        if predicate.column == "players":
+            at_least = int(predicate.low)
+            return int(self.players_at_least[at_least]) if at_least < len(self.players_at_least) else 0
+        return getattr(catalog, COLUMN_INDEXES[predicate.column]).count(predicate.low, predicate.high) # Exact, two binary searches
+
+
+def predicates_for(preferences: dict[str, Any]) -> list[Predicate]:
+    # One predicate per preference that is set, in no particular order
+    state = canonical_preferences(preferences)
+    predicates = []
+    if state.genre_mask:
+        predicates.append(Predicate("genre_mask", mask=state.genre_mask))
+    if state.release_range:
+        predicates.append(Predicate("release_year", *state.release_range))
+    if state.length:
+        predicates.append(Predicate("length", state.length / LENGTH_TOLERANCE, state.length * LENGTH_TOLERANCE))
+    if state.number_of_players:
+        predicates.append(Predicate("players", state.number_of_players))
+    return predicates
+
+
+def compile_plan(catalog: GameCatalog, preferences: dict[str, Any], statistics: _Statistics | None = None) -> QueryPlan:
+    statistics = statistics or _Statistics(catalog)
+    rows = max(len(catalog), 1)
+    estimated = sorted(((statistics.estimate(catalog, predicate), predicate) for predicate in predicates_for(preferences)), key=lambda item: item[0])
+
+    steps = []
+    remaining = float(len(catalog)) # Rows expected to be left, every predicate treated as independent
+    for estimate, predicate in estimated:
+        if estimate == len(catalog) and not predicate.mask:
+            continue # Exact count says it keeps every game, e.g. a release range wider than the catalog's
+        if not steps and estimate <= len(catalog) * INDEX_SCAN_FRACTION and predicate.column in COLUMN_INDEXES:
+            access = "index"
+        elif steps and steps[0].access == "index" or remaining <= len(catalog) * GATHER_FRACTION:
+            access = "filter" # Rows are in hand already, or so few are left that gathering them wins
+        else:
+            access = "scan"
+        remaining *= estimate / rows
+        steps.append(Step(predicate, access, round(remaining)))
+
+    state = canonical_preferences(preferences)
+    genre_lists = sum(int(statistics.genre_counts[bit]) for bit in range(state.genre_mask.bit_length()) if state.genre_mask >> bit & 1)
+    # Reading the posting lists can't beat a range index that already cut the catalog down
+    range_index = bool(steps) and steps[0].access == "index" and steps[0].predicate.column != "genre_mask"
+    threshold = bool(state.genre_mask) and genre_lists <= len(catalog) * THRESHOLD_MAX_FRACTION and not range_index
+    return QueryPlan(preferences_fingerprint(preferences), tuple(steps), threshold, state.genre_mask)
+
+
+class _CatalogPlans:
+    """Statistics and compiled plans of one catalog"""
+
+    def __init__(self, catalog: GameCatalog):
+        self.statistics = _Statistics(catalog)
+        self.plans: OrderedDict[str, QueryPlan] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+_catalogs: "weakref.WeakKeyDictionary[GameCatalog, _CatalogPlans]" = weakref.WeakKeyDictionary()
+_catalogs_lock = threading.Lock()
+
+
+def _plans_of(catalog: GameCatalog) -> _CatalogPlans:
+    with _catalogs_lock:
+        plans = _catalogs.get(catalog)
+        if plans is None:
+            plans = _catalogs[catalog] = _CatalogPlans(catalog)
+        return plans
+
+
+def plan_for(catalog: GameCatalog, preferences: dict[str, Any]) -> QueryPlan:
+    # The cached plan for these preferences on this catalog, compiled on first use
+    plans = _plans_of(catalog)
+    fingerprint = preferences_fingerprint(preferences)
+    with plans.lock:
+        plan = plans.plans.get(fingerprint)
+        if plan is not None:
+            plans.plans.move_to_end(fingerprint)
+            plans.hits += 1
+            return plan
+        plans.misses += 1
+    plan = compile_plan(catalog, preferences, plans.statistics) # Outside the lock, two racing compiles agree
+    with plans.lock:
+        plans.plans[fingerprint] = plan
+        while len(plans.plans) > PLAN_CACHE_SIZE:
+            plans.plans.popitem(last=False)
+    return plan
+
+
+def is_cached(catalog: GameCatalog, preferences: dict[str, Any]) -> bool:
+    plans = _plans_of(catalog)
+    with plans.lock:
+        return preferences_fingerprint(preferences) in plans.plans
+
+
+def explain(catalog: GameCatalog, preferences: dict[str, Any]) -> list[str]:
+    # The plan for the preferences as text, run once so every step shows its actual row count too
+    cached = is_cached(catalog, preferences)
+    plan = plan_for(catalog, preferences)
+    trace: list[int] = []
+    plan.candidate_rows(catalog, trace)
+
+    lines = [f"Query plan {plan.fingerprint} ({'cached' if cached else 'compiled now'}), {len(catalog):,} games:\n"]
+    if not plan.steps:
+        lines.append("No preferences set, every game is a candidate.")
+    width = max((len(step.predicate.describe()) for step in plan.steps), default=0)
+    for number, (step, actual) in enumerate(zip(plan.steps, trace), start=1):
+        lines.append(f"{number}. {step.predicate.describe():<{width}}  {step.access:<6}  estimated {step.estimate:>9,}  actual {actual:>9,}")
+    if plan.threshold:
+        lists = plan.genre_mask.bit_count()
+        lines.append(f"\nRanking: threshold algorithm over {lists} genre posting list{'s' if lists > 1 else ''}, the steps above if it can't stop early.")
+    else:
+        lines.append("\nRanking: every candidate is scored, the best are picked with a partial sort.")
+    return lines
@@ -0,0 +1,302 @@
+"""
+Docstring for recommender
+
+Scores the game catalog against a user's preferences (Sprint 2)
+
+Every preference is applied to whole catalog columns in one vectorized pass,
+then the best rows are picked with a partial sort instead of sorting everything.
+
+Short result lists for selective genres skip the scan: the threshold algorithm
+reads the wanted genres' posting lists (games by popularity, best first) and
+stops as soon as no unread game could still make the top k.
+"""
+
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+import query_plan
+from auth_and_preferences import User
+from cache import RecommendationCache, preferences_fingerprint, shared_cache
+from catalog import GameCatalog
+from preference_options import CanonicalPreferences, as_genre_mask, canonical_preferences
+from query_plan import LENGTH_TOLERANCE
+
+
+DEFAULT_RESULTS = 10
+
+# How much each preference contributes to a game's score
+GENRE_WEIGHT = 3.0
+LENGTH_WEIGHT = 1.0
+POPULARITY_WEIGHT = 1.0
+
+# Incremental rankings only track their base when filters cut it to this fraction of the
+# catalog or less, a delta over a bigger base costs more than ranking from scratch
+DELTA_MAX_FRACTION = 0.5
+
+# The threshold algorithm is tried for at most this many results, when the query plan allows it
+# (see query_plan.THRESHOLD_MAX_FRACTION). Scoring rows it reads costs several times what the
+# scan pays per row, so it gives up for the scan before reading more than THRESHOLD_MAX_READ
+# of the catalog.
+THRESHOLD_MAX_RESULTS = 100
+THRESHOLD_MAX_READ = 0.05
+THRESHOLD_FIRST_DEPTH = 256 # Entries read per posting list in the first round, doubled every round
+
+
+@dataclass(frozen=True)
+class Recommendation:
+    row: int
+    title: str
+    score: float
+
+
+def candidate_rows(catalog: GameCatalog, preferences: dict[str, Any]) -> np.ndarray:
+    # Row ids of the games that pass every hard filter in the preferences, in row order,
+    # found the way the preferences' cached query plan says
+    return query_plan.plan_for(catalog, preferences).candidate_rows(catalog)
+
+
+def matching_rows(catalog: GameCatalog, preferences: dict[str, Any], rows: np.ndarray) -> np.ndarray:
+    # The given rows that pass every hard filter in the preferences
+    return query_plan.plan_for(catalog, preferences).filter(catalog, rows)
+
+
+def static_scores(catalog: GameCatalog, preferences: dict[str, Any], rows: np.ndarray) -> np.ndarray:
+    # Score parts that don't depend on genres: popularity and closeness to the wanted length
+    scores = POPULARITY_WEIGHT * catalog.popularity_score[rows]
+
+    length = preferences.get("length")
+    if length:
+        # 1 for an exact match, falling off the further a game is from the wanted length
+        distance = np.abs(np.log(np.maximum(catalog.length[rows], 0.1) / length))
+        scores = scores + LENGTH_WEIGHT * (1 - distance / np.log(LENGTH_TOLERANCE))
+
+    return scores
+
+
+def genre_scores(overlap: np.ndarray, wanted: int) -> np.ndarray:
+    # Fraction of the wanted genres each game has, from per-game overlap counts
+    return GENRE_WEIGHT * overlap / wanted.bit_count()
+
+
+def score_rows(catalog: GameCatalog, preferences: dict[str, Any], rows: np.ndarray) -> np.ndarray:
+    # Scores the given rows; higher is better
+    scores = static_scores(catalog, preferences, rows)
+
+    wanted = as_genre_mask(preferences.get("genre"))
+    if wanted:
+        overlap = np.bitwise_count(catalog.genre_mask[rows] & np.uint32(wanted))
+        scores = scores + genre_scores(overlap, wanted)
+
+    return scores.astype(np.float32)
+
+
+def top_k(rows: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    # Best k rows ordered by descending score, only the winners get fully sorted
+    if k < len(rows):
+        best = np.argpartition(-scores, k - 1)[:k]
+    else:
+        best = np.arange(len(rows))
+    order = best[np.argsort(-scores[best], kind="stable")]
+    return rows[order], scores[order]
+
+
+def threshold_rank(catalog: GameCatalog, preferences: dict[str, Any], k: int) -> tuple[np.ndarray, np.ndarray] | None:
+    # Top k by the threshold algorithm (Fagin, Lotem and Naor) over the posting lists of the wanted genres.
+    # Each round reads the next block of every list, scores the rows it hasn't seen in full and keeps the
+    # best k. An unread game in o of the m lists can score at most the o-th highest next popularity in the
+    # lists plus o/m of the genre weight (plus the length weight); once the k-th best beats that for every o,
+    # the result is final. Returns None when it would read past THRESHOLD_MAX_READ of the catalog.
+    wanted = as_genre_mask(preferences.get("genre"))
+    if max(THRESHOLD_FIRST_DEPTH, k) * wanted.bit_count() > len(catalog) * THRESHOLD_MAX_READ:
+        return None
+    lists = [catalog.genre_postings.postings(bit) for bit in range(wanted.bit_length()) if wanted >> bit & 1]
+    overlaps = np.arange(1, len(lists) + 1)
+    bonus = genre_scores(overlaps, wanted) + (LENGTH_WEIGHT if preferences.get("length") else 0)
+
+    plan = query_plan.plan_for(catalog, preferences)
+    seen = np.zeros(len(catalog), dtype=bool) # Games in several lists are only scored the first time
+    rows, scores = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    start, end = 0, max(THRESHOLD_FIRST_DEPTH, k)
+    while True:
+        read = np.sort(np.concatenate([postings[start:end] for postings in lists]))
+        read = read[~seen[read]]
+        seen[read] = True
+        read = plan.filter(catalog, read[np.r_[True, read[1:] != read[:-1]]] if len(read) else read)
+        rows, scores = top_k(np.concatenate([rows, read]), np.concatenate([scores, score_rows(catalog, preferences, read)]), k)
+
+        next_popularity = np.sort([catalog.popularity_score[postings[end]] if end < len(postings) else -np.inf for postings in lists])[::-1]
+        if np.isneginf(next_popularity[0]):
+            return rows, scores # Every list is read to the end
+        threshold = np.max(POPULARITY_WEIGHT * next_popularity + bonus)
+        if len(rows) == k and scores[-1] > threshold:
+            return rows, scores
+        start, end = end, end * 2
+        if end * len(lists) > len(catalog) * THRESHOLD_MAX_READ:
+            return None
+
+
+def rank(catalog: GameCatalog, preferences: dict[str, Any], k: int = DEFAULT_RESULTS) -> tuple[np.ndarray, np.ndarray]:
+    # Row ids and scores of the k best games for the preferences, best first
+    if 0 < k <= THRESHOLD_MAX_RESULTS and query_plan.plan_for(catalog, preferences).threshold:
+        ranked = threshold_rank(catalog, preferences, k)
+        if ranked is not None:
+            return ranked
+    rows = candidate_rows(catalog, preferences)
+    if len(rows) == 0 or k <= 0:
+        return rows[:0], np.zeros(0, dtype=np.float32)
+    return top_k(rows, score_rows(catalog, preferences, rows), k)
+
+
+def to_recommendations(catalog: GameCatalog, rows: np.ndarray, scores: np.ndarray) -> list[Recommendation]:
+    return [Recommendation(int(row), catalog.title(row), float(score)) for row, score in zip(rows, scores)]
+
+
+def recommend(catalog: GameCatalog, preferences: dict[str, Any], k: int = DEFAULT_RESULTS) -> list[Recommendation]:
+    # Returns the k best games for the preferences, best first
+    return to_recommendations(catalog, *rank(catalog, preferences, k))
+
+
+class RankingSession:
+    """
+    Remembers one user's last ranking so small preference edits are applied as deltas
+
+    Keeps the rows that pass every filter except genres (the base), their genre
+    masks, genre overlap counts and genre-independent scores. Adding or removing
+    genres only updates the overlap counts of the base, and narrowing the release
+    range or raising the player count only filters it. Anything else (a wider
+    range, a new length) needs rows outside the base, so it is recomputed in full.
+    Bases wider than DELTA_MAX_FRACTION of the catalog aren't kept at all.
+    """
+
+    def __init__(self, catalog: GameCatalog):
+        self.catalog = catalog
+        self.lock = threading.Lock() # A cancelled worker's thread may still be ranking
+        self.state: CanonicalPreferences | None = None
+        self.base: np.ndarray | None = None
+        self.full_recomputes = 0
+        self.delta_updates = 0
+
+    def rank(self, preferences: dict[str, Any], k: int = DEFAULT_RESULTS) -> tuple[np.ndarray, np.ndarray]:
+        # Same result as rank(catalog, preferences, k)
+        state = canonical_preferences(preferences)
+        with self.lock:
+            if self.state is None or not self._apply_delta(state):
+                self._recompute(state)
+            self.state = state
+            if self.base is None:
+                return rank(self.catalog, preferences, k)
+
+            if state.genre_mask:
+                matching = np.flatnonzero(self.overlap > 0)
+                rows = self.base[matching]
+                scores = self.static[matching] + genre_scores(self.overlap[matching], state.genre_mask)
+            else:
+                rows, scores = self.base, self.static
+        if len(rows) == 0 or k <= 0:
+            return rows[:0], np.zeros(0, dtype=np.float32)
+        return top_k(rows, scores.astype(np.float32), k)
+
+    def _recompute(self, state: CanonicalPreferences) -> None:
+        filters = state.as_preferences() | {"genre": None}
+        self.base = candidate_rows(self.catalog, filters)
+        self.full_recomputes += 1
+        if len(self.base) > len(self.catalog) * DELTA_MAX_FRACTION:
+            self.base = None
+            return
+        self.base_masks = self.catalog.genre_mask[self.base]
+        self.static = static_scores(self.catalog, filters, self.base)
+        self.overlap = np.bitwise_count(self.base_masks & np.uint32(state.genre_mask)).astype(np.int8)
+
+    def _apply_delta(self, state: CanonicalPreferences) -> bool:
+        # Updates the base in place for the change from self.state to state,
+        # returns False when the change can't be expressed as a delta
+        old = self.state
+        if self.base is None:
+            # Broad base, fine to keep going as long as only genres changed
+            return state._replace(genre_mask=0) == old._replace(genre_mask=0)
+        if state.length != old.length:
+            return False
+        if state.release_range != old.release_range and not _narrows(state.release_range, old.release_range):
+            return False
+        if (state.number_of_players or 0) < (old.number_of_players or 0):
+            return False
+
+        if state.release_range != old.release_range:
+            start, end = state.release_range
+            years = self.catalog.release_year[self.base]
+            self._keep((years >= start) & (years <= end))
+        if state.number_of_players != old.number_of_players:
+            self._keep(self.catalog.players[self.base] >= state.number_of_players)
+
+        added = state.genre_mask & ~old.genre_mask
+        removed = old.genre_mask & ~state.genre_mask
+        if added:
+            self.overlap += np.bitwise_count(self.base_masks & np.uint32(added)).astype(np.int8)
+        if removed:
+            self.overlap -= np.bitwise_count(self.base_masks & np.uint32(removed)).astype(np.int8)
+
+        self.delta_updates += 1
+        return True
+
+    def _keep(self, keep: np.ndarray) -> None:
+        self.base = self.base[keep]
+        self.base_masks = self.base_masks[keep]
+        self.static = self.static[keep]
+        self.overlap = self.overlap[keep]
+
+
+def _narrows(new: tuple[int, int] | None, old: tuple[int, int] | None) -> bool:
+    # True when the range new only keeps years that old kept too
+    if new is None:
+        return old is None
+    return old is None or (new[0] >= old[0] and new[1] <= old[1])
+
+
+# Each user's last ranking, dropped along with the User
+_rankings: "weakref.WeakKeyDictionary[User, RankingSession]" = weakref.WeakKeyDictionary()
+
+
+def rank_for(user: User, catalog: GameCatalog, k: int = DEFAULT_RESULTS, cache: RecommendationCache = shared_cache) -> tuple[np.ndarray, np.ndarray]:
+    # Like rank, but served from the shared cache when anyone with the same preferences asked before.
+    # On a miss the user's previous ranking is updated incrementally instead of starting over.
+
+    # Copied up front, the UI may edit the user's preferences while this runs in a worker
+    preferences = canonical_preferences(user.preferences).as_preferences()
+
+    cache.set_catalog_version(catalog.version, catalog.generation)
+    key = (catalog.version, preferences_fingerprint(preferences), k)
+    cache.track(user, key)
+
+    entry = cache.get(key)
+    if entry is not None:
+        return entry.rows, entry.scores
+    ranking = _rankings.get(user)
+    if ranking is None or ranking.catalog is not catalog:
+        ranking = _rankings[user] = RankingSession(catalog)
+    rows, scores = ranking.rank(preferences, k)
+    cache.put(key, rows, scores)
+    return rows, scores
+
+
+def rank_cached(catalog: GameCatalog, preferences: dict[str, Any], k: int = DEFAULT_RESULTS, cache: RecommendationCache = shared_cache) -> tuple[np.ndarray, np.ndarray]:
+    # rank through the shared cache for preferences that don't belong to a long-lived User
+    # (HTTP requests, batch jobs). Entries aren't tracked, they leave the cache by TTL or LRU.
+    preferences = canonical_preferences(preferences).as_preferences()
+
+    cache.set_catalog_version(catalog.version, catalog.generation)
+    key = (catalog.version, preferences_fingerprint(preferences), k)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry.rows, entry.scores
+    rows, scores = rank(catalog, preferences, k)
+    cache.put(key, rows, scores)
+    return rows, scores
+
+
+def recommend_for(user: User, catalog: GameCatalog, k: int = DEFAULT_RESULTS, cache: RecommendationCache = shared_cache) -> list[Recommendation]:
+    # rank_for as Recommendation objects
+    return to_recommendations(catalog, *rank_for(user, catalog, k, cache))
@@ -0,0 +1,395 @@
+"""
+Docstring for session
+
+UI-independent command handling (Sprint 2)
+
+A Session is one user's position in the app (logged in as whom, which screen
+they're on, the results they're paging through) and turns each line they type
+into the lines to show back. The Textual app, the TCP session server and the
+plain terminal CLI all drive Sessions, so every front end runs the same
+commands. Sessions share the catalog, user database, credential checks and
+preference journal through one Services object.
+
+Screens:
+    login -> home -> view_preferences / edit_preferences -> edit_preference
+    results (from home or edit_preference, exit goes back)
+"""
+
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+import numpy as np
+
+import catalog
+import collaborative
+import credentials
+import preference_journal
+import preference_options
+import query_plan
+import similarity
+import snapshot
+import user_store
+import workers
+from auth_and_preferences import User
+
+
+TITLE = "Game Recommender"
+
+PAGE_SIZE = 10 # Results per page, the first page is shown as soon as it's ranked
+RESULT_LIMIT = 500 # Results ranked in total, they arrive after the first page
+
+
+@dataclass
+class Services:
+    """Everything sessions share, loaded once per process"""
+    catalogs: snapshot.CatalogHandle
+    users: user_store.UserStore
+    credentials: credentials.CredentialVerifier
+    journal: preference_journal.PreferenceJournal
+    neighbours: collaborative.NeighbourHandle | None = None
+
+    @classmethod
+    def load(cls) -> "Services":
+        users = user_store.default_store()
+        return cls(
+            catalogs=snapshot.default_handle(), # Games the recommender chooses from, shared with other processes
+            users=users, # Accounts and their saved preferences
+            credentials=credentials.CredentialVerifier(users),
+            journal=preference_journal.PreferenceJournal(users), # Replays edits a crash left unsaved
+            neighbours=collaborative.NeighbourHandle(), # Play history boost, follows rebuilds of the neighbour file
+        )
+
+    @property
+    def catalog(self) -> catalog.GameCatalog:
+        # The newest published generation
+        return self.catalogs.current()
+
+    def close(self) -> None:
+        self.journal.close()
+
+
+@dataclass
+class Reply:
+    """What to show after a command"""
+    lines: list[str] = field(default_factory=list)
+    switched: bool = False # The session moved to another screen, show its intro next
+    clear: bool = False # The lines replace what's shown instead of adding to it
+    quit: bool = False # The user asked to leave the app
+
+
+def describe_game(games: catalog.GameCatalog, row: int) -> str:
+    # One result line's text, the only place a row's strings are decoded
+    developer = games.developer_of(row)
+    by = f" by {developer}" if developer else ""
+    return f"{games.title(row)} ({games.release_year[row]}){by} - {', '.join(games.genres(row))}"
+
+
+class Session:
+    """One user's state machine over the app's screens"""
+
+    def __init__(self, services: Services):
+        self.services = services
+        self.screen = "login"
+        self.step = "username" # Login step: username -> password
+        self.username = ""
+        self.user = User()
+        self.preference = "genre" # Preference being edited on the edit_preference screen
+
+        # Results screen
+        self.return_to = "home"
+        self.games: catalog.GameCatalog | None = None # Catalog generation the rows belong to
+        self.rows = np.zeros(0, dtype=np.int64) # Ranked catalog rows, best first
+        self.page = 0
+        self.more_pending = False
+        self.history_stale = False # Play history left out, its neighbour file predates the catalog
+
+    def log_in(self, user: User) -> None:
+        # Starts the session as an already authenticated user
+        self.user, self.username = user, user.username
+        self.screen = "home"
+
+    def _go(self, screen: str, reply: Reply | None = None) -> Reply:
+        reply = reply or Reply()
+        self.screen = screen
+        reply.switched = True
+        return reply
+
+    def intro(self) -> list[str]:
+        # Lines shown when the current screen is entered
+        match self.screen:
+            case "login":
+                return [
+                    f"Welcome to {TITLE}!",
+                    "Recommends games based on user preferences.\n",
+                    "Log in with your credentials to begin.",
+                    "Submit with Enter.\n",
+                ]
+            case "home":
+                return [
+                    f"{self.username} welcome to Game Recommender!",
+                    "Here you can generate your recommendations or view/edit preferences.",
+                    "Type 'help' to see commands.\n",
+                    "Your changes are associated with your user if you quit the app.\n",
+                    "If you're a new user, type the 'quick start' command to have\ninstructions you can follow for preference setup and a generation\nprinted on the screen!",
+                ]
+            case "view_preferences":
+                return [
+                    f"Viewing preferences of {self.username}",
+                    "Preferences determine how the recommender decides what to recommend.",
+                    "Type 'exit' to return to the home screen or 'edit preferences'\nto jump to that screen immediately.\n",
+                    *self.user_preferences(),
+                ]
+            case "edit_preferences":
+                return [
+                    f"Editing preferences of {self.username}",
+                    "Preferences determine how the recommender decides what to recommend.\n",
+                    "Type 'edit <preference>' or (e <preference>) followed by the name of the\npreference (e.g. genre) to go to a screen with\noptions to add or remove preferences.",
+                    "Type 'exit' to return to the home screen.\n",
+                    *self.user_preferences(),
+                ]
+            case "edit_preference":
+                return [
+                    f"Editing {self.preference} of {self.username}",
+                    "Type 'exit' to return to the edit screen or\nadd/delete (a/d) followed by the name of the genre\nto add or remove a particular genre from your preferences.\n",
+                    "Type 'recommend' (r) to check your recommendations after a change.\n",
+                    "Preferences determine how the recommender\ndecides what to recommend.\n",
+                    f"{self.preference.capitalize()} Options: \n",
+                    *preference_options.get_options(self.preference),
+                    "",
+                    self.user_preference(self.preference),
+                ]
+            case "results":
+                return ["Ranking games..."]
+        return []
+
+    async def handle(self, raw: str) -> Reply:
+        # Runs one line of input on the current screen
+        raw = raw.strip()
+        if not raw:
+            return Reply()
+        if self.screen == "login":
+            return await self._login(raw)
+
+        cmd, *args = raw.split()
+        match self.screen:
+            case "home":
+                return await self._home(cmd.lower(), args)
+            case "view_preferences":
+                return self._view_preferences(cmd.lower(), args)
+            case "edit_preferences":
+                return self._edit_preferences(cmd.lower(), args)
+            case "edit_preference":
+                return self._edit_preference(cmd.lower(), args)
+            case "results":
+                return self._results(cmd.lower(), args)
+        return Reply(["Unrecognized input."])
+
+    async def _login(self, raw: str) -> Reply:
+        if self.step == "username":
+            self.username = raw # Saves attempted username
+            self.step = "password"
+            return Reply([f"Attempting to login as {self.username}..."])
+
+        # Hashing runs in a worker process, other sessions keep going meanwhile
+        validated_user = await self.services.credentials.verify(self.username, raw)
+        self.step = "username"
+        if validated_user:
+            self.log_in(validated_user)
+            return self._go("home")
+        self.username, self.user = "", User()
+        return Reply(["Authentication failed, try again."])
+
+    async def _home(self, cmd: str, args: list[str]) -> Reply:
+        match cmd:
+            case "help":
+                return Reply(self.help_message())
+            case "logout":
+                # Saved preferences are what the next login reads
+                await workers.run_in_thread(self.services.journal.compact)
+                self.username, self.user = "", User()
+                return self._go("login")
+            case "exit":
+                return Reply(quit=True)
+            case "view":
+                if args and args[0] == "preferences":
+                    return self._go("view_preferences")
+                return Reply(["Second word in input is invalid."])
+            case "edit":
+                if args and args[0] == "preferences":
+                    return self._go("edit_preferences")
+                return Reply(["Second word in input is invalid."])
+            case "quick":
+                if len(args) != 1:
+                    return Reply(["Too many arguments."])
+                if args[0] == "start":
+                    return Reply(self.quick_start_message())
+                return Reply(["Second word in input is invalid."])
+            case "recommend":
+                if len(args) != 1:
+                    return Reply(["Usage: recommend games"])
+                if args[0] == "games":
+                    return self._open_results()
+                return Reply(["Second word in input is invalid."])
+            case "similar":
+                if not args:
+                    return Reply(["Usage: similar <title>"])
+                return await self._similar(" ".join(args))
+            case "explain":
+                if args:
+                    return Reply(["Usage: explain"])
+                # Runs the plan's steps to count their rows, so like ranking it goes to a thread
+                preferences = preference_options.canonical_preferences(self.user.preferences).as_preferences()
+                return Reply(await workers.run_in_thread(query_plan.explain, self.services.catalog, preferences))
+        return Reply(["Unrecognized input."])
+
+    async def _similar(self, title: str) -> Reply:
+        # The catalog's similarity index is built on first use, in a thread like ranking
+        games = self.services.catalog
+        found = await workers.run_in_thread(similarity.similar_to, games, title)
+        if found is None:
+            return Reply([f"No game titled '{title}' in the catalog."])
+        row, rows, scores = found
+        lines = [f"Games similar to {games.title(row)}:\n"]
+        for rank, (similar_row, score) in enumerate(zip(rows, scores), start=1):
+            lines.append(f"{rank}. {describe_game(games, similar_row)} ({score:.0%} similar)")
+        return Reply(lines)
+
+    def _view_preferences(self, cmd: str, args: list[str]) -> Reply:
+        match cmd:
+            case "exit":
+                return self._go("home")
+            case "edit":
+                if len(args) != 1:
+                    return Reply(["Too many arguments."])
+                if args[0] == "preferences":
+                    return self._go("edit_preferences")
+                return Reply(["Second word in input is invalid."])
+        return Reply(["Unrecognized input."])
+
+    def _edit_preferences(self, cmd: str, args: list[str]) -> Reply:
+        match cmd:
+            case "exit":
+                return self._go("home")
+            case "edit" | "e":
+                if len(args) != 1:
+                    return Reply(["Too many arguments."])
+                if args[0] in ("genre", "genres"):
+                    self.preference = "genre"
+                    return self._go("edit_preference")
+                return Reply(["Second word in input is invalid."])
+        return Reply(["Unrecognized input."])
+
+    def _edit_preference(self, cmd: str, args: list[str]) -> Reply:
+        match cmd:
+            case "exit":
+                return self._go("edit_preferences")
+            case "add" | "a" | "delete" | "d":
+                if len(args) != 1:
+                    return Reply(["Too many arguments."])
+                if not preference_options.is_valid_option(self.preference, args[0]):
+                    return Reply(["Invalid genre option."])
+                if cmd.startswith("a"):
+                    self.user.add_preference(self.preference, args[0])
+                else:
+                    self.user.delete_preference(self.preference, args[0])
+                self.services.journal.record(self.user) # Saved to disk in the background
+                return Reply([self.user_preference(self.preference)])
+            case "recommend" | "r":
+                # Only the changed genre is rescored, see recommender.RankingSession
+                return self._open_results()
+        return Reply(["Unrecognized input."])
+
+    def user_preferences(self) -> list[str]:
+        return [preference + ": " + str(value) for preference, value in self.user.preferences.items()]
+
+    def user_preference(self, preference: str) -> str:
+        return preference + ": " + str(self.user.preferences[preference])
+
+    def help_message(self) -> list[str]:
+        return [
+            "\nhelp - Shows a list of commands with usage information",
+            "logout - Log out of current user (returns to login screen)",
+            "exit - Quits the application",
+            "view preferences - Shows a screen with a list of current user's preferences",
+            "edit preferences - Shows a screen with a list of current user's preferences and shows how to edit them",
+            "quick start - Shows a basic guide for how to use this application",
+            "recommend games - Recommends games based on your preferences",
+            "similar <title> - Shows the games most like the one with that title",
+            "explain - Shows how your preferences are turned into a catalog search, with row counts",
+        ]
+
+    def quick_start_message(self) -> list[str]:
+        return [
+            "\nSince you're logged in, head to edit preferences!",
+            "From there, edit whichever preference you want the recommender to consider.",
+            "Once the preferences are to your liking, return home and run 'recommend games'\nto receive your recommendations!",
+        ]
+
+    # Results screen
+
+    def _open_results(self) -> Reply:
+        # The caller then runs load_results() to rank and show the first page
+        self.return_to = self.screen
+        self.games = self.services.catalog # Pinned, a newer generation would renumber the rows
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.page = 0
+        self.more_pending = True
+        return self._go("results")
+
+    async def load_results(self) -> AsyncIterator[list[str]]:
+        # Ranks just the first page so it can be shown right away, then the full result list.
+        # Yields the rendered page after each step; ranking runs in a thread.
+        user, games, model = self.user, self.games, None
+        if self.services.neighbours is not None:
+            model, self.history_stale = self.services.neighbours.for_catalog(games)
+
+        self.rows, _ = await workers.run_in_thread(collaborative.rank_with_history, user, games, model, PAGE_SIZE)
+        if len(self.rows) < PAGE_SIZE:
+            self.more_pending = False
+            yield self.render_page()
+            return
+        yield self.render_page()
+
+        self.rows, _ = await workers.run_in_thread(collaborative.rank_with_history, user, games, model, RESULT_LIMIT)
+        self.more_pending = False
+        yield self.render_page()
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-len(self.rows) // PAGE_SIZE))
+
+    def render_page(self) -> list[str]:
+        # The current page, only PAGE_SIZE rows are formatted
+        games = self.games
+        start = self.page * PAGE_SIZE
+        lines = [f"Recommended games, page {self.page + 1} of {self.page_count}{' (more loading...)' if self.more_pending else ''}\n"]
+        if len(self.rows) == 0 and not self.more_pending:
+            lines.append("No games match your preferences, try loosening them.")
+        if self.history_stale:
+            lines.append("Play history isn't counted until it is rebuilt for the updated catalog.\n")
+        for rank, row in enumerate(self.rows[start:start + PAGE_SIZE], start=start + 1):
+            lines.append(f"{rank}. {describe_game(games, row)}")
+        lines.append("\nType 'next' (n), 'prev' (p) or 'page <number>' to browse, or 'exit' to go back.")
+        return lines
+
+    def _results(self, cmd: str, args: list[str]) -> Reply:
+        match cmd:
+            case "exit":
+                return self._go(self.return_to)
+            case "next" | "n":
+                return self._go_to_page(self.page + 1)
+            case "prev" | "p":
+                return self._go_to_page(self.page - 1)
+            case "page":
+                if len(args) != 1 or not args[0].isdigit():
+                    return Reply(["Usage: page <number>"])
+                return self._go_to_page(int(args[0]) - 1)
+        return Reply(["Unrecognized input."])
+
+    def _go_to_page(self, page: int) -> Reply:
+        if 0 <= page < self.page_count:
+            self.page = page
+            return Reply(self.render_page(), clear=True)
+        if self.more_pending:
+            return Reply(["More results are still loading."])
+        return Reply([f"There are only {self.page_count} pages."])
@@ -0,0 +1,163 @@
+"""
+Docstring for session_loadgen
+
+Load generator for the session server (Sprint 2)
+
+Opens N concurrent sessions, logs each one in and runs a script of everyday
+commands (browsing screens, editing genres, paging recommendations) several
+times over, timing every command from sending the line to receiving the prompt.
+Prints throughput and p50/p99 latencies for logins and for commands.
+
+Without --port it starts a server in this process against a throwaway user
+database, with cheap password hashes so the run measures sessions rather than
+scrypt. Client and server then share the CPU, so latencies are pessimistic.
+
+Usage:
+    python session_loadgen.py [--sessions 1000] [--rounds 3] [--port 8023]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import credentials
+import preference_journal
+import snapshot
+import workers
+from auth_and_preferences import User
+from preference_options import GENRE_OPTIONS
+from session import Services
+from session_server import HOST, PROMPT, SessionServer
+from user_store import UserStore
+
+
+PASSWORD = "password"
+
+# One round of commands, starting and ending on the home screen
+SCRIPT = [
+    "help",
+    "view preferences",
+    "exit",
+    "edit preferences",
+    "edit genre",
+    "add {genre}",
+    "recommend",
+    "next",
+    "exit",
+    "delete {genre}",
+    "exit",
+    "exit",
+    "recommend games",
+    "page 3",
+    "exit",
+]
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Client:
+    """One simulated user on one connection"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def command(self, line: str) -> tuple[float, bytes]:
+        # Sends a line, returns the seconds until the whole reply arrived and the reply
+        start = time.perf_counter()
+        self.writer.write(line.encode("utf-8") + b"\n")
+        reply = await self.reader.readuntil(PROMPT)
+        return time.perf_counter() - start, reply
+
+
+async def run_session(number: int, host: str, port: int, rounds: int, logins: list[float], commands: list[float]) -> None:
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+    client = Client(reader, writer)
+    await reader.readuntil(PROMPT) # Login screen intro
+
+    _, reply = await client.command(f"user{number}")
+    elapsed, reply = await client.command(PASSWORD)
+    logins.append(elapsed)
+    if b"Authentication failed" in reply:
+        raise RuntimeError(f"user{number} could not log in")
+
+    genre = GENRE_OPTIONS[number % len(GENRE_OPTIONS)]
+    for _ in range(rounds):
+        for line in SCRIPT:
+            elapsed, _ = await client.command(line.format(genre=genre))
+            commands.append(elapsed)
+
+    writer.write(b"exit\n")
+    await writer.drain()
+    writer.close()
+
+
+def local_services(directory: str, users: int, hash_cost: int) -> Services:
+    # A throwaway user database with users user0..userN-1, all sharing one cheap password hash
+    params = credentials.HashParams(log_n=hash_cost)
+    store = UserStore(os.path.join(directory, "users.db"))
+    stored = credentials.hash_password(PASSWORD, params)
+    store.bulk_import(User(f"user{i}", stored) for i in range(users))
+    return Services(
+        catalogs=snapshot.default_handle(),
+        users=store,
+        credentials=credentials.CredentialVerifier(store, params),
+        journal=preference_journal.PreferenceJournal(store, os.path.join(directory, "preferences.journal")),
+    )
+
+
+async def run(sessions: int, rounds: int, host: str, port: int | None, hash_cost: int) -> None:
+    server = services = None
+    directory = tempfile.TemporaryDirectory()
+    if port is None:
+        services = local_services(directory.name, sessions, hash_cost)
+        server = SessionServer(services)
+        port = await server.start(host, 0)
+
+    logins: list[float] = []
+    commands: list[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(i, host, port, rounds, logins, commands) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{'sessions':<48} {sessions:10d}")
+    print(f"{'commands':<48} {len(commands):10d}")
+    print(f"{'elapsed':<48} {elapsed:10.2f} s")
+    print(f"{'commands per second':<48} {len(commands) / elapsed:10.0f}")
+    for name, samples in (("login", logins), ("command", commands)):
+        millis = [sample * 1000 for sample in samples]
+        print(f"{f'{name} latency p50 / p99 / max':<48} {statistics.median(millis):8.2f} / {percentile(millis, 0.99):.2f} / {max(millis):.2f} ms")
+
+    if server is not None:
+        await server.close()
+        services.close()
+        services.users.close()
+    directory.cleanup()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Drive many concurrent sessions against the session server")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3, help="Times each session runs the command script")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=None, help="Existing server to test, default starts one in this process")
+    parser.add_argument("--hash-cost", type=int, default=10, help="scrypt log2 N for the local server's users")
+    args = parser.parse_args()
+
+    workers.process_pool()
+    try:
+        asyncio.run(run(args.sessions, args.rounds, args.host, args.port, args.hash_cost))
+    finally:
+        workers.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
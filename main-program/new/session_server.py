@@ -0,0 +1,126 @@
+"""
+Docstring for session_server
+
+Many CLI sessions in one process over a TCP line protocol (Sprint 2)
+
+Every connection gets its own session.Session, and all of them share one
+catalog, recommendation cache, user database and journal. The client sends
+one command per line. The server answers with the lines the screen would show,
+then the prompt "> " without a newline, so `nc host port` works as a client and
+a program can read up to PROMPT to get a whole reply. Sessions only wait on each
+other for password hashing, which runs on the shared process pool.
+
+Usage:
+    python session_server.py [--host 127.0.0.1] [--port 8023]
+"""
+
+import argparse
+import asyncio
+import sys
+
+import workers
+from session import Reply, Services, Session
+
+
+HOST = "127.0.0.1"
+PORT = 8023
+PROMPT = b"\n> " # Ends every reply
+MAX_LINE = 4096
+BACKLOG = 4096 # Pending connections; the default of 100 stalls bursts of new sessions
+
+
+class SessionServer:
+    """asyncio TCP server running one Session per connection"""
+
+    def __init__(self, services: Services):
+        self.services = services
+        self.sessions = 0 # Currently connected
+        self.commands = 0
+        self._server: asyncio.Server | None = None
+
+    async def start(self, host: str = HOST, port: int = PORT) -> int:
+        # Starts listening and returns the bound port (useful with port 0)
+        self._server = await asyncio.start_server(self._serve, host, port, limit=MAX_LINE, backlog=BACKLOG)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        assert self._server is not None
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = Session(self.services)
+        self.sessions += 1
+        try:
+            await self._send(writer, session.intro())
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    break # Line longer than MAX_LINE
+                if not line:
+                    break
+                self.commands += 1
+                reply = await session.handle(line.decode("utf-8", errors="replace"))
+                if reply.quit:
+                    break
+                if reply.switched and session.screen == "results":
+                    await self._send_results(session, writer, reply.lines)
+                else:
+                    await self._send(writer, self._reply_lines(session, reply))
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+
+    def _reply_lines(self, session: Session, reply: Reply) -> list[str]:
+        # A screen change is followed by the new screen's intro, like a fresh Textual screen
+        return reply.lines + session.intro() if reply.switched else reply.lines
+
+    async def _send_results(self, session: Session, writer: asyncio.StreamWriter, lines: list[str]) -> None:
+        # Replies with the first page as soon as it's ranked; the rest is ranked before the next command is read
+        pages = session.load_results()
+        await self._send(writer, lines + await anext(pages))
+        async for _ in pages:
+            pass
+
+    async def _send(self, writer: asyncio.StreamWriter, lines: list[str]) -> None:
+        writer.write("\n".join(lines).encode("utf-8") + PROMPT)
+        await writer.drain()
+
+
+async def serve(host: str, port: int) -> None:
+    services = Services.load()
+    server = SessionServer(services)
+    port = await server.start(host, port)
+    print(f"Serving sessions on {host}:{port}")
+    try:
+        await server.serve_forever()
+    finally:
+        services.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Serve Game Recommender sessions over TCP")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    workers.process_pool()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        workers.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
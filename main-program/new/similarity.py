@@ -0,0 +1,247 @@
+"""
+Docstring for similarity
+
+"More like this" search over the catalog (Sprint 2)
+
+Every game is embedded as a TF-IDF vector over its genres and the words of its
+title (the catalog has no descriptions or free-form tags), stored as a CSR
+sparse matrix with L2-normalized rows, so a dot product is cosine similarity.
+
+Queries don't compare against every game. A random projection squashes the
+sparse vectors to PROJECTION_DIMENSIONS dense ones, spherical k-means over
+those splits the catalog into about sqrt(n) clusters (an IVF index), and a
+query only scores the games in the PROBES clusters whose centroids are closest
+to it. Those candidates are then ranked by their exact sparse cosine. The dense
+vectors are only needed while building, the index keeps the sparse matrix,
+the centroids and one row id per game.
+
+Indexes are built per catalog generation on first use and live as long as
+the catalog does.
+"""
+
+import re
+import threading
+import weakref
+
+import numpy as np
+
+import preference_options
+from catalog import GameCatalog
+
+
+SIMILAR_RESULTS = 10
+PROJECTION_DIMENSIONS = 32
+PROBES = 16 # Clusters scored per query, more gives better recall for more work
+KMEANS_ITERATIONS = 8
+KMEANS_SAMPLE_PER_CLUSTER = 40 # k-means trains on a sample of this many games per cluster
+ROW_CHUNK = 65_536 # Games projected or assigned at a time, bounds the build's temporary memory
+SEED = 0
+
+TOKEN_PATTERN = re.compile(r"[^\W\d_]{2,}") # Words of two or more letters, numbers say little about a game
+
+
+def title_terms(title: str) -> set[str]:
+    return set(TOKEN_PATTERN.findall(title.lower()))
+
+
+class SimilarityIndex:
+    """TF-IDF vectors of every game plus an IVF index over their random projections"""
+
+    def __init__(
+        self,
+        titles: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+        projection: np.ndarray,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_rows: np.ndarray,
+    ):
+        self.titles = titles # (hash of the lowercased title, row) sorted by hash, for lookups by name
+        self.indptr = indptr # CSR: row i's terms are indices[indptr[i]:indptr[i + 1]]
+        self.indices = indices
+        self.data = data
+        self.projection = projection # Vocabulary x PROJECTION_DIMENSIONS random matrix
+        self.centroids = centroids # Clusters x PROJECTION_DIMENSIONS, unit length
+        self.list_offsets = list_offsets # Cluster c holds list_rows[list_offsets[c]:list_offsets[c + 1]]
+        self.list_rows = list_rows
+        self._owners: np.ndarray | None = None # Row of every CSR entry, only exact() needs it
+
+    @classmethod
+    def build(cls, games: GameCatalog, dimensions: int = PROJECTION_DIMENSIONS, seed: int = SEED) -> "SimilarityIndex":
+        rng = np.random.default_rng(seed)
+        titles = list(games.titles)
+        indptr, indices, data = _tfidf(games, titles)
+        vocabulary_size = int(indices.max()) + 1 if len(indices) else 1
+        projection = rng.standard_normal((vocabulary_size, dimensions)).astype(np.float32)
+
+        rows = len(titles)
+        clusters = max(1, min(rows, int(np.sqrt(rows))))
+        sample = rng.choice(rows, size=min(rows, clusters * KMEANS_SAMPLE_PER_CLUSTER), replace=False) if rows else np.zeros(0, dtype=np.int64)
+        centroids = _spherical_kmeans(_project(indptr, indices, data, projection, np.sort(sample)), clusters, rng)
+
+        # Every game joins the cluster whose centroid is closest
+        assignment = np.empty(rows, dtype=np.int32)
+        for start in range(0, rows, ROW_CHUNK):
+            chunk = np.arange(start, min(rows, start + ROW_CHUNK))
+            assignment[chunk] = np.argmax(_project(indptr, indices, data, projection, chunk) @ centroids.T, axis=1)
+        list_rows = np.argsort(assignment, kind="stable").astype(np.int32)
+        list_offsets = np.zeros(clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=clusters), out=list_offsets[1:])
+
+        hashes = np.fromiter((hash(title.lower()) for title in titles), dtype=np.int64, count=rows)
+        order = np.argsort(hashes, kind="stable")
+        title_index = np.rec.fromarrays([hashes[order], order.astype(np.int32)], names="hash,row")
+        return cls(title_index, indptr, indices, data, projection, centroids, list_offsets, list_rows)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.titles, self.indptr, self.indices, self.data, self.projection, self.centroids, self.list_offsets, self.list_rows)
+        return sum(array.nbytes for array in arrays)
+
+    def find(self, games: GameCatalog, title: str) -> int | None:
+        # Row of the game with this title, ignoring case
+        wanted = title.strip().lower()
+        key = hash(wanted)
+        start = int(np.searchsorted(self.titles.hash, key, "left"))
+        end = int(np.searchsorted(self.titles.hash, key, "right"))
+        for row in self.titles.row[start:end]: # Hash collisions are told apart by the title itself
+            if games.title(int(row)).lower() == wanted:
+                return int(row)
+        return None
+
+    def _query(self, row: int) -> np.ndarray:
+        # Row's TF-IDF vector as a dense vocabulary-sized array
+        query = np.zeros(len(self.projection), dtype=np.float32)
+        start, end = self.indptr[row], self.indptr[row + 1]
+        query[self.indices[start:end]] = self.data[start:end]
+        return query
+
+    def _cosine(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        # Exact cosine between query and each of rows, reading only those rows' terms
+        positions, owners, _ = gather_rows(self.indptr, rows)
+        weights = query[self.indices[positions]] * self.data[positions]
+        return np.bincount(owners, weights=weights, minlength=len(rows)).astype(np.float32)
+
+    def _top(self, row: int, rows: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        keep = rows != row # A game isn't similar to itself
+        rows, scores = rows[keep], scores[keep]
+        if len(rows) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.lexsort((rows, -scores)) # Ties broken by row so results are stable
+        return rows[order], scores[order]
+
+    def similar(self, row: int, k: int = SIMILAR_RESULTS, probes: int = PROBES) -> tuple[np.ndarray, np.ndarray]:
+        # Approximate top k games by cosine similarity to row, best first
+        query = self._query(row)
+        embedded = _project(self.indptr, self.indices, self.data, self.projection, np.array([row]))[0]
+        probes = min(probes, len(self.centroids))
+        clusters = np.argpartition(-(self.centroids @ embedded), probes - 1)[:probes]
+        candidates = np.concatenate([self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in clusters])
+        return self._top(row, candidates, self._cosine(query, candidates), k)
+
+    def exact(self, row: int, k: int = SIMILAR_RESULTS) -> tuple[np.ndarray, np.ndarray]:
+        # Brute force over every game, the reference for measuring recall
+        query = self._query(row)
+        rows = len(self.indptr) - 1
+        if self._owners is None:
+            self._owners = np.repeat(np.arange(rows), np.diff(self.indptr))
+        scores = np.bincount(self._owners, weights=query[self.indices] * self.data, minlength=rows)
+        return self._top(row, np.arange(rows), scores.astype(np.float32), k)
+
+
+def _tfidf(games: GameCatalog, titles: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # CSR matrix of binary term frequency x smoothed IDF, rows L2-normalized.
+    # Terms 0..len(GENRE_OPTIONS)-1 are the genres, title words follow.
+    rows = len(titles)
+    term_rows, term_ids = [], []
+    masks = np.asarray(games.genre_mask)
+    for term, genre in enumerate(preference_options.GENRE_OPTIONS):
+        members = np.flatnonzero(masks & preference_options.GENRE_BITS[genre])
+        term_rows.append(members)
+        term_ids.append(np.full(len(members), term, dtype=np.int32))
+
+    vocabulary: dict[str, int] = {}
+    word_rows, word_ids = [], []
+    first_word = len(preference_options.GENRE_OPTIONS)
+    for row, title in enumerate(titles):
+        for word in title_terms(title):
+            word_rows.append(row)
+            word_ids.append(vocabulary.setdefault(word, first_word + len(vocabulary)))
+    term_rows.append(np.array(word_rows, dtype=np.int64))
+    term_ids.append(np.array(word_ids, dtype=np.int32))
+
+    all_rows = np.concatenate(term_rows)
+    all_ids = np.concatenate(term_ids)
+    order = np.lexsort((all_ids, all_rows))
+    all_rows, indices = all_rows[order], all_ids[order]
+
+    document_frequency = np.bincount(indices, minlength=first_word + len(vocabulary))
+    idf = (np.log((1 + rows) / (1 + document_frequency)) + 1).astype(np.float32)
+    data = idf[indices]
+    norms = np.sqrt(np.bincount(all_rows, weights=data.astype(np.float64) ** 2, minlength=rows)).astype(np.float32)
+    data /= norms[all_rows]
+
+    indptr = np.zeros(rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_rows, minlength=rows), out=indptr[1:])
+    return indptr, indices, data
+
+
+def gather_rows(indptr: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Positions of the given CSR rows' entries, which of rows each belongs to, and each row's entry count
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    offsets = np.cumsum(lengths) - lengths # Where each row's entries start in the gathered arrays
+    positions = np.repeat(starts - offsets, lengths) + np.arange(int(lengths.sum()))
+    return positions, np.repeat(np.arange(len(rows)), lengths), lengths
+
+
+def _project(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, projection: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    # Unit-length random projections of the given rows
+    positions, _, lengths = gather_rows(indptr, rows)
+    embedded = np.zeros((len(rows), projection.shape[1]), dtype=np.float32)
+    present = lengths > 0 # reduceat can't express empty rows, they stay zero
+    if present.any():
+        contributions = projection[indices[positions]] * data[positions, None]
+        embedded[present] = np.add.reduceat(contributions, (np.cumsum(lengths) - lengths)[present], axis=0)
+    norms = np.linalg.norm(embedded, axis=1, keepdims=True)
+    return embedded / np.maximum(norms, 1e-12)
+
+
+def _spherical_kmeans(points: np.ndarray, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    # Unit-length centroids maximising the cosine to their members
+    if len(points) == 0:
+        return np.zeros((clusters, points.shape[1]), dtype=np.float32)
+    centroids = points[rng.choice(len(points), size=clusters, replace=len(points) < clusters)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(points @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, points)
+        empty = ~sums.any(axis=1)
+        sums[empty] = points[rng.choice(len(points), size=int(empty.sum()))] # Restart empty clusters on random points
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+_indexes: "weakref.WeakKeyDictionary[GameCatalog, SimilarityIndex]" = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def index_for(games: GameCatalog) -> SimilarityIndex:
+    # The catalog's index, built on first use; concurrent callers wait for the one build
+    with _indexes_lock:
+        index = _indexes.get(games)
+        if index is None:
+            index = _indexes[games] = SimilarityIndex.build(games)
+        return index
+
+
+def similar_to(games: GameCatalog, title: str, k: int = SIMILAR_RESULTS) -> tuple[int, np.ndarray, np.ndarray] | None:
+    # (row of the game titled title, similar rows, their cosine similarity), or None for an unknown title
+    index = index_for(games)
+    row = index.find(games, title)
+    if row is None:
+        return None
+    return (row, *index.similar(row, k))
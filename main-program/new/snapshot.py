@@ -0,0 +1,401 @@
+"""
+Docstring for snapshot
+
+Compiled binary catalog snapshots (Sprint 2)
+
+Parsing the raw dataset on every launch is slow, so it is compiled once into a
+snapshot file that the app memory-maps. Mapping is close to free and the OS page
+cache is shared between every app process reading the same file.
+
+Besides the columns, a snapshot stores what GameCatalog would otherwise derive
+in every process (popularity scores, the range indexes and the genre posting
+lists), so Flask workers, session servers and batch workers attached to one
+snapshot each add almost nothing of their own however many of them run.
+CatalogHandle is how processes attach: publishing a new generation replaces the
+file atomically, processes still reading the old one keep their mapping (its
+pages live until the last mapping goes), and each handle moves to the new file
+on its next check.
+
+Layout of a snapshot file:
+    prefix   MAGIC, format version, header length and header CRC32 (PREFIX_FORMAT)
+    header   JSON describing the row count, source dataset and every section
+    sections one fixed-width array per catalog column plus the title string
+             table, each starting on an ALIGNMENT byte boundary
+
+Usage:
+    python snapshot.py build [dataset.csv] [games.snap]
+    python snapshot.py verify [games.snap]
+    python snapshot.py publish [dataset.csv] [games.snap]
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterator
+
+import numpy as np
+
+import catalog
+from catalog import DictionaryColumn, GameCatalog, GenrePostings, SortedIndex, StringTable
+
+try:
+    import fcntl
+except ImportError: # Windows, builds there aren't serialized between processes
+    fcntl = None
+
+
+SNAPSHOT_PATH = os.getenv("GAME_SNAPSHOT", os.path.splitext(catalog.CATALOG_PATH)[0] + ".snap")
+
+MAGIC = b"GRSNAP\0\0"
+FORMAT_VERSION = 1
+PREFIX_FORMAT = "<8sIII" # magic, format version, header length, header crc32
+ALIGNMENT = 64
+WRITE_CHUNK = 1 << 20 # Array elements copied to the file at a time
+
+CHECK_INTERVAL = 1.0 # Seconds between a handle's checks for a newer generation
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot is unreadable, corrupt or out of date"""
+
+
+def source_fingerprint(source: str) -> dict:
+    # Cheap identity of the raw dataset, a changed file gets a changed fingerprint
+    stat = os.stat(source)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _sections(games: GameCatalog) -> dict[str, np.ndarray]:
+    # Every array stored in the snapshot, keyed by section name
+    titles = games.titles if isinstance(games.titles, StringTable) else StringTable.from_strings(games.titles)
+    sections = {name: np.ascontiguousarray(getattr(games, name), dtype=dtype) for name, dtype in GameCatalog.COLUMNS.items()}
+    sections["titles.offsets"] = np.ascontiguousarray(titles.offsets, dtype=np.uint64)
+    sections["titles.data"] = np.ascontiguousarray(titles.data, dtype=np.uint8)
+    for name in GameCatalog.STRING_COLUMNS:
+        column = getattr(games, name)
+        sections[f"{name}.codes"] = np.ascontiguousarray(column.codes, dtype=catalog.CODE_DTYPE)
+        sections[f"{name}.values.offsets"] = np.ascontiguousarray(column.values.offsets, dtype=np.uint64)
+        sections[f"{name}.values.data"] = np.ascontiguousarray(column.values.data, dtype=np.uint8)
+    # Derived data, stored so attached processes don't each build a private copy
+    sections["popularity_score"] = np.ascontiguousarray(games.popularity_score, dtype=np.float32)
+    for name, column in GameCatalog.INDEXES.items():
+        index = getattr(games, name)
+        sections[f"{name}.order"] = np.ascontiguousarray(index.order, dtype=np.int32)
+        sections[f"{name}.values"] = np.ascontiguousarray(index.values, dtype=GameCatalog.COLUMNS[column])
+    sections["genre_postings.offsets"] = np.ascontiguousarray(games.genre_postings.offsets, dtype=np.int64)
+    sections["genre_postings.rows"] = np.ascontiguousarray(games.genre_postings.rows, dtype=np.int32)
+    return sections
+
+
+def _crc32(array: np.ndarray) -> int:
+    crc = 0
+    for start in range(0, len(array), WRITE_CHUNK):
+        crc = zlib.crc32(array[start:start + WRITE_CHUNK].tobytes(), crc)
+    return crc
+
+
+def write_sections(path: str, header: dict, sections: dict[str, np.ndarray]) -> None:
+    # Writes header plus one aligned array per section as a snapshot file, replacing path atomically.
+    # Arrays are copied out a slice at a time, so memory-mapped inputs are never loaded whole.
+    layout = {}
+    offset = 0 # Relative to the end of the header, fixed up below
+    for name, array in sections.items():
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "count": len(array),
+            "offset": offset,
+            "crc32": _crc32(array),
+        }
+        offset = _aligned(offset + array.nbytes)
+
+    header = {**header, "sections": layout}
+    # The header's own length decides where data starts, so size it with final offsets in place
+    data_start = 0
+    while True:
+        for name, section in layout.items():
+            section["start"] = data_start + section["offset"]
+        encoded = json.dumps(header, sort_keys=True).encode("utf-8")
+        needed = _aligned(struct.calcsize(PREFIX_FORMAT) + len(encoded))
+        if needed == data_start:
+            break
+        data_start = needed
+
+    temp_path = f"{path}.tmp{os.getpid()}"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(temp_path, "wb") as f:
+        f.write(struct.pack(PREFIX_FORMAT, MAGIC, FORMAT_VERSION, len(encoded), zlib.crc32(encoded)))
+        f.write(encoded)
+        for name, array in sections.items():
+            f.seek(layout[name]["start"])
+            for start in range(0, len(array), WRITE_CHUNK):
+                f.write(array[start:start + WRITE_CHUNK].tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path) # Readers see either the old snapshot or the new one, never half of one
+
+
+def write_snapshot(games: GameCatalog, path: str, source: str | None = None, generation: int = 0, fingerprint: dict | None = None) -> None:
+    # Writes the catalog as a snapshot, replacing any existing file atomically.
+    # fingerprint ties it to a dataset without reading it, for catalogs derived from one.
+    header = {
+        "rows": len(games),
+        "version": games.version,
+        "generation": generation,
+        "source": source_fingerprint(source) if source else fingerprint,
+    }
+    write_sections(path, header, _sections(games))
+
+
+def _read_header(f: BinaryIO, path: str) -> dict:
+    prefix_size = struct.calcsize(PREFIX_FORMAT)
+    prefix = f.read(prefix_size)
+    if len(prefix) != prefix_size:
+        raise SnapshotError(f"{path} is too short to be a snapshot")
+    magic, version, header_length, header_crc = struct.unpack(PREFIX_FORMAT, prefix)
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} is not a catalog snapshot")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"{path} has format version {version}, expected {FORMAT_VERSION}")
+    encoded = f.read(header_length)
+    if zlib.crc32(encoded) != header_crc:
+        raise SnapshotError(f"{path} has a corrupt header")
+    return json.loads(encoded)
+
+
+def read_header(path: str) -> dict:
+    # Parses and checks the prefix and header without touching the column data
+    with open(path, "rb") as f:
+        return _read_header(f, path)
+
+
+def map_sections(path: str, verify: bool = False) -> tuple[dict, dict[str, np.ndarray], tuple[int, int]]:
+    # Maps every section through one open file, so a generation swapped in meanwhile can't be half read.
+    # Returns the header, the arrays by section name and the (device, inode) of the file they map.
+    # With verify, every section is checksummed (reads the whole file).
+    with open(path, "rb") as f:
+        header = _read_header(f, path)
+        stat = os.fstat(f.fileno())
+        arrays = {}
+        for name, section in header["sections"].items():
+            dtype = np.dtype(section["dtype"])
+            if section["start"] + section["count"] * dtype.itemsize > stat.st_size:
+                raise SnapshotError(f"{path} is truncated in section {name}")
+            if section["count"] == 0:
+                arrays[name] = np.zeros(0, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(f, dtype=dtype, mode="r", offset=section["start"], shape=(section["count"],))
+            if verify and _crc32(arrays[name]) != section["crc32"]:
+                raise SnapshotError(f"{path} failed its checksum in section {name}")
+    return header, arrays, (stat.st_dev, stat.st_ino)
+
+
+def _open(path: str, source: str | None, verify: bool) -> tuple[GameCatalog, dict, tuple[int, int]]:
+    # Returns the catalog, its header and the identity of the file it maps
+    header, arrays, identity = map_sections(path, verify)
+    if source is not None and header["source"] != source_fingerprint(source):
+        raise SnapshotError(f"{path} was built from a different version of {source}")
+
+    titles = StringTable(arrays.pop("titles.data"), arrays.pop("titles.offsets"))
+    strings = {
+        name: DictionaryColumn(arrays.pop(f"{name}.codes"), StringTable(arrays.pop(f"{name}.values.data"), arrays.pop(f"{name}.values.offsets")))
+        for name in GameCatalog.STRING_COLUMNS
+        if f"{name}.codes" in arrays
+    }
+    popularity_score = arrays.pop("popularity_score", None)
+    # Snapshots written before the derived sections existed still open, those are then built per process
+    indexes = {
+        name: SortedIndex.from_sorted(arrays.pop(f"{name}.order"), arrays.pop(f"{name}.values"))
+        for name in GameCatalog.INDEXES
+        if f"{name}.order" in arrays
+    }
+    genre_postings = None
+    if "genre_postings.rows" in arrays:
+        genre_postings = GenrePostings(arrays.pop("genre_postings.offsets"), arrays.pop("genre_postings.rows"))
+    games = GameCatalog(
+        titles,
+        **arrays,
+        version=header["version"],
+        popularity_score=popularity_score,
+        indexes=indexes,
+        genre_postings=genre_postings,
+        generation=header.get("generation", 0),
+        **strings,
+    )
+    return games, header, identity
+
+
+def open_snapshot(path: str, source: str | None = None, verify: bool = False) -> GameCatalog:
+    # Memory-maps a snapshot as a read-only catalog.
+    # With a source, the snapshot must have been built from that exact file.
+    # With verify, every section is checksummed (reads the whole file).
+    return _open(path, source, verify)[0]
+
+
+def build_snapshot(source: str, path: str) -> None:
+    # Compiles the raw dataset at source into a snapshot at path
+    write_snapshot(catalog.load_csv(source), path, source=source)
+
+
+def open_or_build(source: str, path: str) -> GameCatalog:
+    # Opens the snapshot for source, recompiling it first when it is missing or stale
+    try:
+        return open_snapshot(path, source=source)
+    except (FileNotFoundError, SnapshotError):
+        build_snapshot(source, path)
+        return open_snapshot(path, source=source)
+
+
+@contextmanager
+def _publish_lock(path: str) -> Iterator[None]:
+    # Serializes builds and publishes of one snapshot across processes
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield # The lock is released when the file closes
+
+
+def ensure_snapshot(path: str = SNAPSHOT_PATH, source: str = catalog.CATALOG_PATH) -> str:
+    # Makes sure path holds a snapshot of source, or of the synthetic catalog when there is no dataset.
+    # Processes starting together wait for whichever one compiles it first.
+    with _publish_lock(path):
+        try:
+            header = read_header(path)
+        except (FileNotFoundError, SnapshotError):
+            header = None
+        if os.path.exists(source):
+            if header is None or header["source"] != source_fingerprint(source):
+                generation = header.get("generation", 0) + 1 if header else 0
+                write_snapshot(catalog.load_csv(source), path, source=source, generation=generation)
+        elif header is None:
+            write_snapshot(catalog.generate_synthetic(), path)
+    return path
+
+
+class CatalogHandle:
+    """A published snapshot that processes attach to zero-copy, following generation swaps"""
+
+    def __init__(self, path: str = SNAPSHOT_PATH, check_interval: float = CHECK_INTERVAL, clock: Callable[[], float] = time.monotonic):
+        self.path = path
+        self.check_interval = check_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._games: GameCatalog | None = None
+        self._identity: tuple[int, int] | None = None # (device, inode) of the mapped file
+        self._checked_at = float("-inf")
+        self.generation = -1
+        self.swap_seconds = 0.0 # How long the last swap held the handle, the only wait readers see
+
+    def current(self) -> GameCatalog:
+        # The newest generation, checked for at most every check_interval seconds.
+        # Callers should hold on to the returned catalog for the whole of one request,
+        # row ids from one generation mean nothing in the next.
+        games = self._games
+        if games is not None and self._clock() - self._checked_at < self.check_interval:
+            return games
+        with self._lock:
+            self._checked_at = self._clock()
+            try:
+                stat = os.stat(self.path)
+                replaced = (stat.st_dev, stat.st_ino) != self._identity
+            except FileNotFoundError:
+                if self._games is None:
+                    raise
+                replaced = False # Keep serving the generation already mapped
+            if replaced:
+                self._attach()
+            return self._games
+
+    def _attach(self) -> None:
+        self._games, header, self._identity = _open(self.path, None, False)
+        self.generation = header.get("generation", 0)
+
+    def _swap(self) -> GameCatalog:
+        # Moves this process to the file just written; requests already holding the old catalog finish on it
+        start = time.perf_counter()
+        with self._lock:
+            self._attach()
+            self._checked_at = self._clock()
+            games = self._games
+        self.swap_seconds = time.perf_counter() - start
+        return games
+
+    def publish(self, games: GameCatalog, source: str | None = None) -> GameCatalog:
+        # Writes games as the next generation and attaches to it.
+        # Other processes switch on their next check, until then they keep reading the old file.
+        with _publish_lock(self.path):
+            try:
+                generation = read_header(self.path).get("generation", 0) + 1
+            except (FileNotFoundError, SnapshotError):
+                generation = 0
+            write_snapshot(games, self.path, source=source, generation=generation)
+            return self._swap()
+
+    def update(self, change: Callable[[GameCatalog], GameCatalog]) -> GameCatalog:
+        # Publishes change(newest generation) as the next generation. The new catalog is built while
+        # readers carry on with the old one, and updates from other processes wait their turn instead of
+        # overwriting each other. It stays tied to the dataset the newest generation came from.
+        with _publish_lock(self.path):
+            base, header, _ = _open(self.path, None, False)
+            games = change(base)
+            write_snapshot(games, self.path, generation=header.get("generation", 0) + 1, fingerprint=header["source"])
+            return self._swap()
+
+
+_default_handle: CatalogHandle | None = None
+_default_handle_lock = threading.Lock()
+
+
+def default_handle() -> CatalogHandle:
+    # The handle on SNAPSHOT_PATH every part of the app shares, the snapshot is compiled on first use
+    global _default_handle
+    with _default_handle_lock:
+        if _default_handle is None:
+            _default_handle = CatalogHandle(ensure_snapshot(SNAPSHOT_PATH, catalog.CATALOG_PATH))
+        return _default_handle
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compile or check a catalog snapshot")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Compile a dataset CSV into a snapshot")
+    build.add_argument("source", nargs="?", default=catalog.CATALOG_PATH)
+    build.add_argument("path", nargs="?", default=SNAPSHOT_PATH)
+    verify = commands.add_parser("verify", help="Checksum every section of a snapshot")
+    verify.add_argument("path", nargs="?", default=SNAPSHOT_PATH)
+    publish = commands.add_parser("publish", help="Replace a live snapshot with a new generation from a dataset CSV")
+    publish.add_argument("source", nargs="?", default=catalog.CATALOG_PATH)
+    publish.add_argument("path", nargs="?", default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    match args.command:
+        case "build":
+            build_snapshot(args.source, args.path)
+            print(f"Wrote {args.path}")
+        case "verify":
+            try:
+                games = open_snapshot(args.path, verify=True)
+            except SnapshotError as e:
+                print(e)
+                return 1
+            print(f"{args.path}: {len(games)} games, version {games.version}, generation {read_header(args.path).get('generation', 0)}")
+        case "publish":
+            handle = CatalogHandle(args.path)
+            handle.publish(catalog.load_csv(args.source), source=args.source)
+            print(f"Published generation {handle.generation} to {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
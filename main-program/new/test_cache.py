@@ -0,0 +1,44 @@
+import gc
+
+import numpy as np
+
+from cache import RecommendationCache
+
+
+class Owner:
+    pass
+
+
+def put(cache: RecommendationCache, fingerprint: str, count: int = 10) -> tuple[str, str, int]:
+    key = ("v1", fingerprint, count)
+    cache.put(key, np.arange(count), np.zeros(count))
+    return key
+
+
+def test_changed_preferences_release_their_entries():
+    cache = RecommendationCache()
+    owner, other = Owner(), Owner()
+    shared = put(cache, "a")
+    put(cache, "a", 20) # Same preferences, another result count
+    cache.track(owner, shared)
+    cache.track(other, shared)
+
+    cache.track(owner, put(cache, "b"))
+    assert cache.get(shared) is not None # other still wants "a"
+    cache.track(other, ("v1", "b", 10))
+    assert cache.get(shared) is None and cache.get(("v1", "a", 20)) is None
+    assert cache.stats()["entries"] == 1
+
+
+def test_collected_owners_release_their_entries():
+    cache = RecommendationCache()
+    owners = [Owner() for _ in range(1000)]
+    for i, owner in enumerate(owners):
+        cache.track(owner, put(cache, f"p{i % 100}"))
+    assert cache.stats()["tracked_preferences"] == 100
+
+    del owners, owner
+    gc.collect()
+    stats = cache.stats()
+    assert stats["tracked_preferences"] == 0
+    assert stats["entries"] == 0 and stats["invalidations"] == 100
@@ -0,0 +1,26 @@
+import catalog
+from collaborative import NeighbourHandle, build_neighbours, generate_history
+
+
+def test_handle_follows_rebuilds_and_skips_stale_files(tmp_path):
+    games, newer = catalog.generate_synthetic(500), catalog.generate_synthetic(500, seed=1)
+    history, path = str(tmp_path / "history.csv"), str(tmp_path / "neighbours.snap")
+    clock = [0.0]
+    handle = NeighbourHandle(path, check_interval=1.0, clock=lambda: clock[0])
+    assert handle.for_catalog(games) == (None, False) # Nothing built yet
+
+    generate_history(games, history, users=200)
+    build_neighbours(history, games, path)
+    clock[0] += 1
+    model, stale = handle.for_catalog(games)
+    assert model is not None and model.matches(games) and not stale
+
+    # After a catalog reload the old file is left out, and said to be
+    assert handle.for_catalog(newer) == (None, True)
+
+    generate_history(newer, history, users=200)
+    build_neighbours(history, newer, path)
+    assert handle.for_catalog(newer) == (None, True) # Not checked again within the interval
+    clock[0] += 1
+    model, stale = handle.for_catalog(newer)
+    assert model is not None and model.matches(newer) and not stale
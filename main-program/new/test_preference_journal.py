@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+from auth_and_preferences import User
+from preference_journal import PreferenceJournal, journal_files
+from user_store import UserStore
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PREFERENCES = {"genre": {"RPG"}, "release_range": (), "number_of_players": None, "length": None}
+
+
+def crashing_writer(tmp_path, edits: dict[str, dict]) -> None:
+    # Records edits in another process, flushes them and dies without closing the journal
+    script = textwrap.dedent(f"""
+        import os, sys
+        sys.path.insert(0, {HERE!r})
+        from auth_and_preferences import User
+        from preference_journal import PreferenceJournal
+        from user_store import UserStore
+        journal = PreferenceJournal(UserStore({str(tmp_path / "users.db")!r}), {str(tmp_path / "preferences.journal")!r}, flush_interval=60)
+        for username, preferences in {edits!r}.items():
+            journal.record(User(username, "", preferences))
+        journal.flush()
+        os._exit(1)
+    """)
+    subprocess.run([sys.executable, "-c", script], check=False)
+
+
+def test_replay_restores_flushed_rows_after_crash(tmp_path):
+    store = UserStore(str(tmp_path / "users.db"))
+    for name in ("ann", "bob", "cat"):
+        store.add(User(name, "", PREFERENCES))
+
+    edits = {
+        "ann": {"genre": {"Action", "Indie"}, "release_range": (1990, 2005), "number_of_players": 2, "length": 10},
+        "bob": {"genre": set(), "release_range": (), "number_of_players": 4, "length": None},
+    }
+    crashing_writer(tmp_path, edits)
+    [left_behind] = journal_files(str(tmp_path / "preferences.journal"))
+    with open(left_behind, "ab") as f:
+        f.write(b'0badc0de ["cat",[') # Torn by the crash, must be ignored
+
+    journal = PreferenceJournal(store, str(tmp_path / "preferences.journal"), flush_interval=60)
+    try:
+        assert store.get("ann").preferences == edits["ann"]
+        assert store.get("bob").preferences == edits["bob"]
+        assert store.get("cat").preferences == PREFERENCES
+        assert not os.path.exists(left_behind)
+    finally:
+        journal.close()
+
+
+def test_startup_leaves_live_journals_alone(tmp_path):
+    store = UserStore(str(tmp_path / "users.db"))
+    store.add(User("ann", "", PREFERENCES))
+    path = str(tmp_path / "preferences.journal")
+
+    live = PreferenceJournal(store, path, flush_interval=60)
+    edited = {"genre": {"Strategy"}, "release_range": (), "number_of_players": None, "length": 30}
+    live.record(User("ann", "", edited))
+    live.flush()
+
+    # Another process starting up must neither replay nor delete it
+    subprocess.run([sys.executable, "-c", textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {HERE!r})
+        from preference_journal import PreferenceJournal
+        from user_store import UserStore
+        PreferenceJournal(UserStore({str(tmp_path / "users.db")!r}), {path!r}, flush_interval=60).close()
+    """)], check=True)
+    assert os.path.getsize(live.file_path) > 0
+    assert store.get("ann").preferences == PREFERENCES
+
+    live.close()
+    assert store.get("ann").preferences == edited
+    assert journal_files(path) == []
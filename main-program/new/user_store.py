@@ -0,0 +1,212 @@
+"""
+Docstring for user_store
+
+Persistent user accounts in an embedded SQLite database (Sprint 2)
+
+Accounts are looked up one at a time through the unique index on username, so
+the store can hold millions of users without any of them being loaded up front.
+The database runs in WAL mode so readers aren't blocked while preferences are saved.
+
+Passwords are stored as given, normally scrypt hashes from credentials.py.
+Plaintext passwords (from seeding or an old import) still work and are
+replaced by a hash the first time that user logs in.
+
+Usage:
+    python user_store.py import users.csv [users.db]
+    python user_store.py count [users.db]
+"""
+
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import threading
+from typing import Iterable, Iterator
+
+from auth_and_preferences import User, VALID_USERS
+from preference_options import GenreSet
+
+
+USER_DB_PATH = os.getenv(
+    "GAME_RECOMMENDER_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "users.db"),
+)
+
+IMPORT_BATCH_SIZE = 10_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    genre_mask INTEGER NOT NULL DEFAULT 0,
+    release_start INTEGER,
+    release_end INTEGER,
+    number_of_players INTEGER,
+    length INTEGER
+)
+"""
+
+COLUMNS = "username, password, genre_mask, release_start, release_end, number_of_players, length"
+
+
+def preferences_row(user: User) -> tuple:
+    # The user's preferences as (genre_mask, release_start, release_end, number_of_players, length), NULL when unset
+    return (
+        user.genre_mask,
+        user.release_start or None,
+        user.release_end or None,
+        user.number_of_players or None,
+        user.length or None,
+    )
+
+
+def _to_row(user: User) -> tuple:
+    # Flattens a user into the users table columns
+    return (user.username, user.password, *preferences_row(user))
+
+
+def _from_row(row: tuple) -> User:
+    username, password, genre_mask, *preferences = row
+    return User.from_fields(username, password, genre_mask, *(value or 0 for value in preferences))
+
+
+class UserStore:
+    """User repository backed by one SQLite database file"""
+
+    def __init__(self, path: str = USER_DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Shared between the UI thread and workers, the lock serializes access to the connection
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(SCHEMA)
+
+    def get(self, username: str) -> User | None:
+        # Index lookup on username
+        with self._lock:
+            row = self._connection.execute(f"SELECT {COLUMNS} FROM users WHERE username = ?", (username,)).fetchone()
+        return _from_row(row) if row else None
+
+    def add(self, user: User) -> None:
+        try:
+            with self._lock:
+                self._connection.execute(f"INSERT INTO users ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", _to_row(user))
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Username already taken: {user.username}") from None
+
+    def set_password(self, username: str, password: str) -> None:
+        # password is the stored form, normally a hash from credentials.hash_password
+        with self._lock:
+            self._connection.execute("UPDATE users SET password = ? WHERE username = ?", (password, username))
+
+    def save_preferences(self, user: User) -> None:
+        self.save_preference_rows([(user.username, preferences_row(user))])
+
+    def save_preference_rows(self, rows: Iterable[tuple[str, tuple]]) -> None:
+        # Writes (username, preferences_row) pairs in one transaction
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "UPDATE users SET genre_mask = ?, release_start = ?, release_end = ?, number_of_players = ?, length = ? WHERE username = ?",
+                ((*row, username) for username, row in rows),
+            )
+            self._connection.execute("COMMIT")
+
+    def bulk_import(self, users: Iterable[User], batch_size: int = IMPORT_BATCH_SIZE) -> int:
+        # Inserts users in large transactions, skipping usernames that already exist.
+        # Streams the iterable, so it can come straight from a file of any size.
+        inserted = 0
+        batch = []
+        for user in users:
+            batch.append(_to_row(user))
+            if len(batch) >= batch_size:
+                inserted += self._insert_batch(batch)
+                batch = []
+        if batch:
+            inserted += self._insert_batch(batch)
+        return inserted
+
+    def _insert_batch(self, rows: list[tuple]) -> int:
+        with self._lock:
+            before = self._connection.total_changes
+            self._connection.execute("BEGIN")
+            self._connection.executemany(f"INSERT OR IGNORE INTO users ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+            return self._connection.total_changes - before
+
+    def iter_preference_chunks(self, after_id: int = 0, size: int = IMPORT_BATCH_SIZE) -> Iterator[list[tuple]]:
+        # Streams (id, username, genre_mask, release_start, release_end, number_of_players, length) rows
+        # in id order, size at a time, starting after after_id. Each chunk is one indexed range read.
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT id, username, genre_mask, release_start, release_end, number_of_players, length FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                    (after_id, size),
+                ).fetchall()
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1][0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+_default_store: UserStore | None = None
+
+
+def default_store() -> UserStore:
+    # The store at USER_DB_PATH, seeded with VALID_USERS the first time it's created
+    global _default_store
+    if _default_store is None:
+        _default_store = UserStore(USER_DB_PATH)
+        if _default_store.count() == 0:
+            _default_store.bulk_import(VALID_USERS)
+    return _default_store
+
+
+def read_users_csv(path: str) -> Iterator[User]:
+    # Streams users from a CSV with a username,password header and optional preference columns
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            start, end = row.get("release_start"), row.get("release_end")
+            yield User(row["username"], row["password"], {
+                "genre": GenreSet(genre for genre in (row.get("genres") or "").split(";") if genre),
+                "release_range": (int(start), int(end)) if start and end else (),
+                "number_of_players": int(row["number_of_players"]) if row.get("number_of_players") else None,
+                "length": int(row["length"]) if row.get("length") else None,
+            })
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Manage the user database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bulk = commands.add_parser("import", help="Bulk-import users from a CSV file")
+    bulk.add_argument("source")
+    bulk.add_argument("path", nargs="?", default=USER_DB_PATH)
+    count = commands.add_parser("count", help="Print the number of users")
+    count.add_argument("path", nargs="?", default=USER_DB_PATH)
+    args = parser.parse_args()
+
+    store = UserStore(args.path)
+    match args.command:
+        case "import":
+            print(f"Imported {store.bulk_import(read_users_csv(args.source))} users into {args.path}")
+        case "count":
+            print(store.count())
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Docstring for user_table
+
+Columnar in-memory user records for batch jobs and servers (Sprint 2)
+
+A UserTable keeps users as parallel NumPy columns (struct of arrays) instead of
+one Python object each: a genre bitmask, the release range, players and length
+take 12 bytes per user, and usernames are packed into one byte buffer with an
+offset per row. A million users fit in a few tens of megabytes.
+
+Passwords aren't kept, tables are for working with preferences. Rows are turned
+into User objects only on demand, and written back with update().
+"""
+
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from auth_and_preferences import User
+
+
+GENRE_DTYPE = np.uint32
+YEAR_DTYPE = np.int16
+PLAYERS_DTYPE = np.uint16
+LENGTH_DTYPE = np.uint16
+
+COLUMNS = {
+    "genre_mask": GENRE_DTYPE,
+    "release_start": YEAR_DTYPE,
+    "release_end": YEAR_DTYPE,
+    "number_of_players": PLAYERS_DTYPE,
+    "length": LENGTH_DTYPE,
+}
+
+INITIAL_CAPACITY = 1024
+EXTEND_BATCH_SIZE = 65_536
+
+
+class UserTable:
+    """Growable struct-of-arrays table of usernames and packed preferences; 0 means unset"""
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        capacity = max(capacity, 1)
+        self._size = 0
+        self._columns = {name: np.zeros(capacity, dtype) for name, dtype in COLUMNS.items()}
+        self._names = bytearray()
+        self._offsets = np.zeros(capacity + 1, np.uint64)
+        self._index: tuple[np.ndarray, np.ndarray] | None = None # (sorted name hashes, their rows), built lazily
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        # table.genre_mask etc. are views of the filled part of each column
+        columns = self.__dict__.get("_columns", {})
+        if name in columns:
+            return columns[name][:self._size]
+        raise AttributeError(name)
+
+    def _reserve(self, size: int) -> None:
+        capacity = len(self._offsets) - 1
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.zeros(capacity, column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+        offsets = np.zeros(capacity + 1, np.uint64)
+        offsets[:self._size + 1] = self._offsets[:self._size + 1]
+        self._offsets = offsets
+
+    def append(self, user: User) -> int:
+        # Adds a user and returns its row
+        row = self._size
+        self._reserve(row + 1)
+        self._names += user.username.encode("utf-8")
+        self._offsets[row + 1] = len(self._names)
+        self._size += 1
+        self._write(row, user)
+        self._index = None
+        return row
+
+    def extend(self, users: Iterable[User]) -> None:
+        # Appends in batches, one slice assignment per column instead of one per field
+        batch = []
+        for user in users:
+            batch.append(user)
+            if len(batch) >= EXTEND_BATCH_SIZE:
+                self._append_batch(batch)
+                batch = []
+        if batch:
+            self._append_batch(batch)
+
+    def _append_batch(self, users: list[User]) -> None:
+        start, end = self._size, self._size + len(users)
+        self._reserve(end)
+        names = [user.username.encode("utf-8") for user in users]
+        self._offsets[start + 1:end + 1] = len(self._names) + np.cumsum([len(name) for name in names], dtype=np.uint64)
+        self._names += b"".join(names)
+        for name, column in self._columns.items():
+            column[start:end] = [getattr(user, name) for user in users]
+        self._size = end
+        self._index = None
+
+    def _write(self, row: int, user: User) -> None:
+        for name, column in self._columns.items():
+            column[row] = getattr(user, name)
+
+    def username(self, row: int) -> str:
+        return self._names[int(self._offsets[row]):int(self._offsets[row + 1])].decode("utf-8")
+
+    def usernames(self) -> Iterator[str]:
+        for row in range(self._size):
+            yield self.username(row)
+
+    def user(self, row: int) -> User:
+        # A standalone User for one row, changes to it only reach the table through update()
+        if not 0 <= row < self._size:
+            raise IndexError(row)
+        columns = self._columns
+        return User.from_fields(self.username(row), "", *(int(columns[name][row]) for name in COLUMNS))
+
+    def update(self, row: int, user: User) -> None:
+        # Writes user's preferences back into row
+        if not 0 <= row < self._size:
+            raise IndexError(row)
+        self._write(row, user)
+
+    def row_of(self, username: str) -> int | None:
+        # Binary search over hashes of the usernames, checked against the name itself
+        if self._index is None:
+            hashes = np.fromiter((hash(name) for name in self.usernames()), np.int64, self._size)
+            order = np.argsort(hashes, kind="stable")
+            self._index = (hashes[order], order.astype(np.int32))
+        hashes, rows = self._index
+        key = hash(username)
+        start = np.searchsorted(hashes, key, "left")
+        end = np.searchsorted(hashes, key, "right")
+        for row in rows[start:end]:
+            if self.username(int(row)) == username:
+                return int(row)
+        return None
+
+    @property
+    def nbytes(self) -> int:
+        # Memory held for the filled rows (capacity slack excluded)
+        index = sum(array.nbytes for array in self._index) if self._index else 0
+        columns = sum(column.itemsize for column in self._columns.values()) * self._size
+        return columns + len(self._names) + self._offsets.itemsize * (self._size + 1) + index
+
+    @classmethod
+    def from_users(cls, users: Iterable[User]) -> "UserTable":
+        table = cls()
+        table.extend(users)
+        return table
@@ -0,0 +1,76 @@
+"""
+Docstring for workers
+
+Executors for work that must not run on the Textual event loop (Sprint 2)
+
+Anything slower than a few milliseconds is handed to a pool here and awaited,
+so typing and rendering keep going while it runs. NumPy work goes to threads,
+pure-Python CPU work to processes.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+
+T = TypeVar("T")
+
+# NumPy releases the GIL inside its loops, so catalog work runs well on threads
+THREAD_WORKERS = min(4, os.cpu_count() or 1)
+
+# Pure-Python CPU work (password hashing) holds the GIL, so it needs processes to run in parallel
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", os.cpu_count() or 1))
+
+_thread_pool: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def thread_pool() -> ThreadPoolExecutor:
+    # Created on first use and shared by every screen
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=THREAD_WORKERS, thread_name_prefix="recommender")
+    return _thread_pool
+
+
+async def run_in_thread(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    # Runs func on the thread pool and waits for it without blocking the event loop.
+    # Cancelling the awaiting task abandons the result, the thread finishes on its own.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(thread_pool(), functools.partial(func, *args, **kwargs))
+
+
+def process_context() -> multiprocessing.context.BaseContext:
+    # Workers come from a fork server rather than forking the app itself, which by then is running threads
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def process_pool() -> ProcessPoolExecutor:
+    # Created on first use.
+    # Inside a Textual app call this before App.run(): creating the pool starts
+    # multiprocessing's resource tracker, which needs the real stderr.
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS, mp_context=process_context())
+    return _process_pool
+
+
+async def run_in_process(func: Callable[..., T], *args: Any) -> T:
+    # Runs a module-level func on the process pool, arguments and result are pickled
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(process_pool(), func, *args)
+
+
+def shutdown() -> None:
+    # Drops queued jobs and lets running ones finish in the background
+    global _thread_pool, _process_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
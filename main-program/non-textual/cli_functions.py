@@ -1,61 +1,47 @@
-import time
+import asyncio
+import os
+import sys
 
-def cli_input_home():
-    while True:
-            match(input("Waiting for input: ").lower()):
-                case "help":
-                    print("help command entered")
-                case "wizard":
-                    print("wizard command entered")
-                case "logout":
-                    print("logout command entered")
-                case "exit":
-                    print("Received exit command, closing..")
-                    break
-                case "edit preferences":
-                    print("edit preferences command entered")
-                case "view preferences":
-                    print("view preferences command entered")
-                case _:
-                    print("Unrecognized input")
-                    continue
+# Commands are handled by the same session state machine as the Textual app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "new"))
+import workers
+from session import Services, Session
 
 
-def cli_input_view_preferences():
-    while True:
-            match(input("Type exit to return to the home screen or edit preferences to jump to that screen immediately: ").lower()):
-                # case "help":
-                #     print("help command entered")
-                case "exit":
-                    print("Received exit command, returning to home")
-                    time.sleep(2)
-                    break
-                case "edit preferences":
-                    print("edit preferences command entered")
-                case _:
-                    print("Unrecognized input")
-                    continue
+def cli_input_home(username: str):
+    # Runs the app's screens as a plain terminal loop for an already logged in user
+    try:
+        asyncio.run(run_session(username))
+    finally:
+        workers.shutdown()
 
 
-def cli_input_edit_preferences():
-    while True:
-            match(input("Type exit to return to the home screen: ").lower()):
-                # case "help":
-                #     print("help command entered")
-                case "exit":
-                    print("Received exit command, returning to home")
-                    time.sleep(2)
-                    break
+async def run_session(username: str):
+    services = Services.load()
+    session = Session(services)
+    session.log_in(services.users.get(username))
+    try:
+        while True:
+            try:
+                raw = input("Waiting for input: ")
+            except EOFError:
+                raw = "exit"
+            reply = await session.handle(raw)
+            if reply.quit:
+                print("Received exit command, closing..")
+                break
+            print_lines(reply.lines)
+            if reply.switched and session.screen == "results":
+                # Printed once everything is ranked, so paging works straight away
+                async for page in session.load_results():
+                    pass
+                print_lines(page)
+            elif reply.switched:
+                print_lines(session.intro())
+    finally:
+        services.close()
 
-                case "edit genre":
-                    print("edit genre command entered")
-                case "edit release range":
-                    print("edit release range command entered")
-                case "edit number of players":
-                    print("edit number of players command entered")
-                case "edit length":
-                    print("edit length command entered")
 
-                case _:
-                    print("Unrecognized input")
-                    continue
\ No newline at end of file
+def print_lines(lines: list[str]):
+    for line in lines:
+        print(line)
@@ -16,7 +16,7 @@ def print_home_banner(username: str, APP_TITLE: str) -> None:
 def home_sequence(username: str, APP_TITLE: str):
     print_home_banner(username, APP_TITLE)
 
-    cli_functions.cli_input_home()
+    cli_functions.cli_input_home(username)
 
 
 if __name__ == "__main__":
@@ -1,19 +1,22 @@
-# Can be replaced with a database later
+import os
+import sys
 
-VALID_USERS = {
-    "test": "1234"
-}
+# Accounts live in the same user database as the Textual app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "new"))
+import credentials
+import user_store
 
 
 def authenticated(username: str, password: str) -> bool:
-    if username not in VALID_USERS:
+    user = user_store.default_store().get(username)
+    if user is None:
         print("Username not found in valid users.")
         return False
 
-    if password != VALID_USERS[username]:
+    if not credentials.verify_password(password, user.password):
         print("Wrong password for user.")
         return False
-    
+
     print(f"Successfully authenticated as {username}!")
     return True
 
@@ -26,4 +29,4 @@ def login_sequence() -> str:
         if authenticated(username, password):
             break
 
-    return username
\ No newline at end of file
+    return username